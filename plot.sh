@@ -1,13 +1,4 @@
 # python src/plot.py "data/base_wd"
-# TODO: skip mechanism
+# one process for the whole tree; unchanged directories are skipped (see src/plot.py)
 
-for d1 in ./data/*; do
-    for d2 in "$d1"/*; do
-        if [ -d "$d2" ]; then
-            python src/plot.py "$d2"
-        fi
-    done
-    if [ -d "$d1" ]; then
-        python src/plot.py "$d1"
-    fi
-done
+python src/plot.py ./data "$@"
@@ -1,3 +1,5 @@
 python src/main.py
 # python src/main.py --nNodes=10 --nByzs=3 --path="byz_acc" --repute="acc"
 # python src/main.py --nNodes=10 --nByzs=3 --path="byz_Frobenius_FN_OS" --repute="Frobenius" --op-stop --filter
+# all of the above, concurrently (see src/sweep.py)
+# python src/sweep.py --out data/sweep --grid nNodes=10 nByzs=3 repute=acc,Frobenius op-stop=false,true filter=false,true seed=1
@@ -0,0 +1,136 @@
+"""
+Robust aggregation
+
+# Rules work on stacked, flattened weights (N x |theta|) which are never materialized at once:
+# every rule walks the parameters in chunks of `chunk` elements (N x chunk at a time).
+# Ref. https://arxiv.org/abs/1703.02757 (Krum), https://arxiv.org/abs/1803.01498 (trimmed mean, median)
+"""
+import torch
+
+
+CHUNK = 1 << 16
+
+
+def _chunks(weightses, chunk=CHUNK):
+    for name in weightses[0].keys():
+        flats = [w[name].data.reshape(-1) for w in weightses]
+        numel = flats[0].numel()
+        for start in range(0, numel, chunk):
+            end = min(start + chunk, numel)
+            yield name, start, end, torch.stack([f[start:end] for f in flats])
+
+
+def _reduce(weightses, fn, chunk=CHUNK):
+    res = dict()
+    for name, value in weightses[0].items():  # filled flat, in logical (NCHW) order
+        res[name] = torch.empty(value.shape, dtype=value.dtype, device=value.device)
+
+    for name, start, end, X in _chunks(weightses, chunk):
+        res[name].view(-1)[start:end] = fn(X)
+
+    for name, value in weightses[0].items():  # back to e.g. channels-last
+        if not value.is_contiguous():
+            res[name] = torch.empty_like(value).copy_(res[name])
+
+    return res
+
+
+"""distance
+# squared L2, accumulated in float64
+"""
+
+
+def pairwise_distances(weightses: list, chunk=CHUNK):
+    n = len(weightses)
+    D = torch.zeros(n, n, dtype=torch.float64)
+
+    for _, _, _, X in _chunks(weightses, chunk):
+        X = X.double()
+        sq = (X * X).sum(1)
+        D += sq.unsqueeze(1) + sq.unsqueeze(0) - 2 * X.mm(X.t())
+
+    D.clamp_(min=0)
+    D.fill_diagonal_(0)
+    return D
+
+
+def distances_to(weightses: list, base: dict, chunk=CHUNK):
+    d = torch.zeros(len(weightses), dtype=torch.float64)
+
+    for name, start, end, X in _chunks(weightses, chunk):
+        diff = X.double() - base[name].data.reshape(-1)[start:end].double()
+        d += (diff * diff).sum(1)
+
+    return d
+
+
+def extend_distances(D, weightses: list, new: dict, chunk=CHUNK):
+    # D of `weightses` -> D of `weightses + [new]`, O(N |theta|) instead of O(N^2 |theta|)
+    d = distances_to(weightses, new, chunk)
+
+    n = D.size(0)
+    E = torch.zeros(n + 1, n + 1, dtype=torch.float64)
+    E[:n, :n] = D
+    E[n, :n] = d
+    E[:n, n] = d
+    return E
+
+
+"""rules
+# TBA
+"""
+
+
+def mean(weightses: list, chunk=CHUNK):
+    return _reduce(weightses, lambda X: X.mean(0), chunk)
+
+
+def krum(weightses: list, f: int, m: int = 1, distances=None, chunk=CHUNK):
+    # Multi-Krum: average of the `m` proposals closest to their n - f - 2 neighbors
+    n = len(weightses)
+    if distances is None:
+        distances = pairwise_distances(weightses, chunk)
+
+    k = min(max(n - f - 2, 1), n - 1)
+    if k <= 0:  # single proposal
+        return mean(weightses, chunk), [0]
+
+    scores = distances.sort(dim=1)[0][:, 1:k + 1].sum(1)  # [:, 0] is herself
+    selected = scores.argsort()[:max(1, min(m, n))].tolist()
+
+    return mean([weightses[i] for i in selected], chunk), selected
+
+
+def trimmed_mean(weightses: list, b: int, chunk=CHUNK):
+    # coordinate-wise, drop the `b` largest and `b` smallest
+    n = len(weightses)
+    b = min(b, (n - 1) // 2)
+    if b == 0:
+        return mean(weightses, chunk)
+    return _reduce(weightses, lambda X: X.sort(0)[0][b:n - b].mean(0), chunk)
+
+
+def median(weightses: list, chunk=CHUNK):
+    # coordinate-wise
+    return _reduce(weightses, lambda X: X.median(0)[0], chunk)
+
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+
+    honest = {'conv': torch.randn(64, 32, 3, 3), 'fc': torch.randn(10, 64)}
+    weightses = [{k: v + 0.01 * torch.randn_like(v) for k, v in honest.items()} for _ in range(7)]
+    weightses += [{k: torch.rand_like(v) * 10 for k, v in honest.items()} for _ in range(3)]  # Byzantine
+
+    def err(w):
+        return max((w[k] - honest[k]).abs().max().item() for k in honest)
+
+    print('mean\t', err(mean(weightses)))
+    w, selected = krum(weightses, f=3, m=4, chunk=1000)
+    print('krum\t', err(w), selected)
+    print('trimmed\t', err(trimmed_mean(weightses, b=3, chunk=1000)))
+    print('median\t', err(median(weightses, chunk=1000)))
+
+    D = pairwise_distances(weightses[:-1], chunk=1000)
+    E = extend_distances(D, weightses[:-1], weightses[-1], chunk=1000)
+    print((E - pairwise_distances(weightses)).abs().max().item())
@@ -0,0 +1,197 @@
+"""
+Approximate nearest-neighbor index over sketches (see `sketch.Sketcher`)
+
+# IVF (inverted file): a k-means coarse quantizer splits the vectors into `nlist` lists.
+# A query scans the `nprobe` lists of the nearest centroids only,
+#   O(nlist dim + nprobe n / nlist dim) with nlist ~ sqrt(n)
+# Insertion assigns to the nearest centroid, removal is O(1).
+# The quantizer is (re)trained after `min_train`, then 4x as many insertions as it was trained on
+# (counting insertions, not size, so a sliding window, e.g. of live proposals, is retrained too);
+# until then, it is a flat scan.
+# Ref. https://arxiv.org/abs/1702.08734 (Faiss)
+"""
+import math
+
+import torch
+
+
+class IVFIndex:
+    def __init__(self, dim, nprobe=4, min_train=256, seed=0):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_train = min_train  # flat scan below
+        self.seed = seed
+
+        # storage
+        self._vectors = torch.zeros(64, dim)
+        self._free = list(range(63, -1, -1))
+        self._slot = dict()  # key -> slot
+        self._keys = dict()  # slot -> key
+
+        # quantizer
+        self.centroids = None
+        self._lists = []  # [set of slots]
+        self._assign = dict()  # slot -> list
+        self._trained_at = 0
+        self._added = 0  # insertions since
+
+    def __len__(self):
+        return len(self._slot)
+
+    def __contains__(self, key):
+        return key in self._slot
+
+    """insert and remove
+    # TBA
+    """
+
+    def add(self, key, vector):
+        if key in self._slot:
+            self.remove(key)
+
+        if not self._free:  # grow
+            n = self._vectors.size(0)
+            self._vectors = torch.cat((self._vectors, torch.zeros(n, self.dim)))
+            self._free = list(range(2 * n - 1, n - 1, -1))
+
+        slot = self._free.pop()
+        self._vectors[slot] = vector
+        self._slot[key] = slot
+        self._keys[slot] = key
+
+        if self.centroids is not None:
+            self._put(slot, self._nearest(vector.unsqueeze(0), 1)[0, 0].item())
+
+        self._added += 1
+        if (len(self._slot) >= self.min_train) and (self._added >= max(self.min_train, 4 * self._trained_at)):
+            self.train()
+
+    def remove(self, key):
+        slot = self._slot.pop(key, None)
+        if slot is None:
+            return False
+
+        del self._keys[slot]
+        self._free.append(slot)
+        if slot in self._assign:
+            self._lists[self._assign.pop(slot)].discard(slot)
+
+        return True
+
+    def _put(self, slot, lst):
+        self._assign[slot] = lst
+        self._lists[lst].add(slot)
+
+    """quantizer
+    # TBA
+    """
+
+    def _nearest(self, X, k):
+        # k nearest centroids of each row of X
+        d = (X * X).sum(1, keepdim=True) - 2 * X.mm(self.centroids.t()) + (self.centroids ** 2).sum(1)
+        return d.topk(min(k, self.centroids.size(0)), dim=1, largest=False)[1]
+
+    def train(self, iters=10):
+        slots = torch.tensor(sorted(self._keys.keys()), dtype=torch.long)
+        n = len(slots)
+        nlist = max(1, int(math.sqrt(n)))
+
+        g = torch.Generator()
+        g.manual_seed(self.seed + n)
+
+        X = self._vectors[slots]
+        sample = X[torch.randperm(n, generator=g)[:min(n, 64 * nlist)]]
+        self.centroids = sample[torch.randperm(sample.size(0), generator=g)[:nlist]].clone()
+
+        for _ in range(iters):  # k-means on the sample
+            assign = self._nearest(sample, 1)[:, 0]
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    self.centroids[c] = members.mean(0)
+
+        self._lists = [set() for _ in range(nlist)]
+        self._assign = dict()
+        for slot, lst in zip(slots.tolist(), self._nearest(X, 1)[:, 0].tolist()):
+            self._put(slot, lst)
+
+        self._trained_at = n
+        self._added = 0
+
+    """search
+    # TBA
+    """
+
+    def search(self, query, count, nprobe=None, where=None):
+        # returns [(distance, key)], nearest first
+        # where: optional predicate on keys
+        if not self._slot:
+            return []
+
+        def _filter(slots):
+            if where is None:
+                return list(slots)
+            return [s for s in slots if where(self._keys[s])]
+
+        if self.centroids is None:
+            slots = _filter(self._keys.keys())
+        else:
+            nprobe = nprobe or self.nprobe
+            order = self._nearest(query.unsqueeze(0), self.centroids.size(0))[0].tolist()
+
+            slots, probed = [], 0
+            for lst in order:  # probe more (non-empty) lists until enough
+                members = _filter(self._lists[lst])
+                if members:
+                    slots += members
+                    probed += 1
+                if (probed >= nprobe) and (len(slots) >= count):
+                    break
+
+        if not slots:
+            return []
+
+        d = (self._vectors[slots] - query).norm(dim=1)
+        top = d.topk(min(count, len(slots)), largest=False)
+
+        return [(dist, self._keys[slots[i]]) for dist, i in zip(top[0].tolist(), top[1].tolist())]
+
+
+if __name__ == "__main__":
+    import time
+
+    torch.manual_seed(0)
+    dim = 1024
+
+    centers = torch.randn(32, dim) * 10
+    index = IVFIndex(dim)
+
+    start = time.time()
+    data = dict()
+    for key in range(20000):
+        v = centers[key % 32] + torch.randn(dim)
+        data[key] = v
+        index.add(key, v)
+    for key in torch.randperm(20000)[:10000].tolist():  # age out
+        index.remove(key)
+        del data[key]
+    print('build', len(index), time.time() - start)
+
+    keys = list(data.keys())
+    X = torch.stack([data[k] for k in keys])
+
+    hits, t_ann, t_flat = 0, 0., 0.
+    for _ in range(100):
+        q = centers[torch.randint(32, (1,)).item()] + torch.randn(dim)
+
+        start = time.time()
+        res = set(k for _, k in index.search(q, 10))
+        t_ann += time.time() - start
+
+        start = time.time()
+        exact = set(keys[i] for i in (X - q).norm(dim=1).topk(10, largest=False)[1].tolist())
+        t_flat += time.time() - start
+
+        hits += len(res & exact)
+
+    print('recall@10 %.3f, ann %.4fs, flat %.4fs' % (hits / 1000, t_ann / 100, t_flat / 100))
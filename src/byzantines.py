@@ -25,8 +25,15 @@ class Byzantine_Random(Client):
 
         weights_dict = self.get_weights()
 
+        generator = None
+        if self.streams is not None:  # see `rng.Streams`
+            generator = self.streams.torch('byzantine', self._id, epoch)
+
         for name, value in weights_dict.items():
-            rand_weights[name] = torch.rand_like(value)
+            if generator is None:
+                rand_weights[name] = torch.rand_like(value)
+            else:
+                rand_weights[name] = torch.rand(value.shape, generator=generator, dtype=value.dtype).to(value.device)
 
         self.set_weights(rand_weights)
 
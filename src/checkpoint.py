@@ -0,0 +1,305 @@
+"""
+Resumable snapshots of a whole simulation
+
+# Written every `every` rounds, incrementally:
+#   clients/<i>-<round>.pt  a client (net incl. BN buffers, optimizer, test result, compressor replicas),
+#                           only if she was activated since her last snapshot
+#   dag-<round>.pt          nodes added since the last snapshot (the DAG is append-only)
+#   dag-<round>.weights     their held weights, `weights.to_bytes` blobs at aligned offsets;
+#                           memory-mapped (copy-on-write) on restore, not read into tensors
+#   sim-<round>.pt          round, RNG states, latest/last nodes, index, network, stats,
+#                           and which files above make up this snapshot
+#   latest.json             points to the last complete `sim-<round>.pt` (written last, atomically)
+# State is copied in the caller's thread, files are written in a background thread.
+# On restore, the DAG is rebuilt by re-adding its nodes in order, so tips, their order
+# and cumulative weights are the same as before.
+"""
+import os
+import io
+import json
+import copy
+import mmap
+import random
+import inspect
+import threading
+
+import numpy as np
+import torch
+
+from dag import Node, DAG
+from codec import Encoded
+import weights as wire
+
+
+_WEIGHTS_ONLY = {'weights_only': False} if 'weights_only' in inspect.signature(torch.load).parameters else {}
+
+
+def _load(f):
+    return torch.load(f, **_WEIGHTS_ONLY)
+
+
+def _write(path, obj):
+    tmp = path + '.tmp'
+    if isinstance(obj, bytes):
+        with open(tmp, 'wb') as f:
+            f.write(obj)
+    else:
+        torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+def rng_states(cuda=False):
+    states = {
+        'random': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()}
+    if cuda:
+        states['cuda'] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def _write_weights(path, records):
+    # held weights of `records` into one file; each record's 'weights' becomes (offset, nbytes)
+    tmp = path + '.tmp'
+    offset = 0
+    with open(tmp, 'wb') as f:
+        for rec in records:
+            if rec['weights'] is None:
+                continue
+            pad = -offset % mmap.PAGESIZE  # aligned tensors when mapped
+            f.write(b'\0' * pad)
+            blob = wire.to_bytes(rec['weights'])
+            f.write(blob)
+            rec['weights'] = (offset + pad, len(blob))
+            offset += pad + len(blob)
+    os.replace(tmp, path)
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+def set_rng_states(states):
+    random.setstate(states['random'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if 'cuda' in states:
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+
+class Checkpointer:
+    def __init__(self, path, every=10, background=True):
+        self.path = path
+        self.every = every
+        self.background = background
+
+        os.makedirs(os.path.join(path, 'clients'), exist_ok=True)
+
+        self._thread = None
+        self._error = None
+
+        # what the last snapshot is made of
+        self._saved = 0  # nodes, in insertion order
+        self._dags = []  # rounds of dag-<round>.pt
+        self._clients = dict()  # client -> round of her latest file
+
+    def due(self, epoch):
+        return (self.every > 0) and (epoch % self.every == 0)
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    """save
+    # TBA
+    """
+
+    @staticmethod
+    def _record(node):
+        encoded = node.encoded
+        if encoded is not None:
+            encoded = {
+                'blob': encoded.blob, 'entries': encoded.entries, 'depth': encoded.depth,
+                'raw_nbytes': encoded.raw_nbytes,
+                'reference': None if encoded.reference is None else encoded.reference.get_id()}
+
+        return {
+            'id': node.get_id(),
+            'parents': [p.get_id() for p in node.get_parents()],
+            'creator': node.creator,
+            'round': node.round,
+            'weight': node.weight,
+            'weights': node.weights,  # immutable snapshots, or None
+            'encoded': encoded,
+            'sketches': getattr(node, 'sketches', None)}
+
+    @staticmethod
+    def _client(client, compressor=None):
+        state = {
+            'net': {name: value.detach().clone() for name, value in client.net.state_dict().items()},
+            'optimizer': copy.deepcopy(client.optimizer.state_dict()),
+            'result': client.result,  # (loss, err)
+            'logs': client.log_offsets(),
+            'step_time': client.step_time}
+        if compressor is not None:  # sender -> replica
+            state['replicas'] = {sender: {name: value.clone() for name, value in replica.items()}
+                                 for sender, replica in compressor.replicas_of(client._id).items()}
+        return state
+
+    def save(self, epoch, clients, dirty, dag, latest_nodes, last_nodes,
+             codec=None, compressor=None, index=None, network=None, byzantines=(), cuda=False):
+        # clients: `ClientPool` (or list), dirty: clients changed since the last snapshot
+        self.wait()
+
+        # copies, in this thread
+        order = dag._order
+        records = [self._record(node) for node in order[self._saved:]]
+        states = {i: self._client(clients[i], compressor) for i in sorted(set(dirty))}
+
+        sim = {
+            'epoch': epoch,
+            'next_id': Node._id,
+            'rng': rng_states(cuda),
+            'latest': [n.get_id() for n in latest_nodes],
+            'last': {a: n.get_id() for a, n in last_nodes.items()},
+            'held': [n.get_id() for n in order if n.weights is not None],
+            'byzantines': list(byzantines),
+            'index': index,
+            'network': network,
+            'codec': None if codec is None else dict(codec.stats),
+            'compressor': None if compressor is None else {
+                'stats': dict(compressor.stats), 'last_nbytes': compressor.last_nbytes}}
+        dags = self._dags + ([epoch] if records else [])
+        files = dict(self._clients)
+        files.update({i: epoch for i in states})
+        sim['dags'], sim['clients'] = dags, files
+
+        buf = io.BytesIO()
+        torch.save(sim, buf)  # index and network change in the next rounds
+        sim = buf.getvalue()
+
+        superseded = [(i, r) for i, r in self._clients.items() if i in states]
+        self._saved, self._dags, self._clients = len(order), dags, files
+
+        def _run():
+            try:
+                if records:
+                    if any(rec['weights'] is not None for rec in records):
+                        _write_weights(os.path.join(self.path, 'dag-%d.weights' % (epoch)), records)
+                    _write(os.path.join(self.path, 'dag-%d.pt' % (epoch)), records)
+                for i, state in states.items():
+                    _write(os.path.join(self.path, 'clients', '%d-%d.pt' % (i, epoch)), state)
+                _write(os.path.join(self.path, 'sim-%d.pt' % (epoch)), sim)
+                _write(os.path.join(self.path, 'latest.json'), json.dumps({'epoch': epoch}).encode())
+
+                # the previous snapshot is no longer needed
+                for i, r in superseded:
+                    os.remove(os.path.join(self.path, 'clients', '%d-%d.pt' % (i, r)))
+                for name in os.listdir(self.path):
+                    if name.startswith('sim-') and name != 'sim-%d.pt' % (epoch):
+                        os.remove(os.path.join(self.path, name))
+            except Exception as e:
+                self._error = e
+
+        if self.background:
+            self._thread = threading.Thread(target=_run, daemon=False)
+            self._thread.start()
+        else:
+            _run()
+            self.wait()
+
+    """restore
+    # TBA
+    """
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path, 'latest.json'))
+
+    def restore(self, clients, codec=None, compressor=None, store=None):
+        # returns a dict of the restored state: epoch, dag, latest_nodes, last_nodes, index, network, byzantines,
+        # clients (those with a state; the logs of the others are to be truncated, see `Client.truncate_logs`)
+        with open(os.path.join(self.path, 'latest.json'), 'r') as f:
+            epoch = json.load(f)['epoch']
+        with open(os.path.join(self.path, 'sim-%d.pt' % (epoch)), 'rb') as f:
+            sim = _load(f)
+
+        # DAG, in insertion order
+        held = set(sim['held'])
+        nodes, dag = dict(), None
+        for r in sim['dags']:
+            with open(os.path.join(self.path, 'dag-%d.pt' % (r)), 'rb') as f:
+                records = _load(f)
+            blobs = None
+            if os.path.isfile(os.path.join(self.path, 'dag-%d.weights' % (r))):
+                blobs = memoryview(_map(os.path.join(self.path, 'dag-%d.weights' % (r))))
+            for rec in records:
+                weights = rec['weights'] if rec['id'] in held else None
+                if isinstance(weights, tuple):  # (offset, nbytes), zero-copy
+                    weights = wire.from_buffer(blobs[weights[0]:weights[0] + weights[1]]).to_dict()
+                node = Node(
+                    weights=weights,
+                    parents=[nodes[p] for p in rec['parents']],
+                    _id=rec['id'],
+                    creator=rec['creator'],
+                    _round=rec['round'],
+                    weight=rec['weight'])
+                if rec['encoded'] is not None:
+                    e = rec['encoded']
+                    node.encoded = Encoded(
+                        e['blob'], e['entries'], reference=nodes.get(e['reference']),
+                        depth=e['depth'], raw_nbytes=e['raw_nbytes'])
+                    node.codec = codec
+                if rec['sketches'] is not None:
+                    node.sketches = rec['sketches']
+                if (store is not None) and (rec['id'] in store.index):
+                    node.store = store
+                nodes[rec['id']] = node
+
+                if dag is None:
+                    dag = DAG(node)  # genesis
+                else:
+                    dag.add(node)
+        Node._id = sim['next_id']
+
+        if store is not None:  # nodes appended after the snapshot
+            store.truncate(sim['next_id'])
+        if codec is not None:
+            codec.stats = dict(sim['codec'])
+        if compressor is not None:
+            compressor.stats = dict(sim['compressor']['stats'])
+            compressor.last_nbytes = sim['compressor']['last_nbytes']
+            compressor.replicas = dict()
+
+        # clients
+        for i, r in sim['clients'].items():
+            with open(os.path.join(self.path, 'clients', '%d-%d.pt' % (i, r)), 'rb') as f:
+                state = _load(f)
+            client = clients[i]
+            client.net.load_state_dict(state['net'])
+            client.optimizer.load_state_dict(state['optimizer'])
+            client.invalidate(buffers=True)
+            client.result, client.step_time = state.get('result'), state['step_time']  # else, retested
+            if state.get('logs') is not None:
+                client.truncate_logs(state['logs'])
+            if compressor is not None:  # a single 'replica', of earlier snapshots, is of no sender: dropped
+                for sender, replica in state.get('replicas', dict()).items():
+                    compressor.replicas[(client._id, sender)] = replica
+
+        self._saved, self._dags, self._clients = len(dag._order), list(sim['dags']), dict(sim['clients'])
+
+        set_rng_states(sim['rng'])  # last
+
+        return {
+            'epoch': epoch,
+            'dag': dag,
+            'latest_nodes': [nodes[_id] for _id in sim['latest']],
+            'last_nodes': {a: nodes[_id] for a, _id in sim['last'].items()},
+            'index': sim['index'],
+            'network': sim['network'],
+            'byzantines': sim['byzantines'],
+            'clients': sorted(sim['clients'])}
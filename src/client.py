@@ -7,16 +7,99 @@ from torch.autograd import Variable
 from torch.utils.data import DataLoader
 
 import os
+import time
+import threading
 import numpy as np
 
+from net import autocast, to_layout
+from dag import next_version
+import inference
+
+
+"""Metrics
+# Test results keyed on what determines them:
+#   (weights version, BN buffers version, dataset id) -> (loss, err)
+# Versions are content ids (see `dag.next_version`): new on `set_weights` and `train`,
+# or the proposal's own when a `Node` is loaded, so the same node tested on the same data
+# with the same BN statistics (e.g. `tmp_client` and the `evaluator` replicas) is tested once.
+"""
+
+
+def dataset_id(dataset):
+    # stable while the dataset lives, unlike `id`
+    _id = getattr(dataset, '_metrics_id', None)
+    if _id is None:
+        _id = next_version()
+        try:
+            dataset._metrics_id = _id
+        except AttributeError:
+            return ('id', id(dataset))
+    return _id
+
+
+class Metrics:
+    def __init__(self, size=1 << 16):
+        self.size = size
+        self.entries = dict()
+        self.hits, self.misses = 0, 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            res = self.entries.get(key)
+            if res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return res
+
+    def put(self, key, value):
+        with self._lock:
+            if len(self.entries) >= self.size:  # oldest first
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = value
+
+
+"""Augmentation
+# On batches, drawing from an explicit generator (see `rng.Streams`), instead of
+# torchvision's random transforms which draw from the global RNG per sample.
+"""
+
+
+class Augment:
+    # RandomCrop(size, padding) + RandomHorizontalFlip, on normalized (B, C, H, W) batches
+    def __init__(self, padding=4, fill=None, flip=True):
+        # fill: per-channel value of padding, e.g. black once normalized: -mean / std
+        self.padding = padding
+        self.fill = fill
+        self.flip = flip
+
+    def __call__(self, data, generator=None):
+        B, C, H, W = data.size()
+        p = self.padding
+
+        padded = data.new_empty((B, C, H + 2 * p, W + 2 * p))
+        padded[:] = torch.as_tensor(self.fill if self.fill is not None else 0., dtype=data.dtype).view(-1, 1, 1)
+        padded[:, :, p:p + H, p:p + W] = data
+
+        ox, oy = torch.randint(2 * p + 1, (2, B), generator=generator)
+        rows = (oy.view(B, 1) + torch.arange(H)).view(B, 1, H, 1)
+        cols = (ox.view(B, 1) + torch.arange(W)).view(B, 1, 1, W)
+        if self.flip:  # mirrored columns
+            flips = torch.rand(B, generator=generator) < 0.5
+            cols = torch.where(flips.view(B, 1, 1, 1), cols.flip(-1), cols)
+
+        return padded[torch.arange(B).view(B, 1, 1, 1), torch.arange(C).view(1, C, 1, 1), rows, cols]
+
 
 class Client:
     _id = 0
+    metrics = Metrics()  # shared by all clients
 
     def __init__(self,
                  args,
                  net, trainset=None, testset=None,
-                 _id=None, log=False):
+                 _id=None, log=False, streams=None, augment=None):
 
         # id
         if _id != None:
@@ -30,8 +113,9 @@ class Client:
 
         # logger
         if log:
-            self.trainF = open(os.path.join(self.path, 'train.csv'), 'w')
-            self.testF = open(os.path.join(self.path, 'test.csv'), 'w')
+            mode = 'a' if getattr(args, 'resume', False) else 'w'
+            self.trainF = open(os.path.join(self.path, 'train.csv'), mode)
+            self.testF = open(os.path.join(self.path, 'test.csv'), mode)
         else:
             self.trainF, self.testF = None, None
 
@@ -50,6 +134,7 @@ class Client:
                                           batch_size=self.batch_size, shuffle=True, **kwargs)
         self.testset = testset
         if self.testset is not None:
+            dataset_id(self.testset)
             # dset.CIFAR10(root='cifar', train=False, download=True, transform=testTransform)
             self.testLoader = DataLoader(self.testset,
                                          batch_size=self.batch_size, shuffle=False, **kwargs)
@@ -58,7 +143,9 @@ class Client:
         # TBA
         """
         # DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10)
-        self.net = net
+        self.precision = getattr(args, 'precision', 'fp32')
+        self.channels_last = getattr(args, 'channels_last', False)
+        self.net = to_layout(net, self.channels_last)
 
         if self.cuda:
             if torch.cuda.device_count() > 1:
@@ -81,7 +168,17 @@ class Client:
         """Metadata
         # (cache) saving latest acc. to reduce computation
         """
-        self.acc = None
+        self.version = next_version()  # of the weights (parameters)
+        self.buffers = next_version()  # of the BN statistics
+        self.step_time = None  # sec. per training step, latest epoch
+
+        # per-(client, round) randomness, see `rng.Streams`; None: the global RNGs
+        self.streams = streams
+        self.augment = augment  # e.g. `Augment`, applied to training batches
+
+        # compiled eval. graph, see `compile_inference`
+        self.inference, self._graph = None, None
+        self._stale = False  # weights changed since the last fold
 
     """ML
     # TBA
@@ -106,9 +203,29 @@ class Client:
         if os.path.isfile(loca):
             # print(">>> Load weights:", loca)
             self.net = torch.load(loca)
+            self.invalidate(buffers=True)
+            if self.inference is not None:
+                self.compile_inference()
         # else:
             # print(">>> No pre-trained weights")
 
+    def log_offsets(self):
+        # (train.csv, test.csv) sizes, see `truncate_logs`; None if not logging
+        if self.trainF is None:
+            return None
+        self.trainF.flush()
+        self.testF.flush()
+        return (self.trainF.tell(), self.testF.tell())
+
+    def truncate_logs(self, offsets=(0, 0)):
+        # drop what was logged after `offsets` (e.g. rounds after the snapshot resumed from)
+        if self.trainF is None:
+            return
+        for f, offset in zip((self.trainF, self.testF), offsets):
+            f.flush()
+            f.truncate(offset)
+            f.seek(offset)
+
     def set_dataset(self, trainset=None, testset=None, batch_size=None):
         assert((trainset or testset) != None)
         batch_size = self.batch_size or batch_size
@@ -123,27 +240,49 @@ class Client:
                                           batch_size=batch_size, shuffle=True, **kwargs)
         self.testset = testset
         if self.testset is not None:
+            dataset_id(self.testset)
             # dset.CIFAR10(root='cifar', train=False, download=True, transform=testTransform),
             self.testLoader = DataLoader(self.testset,
                                          batch_size=batch_size, shuffle=False, **kwargs)
 
     def train(self, epoch, show=True, log=True):
+        # shuffling and augmentation draw from this (client, round)'s own generator, not the global RNGs
+        generator = None
+        if self.streams is not None:
+            generator = self.streams.torch('train', self._id, epoch)
+        self._train(epoch, generator, show=show, log=log)
+
+    def _loader(self, generator=None):
+        if generator is None:
+            return self.trainLoader
+        kwargs = {'num_workers': 1, 'pin_memory': True} if self.cuda else {}
+        return DataLoader(self.trainset, batch_size=self.trainLoader.batch_size, shuffle=True,
+                          generator=generator, **kwargs)  # also seeds its workers
+
+    def _train(self, epoch, generator=None, show=True, log=True):
         # assert((not show) or (self.trainF is None))
 
         self.net.train()
 
+        loader = self._loader(generator)
         nProcessed = 0
-        nTrain = len(self.trainLoader.dataset)
+        nTrain = len(loader.dataset)
+
+        start = time.time()
 
-        for batch_idx, (data, target) in enumerate(self.trainLoader):
+        for batch_idx, (data, target) in enumerate(loader):
 
+            if self.augment is not None:
+                data = self.augment(data, generator)
             if self.cuda:
                 data, target = data.cuda(), target.cuda()
+            data = to_layout(data, self.channels_last)
 
             data, target = Variable(data), Variable(target)
             self.optimizer.zero_grad()
-            output = self.net(data)
-            loss = F.nll_loss(output, target)
+            with autocast(self.precision, self.cuda):
+                output = self.net(data).float()
+                loss = F.nll_loss(output, target)
             loss.backward()
             self.optimizer.step()
 
@@ -151,11 +290,11 @@ class Client:
             pred = output.data.max(1)[1]  # get the index of the max log-probability
             incorrect = pred.ne(target.data).cpu().sum()
             err = 100. * incorrect / len(data)
-            partialEpoch = epoch + batch_idx / len(self.trainLoader) - 1
+            partialEpoch = epoch + batch_idx / len(loader) - 1
 
             if show:
                 print('Train Epoch: {:.2f} [{}/{} ({:.0f}%)]\tLoss: {:.6f}\tError: {:.6f}'.format(
-                    partialEpoch, nProcessed, nTrain, 100. * batch_idx / len(self.trainLoader),
+                    partialEpoch, nProcessed, nTrain, 100. * batch_idx / len(loader),
                     loss.item(), err))
 
             if (self.trainF is not None) and log:
@@ -163,29 +302,107 @@ class Client:
                     partialEpoch, loss.item(), err))
                 self.trainF.flush()
 
+        self.step_time = (time.time() - start) / max(len(loader), 1)
+        self.invalidate(buffers=True)
+
+    def compile_inference(self):
+        # eval. through a BN-folded graph, captured once; weights are refreshed in place
+        net = self.net.module if isinstance(self.net, nn.DataParallel) else self.net
+        self.inference, self._graph = inference.compile(net)
+        self._stale = False
+
+    def _eval_net(self):
+        if self.inference is None:
+            return self.net
+        if self._stale:
+            self.inference.load(self.net.module if isinstance(self.net, nn.DataParallel) else self.net)
+            self._stale = False
+        return self._graph
+
+    """cache
+    # see `Metrics`
+    """
+
+    def invalidate(self, version=None, buffers=False):
+        # weights changed: a new version (or `version`, the content id of the weights loaded)
+        # buffers: BN statistics changed too (e.g. trained)
+        self.version = version if version is not None else next_version()
+        if buffers:
+            self.buffers = next_version()
+        self._stale = True
+
+    def _key(self, version=None):
+        return (self.version if version is None else version, self.buffers, dataset_id(self.testset))
+
+    @property
+    def result(self):
+        # (loss, err) of the current weights on her own test set; None if not tested since they changed
+        return Client.metrics.entries.get(self._key()) if self.testset is not None else None
+
+    @result.setter
+    def result(self, result):
+        # e.g. restored with the weights, see `checkpoint`
+        if (result is not None) and (self.testset is not None):
+            Client.metrics.put(self._key(), tuple(result))
+
+    @property
+    def acc(self):
+        res = self.result
+        return None if res is None else 100. - res[1]
+
+    def score(self, node, epoch, show=False, log=False):
+        # acc. of `node`'s weights (a `Node`, or a `Client`) on this client's test set and BN statistics
+        res = Client.metrics.get(self._key(node.version))
+        if res is not None:
+            self._log_test(epoch, res[0], res[1], show, log)
+            return 100. - res[1]
+
+        self.set_weights(node.get_weights(), version=node.version)
+        return 100. - self._test(epoch, show=show, log=log)
+
+    def _log_test(self, epoch, test_loss, err, show, log):
+        if show:
+            print('\nTest set: Average loss: {:.4f}, Error: {:.0f}%\n'.format(test_loss, err))
+
+        if (self.testF is not None) and log:
+            self.testF.write('{},{},{}\n'.format(
+                epoch, test_loss, err))
+            self.testF.flush()
+
     def test(self, epoch, show=True, log=True):
+        res = Client.metrics.get(self._key())
+        if res is not None:
+            self._log_test(epoch, res[0], res[1], show, log)
+            return res[1]
+        return self._test(epoch, show=show, log=log)
+
+    def _test(self, epoch, show=True, log=True):
         # assert((not show) or (self.testF is None))
 
+        key, loader = self._key(), self.testLoader  # of what is tested, before `testset` may change
+
         self.net.eval()  # tells net to do evaluating
+        net = self._eval_net()
 
         test_loss = 0
         incorrect = 0
 
-        for data, target in self.testLoader:
+        for data, target in loader:
 
             if self.cuda:
                 data, target = data.cuda(), target.cuda()
+            data = to_layout(data, self.channels_last)
 
-            with torch.no_grad():
+            with torch.no_grad(), autocast(self.precision, self.cuda):
                 # data, target = Variable(data), Variable(target)
-                output = self.net(data)
+                output = net(data).float()
                 test_loss += F.nll_loss(output, target).item()
                 pred = output.data.max(1)[1]  # get the index of the max log-probability
                 incorrect += pred.ne(target.data).cpu().sum()
 
         test_loss = test_loss
-        test_loss /= len(self.testLoader)  # loss function already averages over batch size
-        nTotal = len(self.testLoader.dataset)
+        test_loss /= len(loader)  # loss function already averages over batch size
+        nTotal = len(loader.dataset)
         err = 100. * incorrect / nTotal
 
         if show:
@@ -197,7 +414,7 @@ class Client:
                 epoch, test_loss, err))
             self.testF.flush()
 
-        self.acc = 100. - err.item()
+        Client.metrics.put(key, (test_loss, err.item()))
 
         return err.item()
 
@@ -229,20 +446,22 @@ class Client:
         dict_weights = dict()
 
         for name, param in dict_params.items():
-            dict_weights[name] = param.data
+            dict_weights[name] = param.detach()  # shares the parameter's version counter, see `merkle`
 
         return dict_weights
 
-    def set_weights(self, new_weights: dict):
+    def set_weights(self, new_weights: dict, version=None):
+        # version: content id of `new_weights` (e.g. `Node.version`), if known
         net_state_dict = self.net.state_dict()
         dict_params = self._get_params()
 
         for name, new_weight in new_weights.items():
             if name in dict_params:
-                dict_params[name].data.copy_(new_weight.data)
+                dict_params[name].detach().copy_(new_weight.detach())
 
         net_state_dict.update(dict_params)
         self.net.load_state_dict(net_state_dict)
+        self.invalidate(version)
 
     def get_average_weights(self, weightses: list, repus: list):
         dict_avg_weights = dict()
@@ -295,6 +514,36 @@ class Client:
     """
 
 
+class ClientPool:
+    """
+    # A list of clients, each created by `factory(i)` on first access only
+    # e.g. clients never activated cost nothing
+    """
+
+    def __init__(self, factory, n):
+        self.factory = factory
+        self._clients = [None] * n
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __getitem__(self, i):
+        if self._clients[i] is None:
+            self._clients[i] = self.factory(i)
+        return self._clients[i]
+
+    def __iter__(self):
+        for i in range(len(self._clients)):
+            yield self[i]
+
+    def is_materialized(self, i):
+        return self._clients[i] is not None
+
+    def materialized(self):
+        # {i: client} created so far
+        return {i: c for i, c in enumerate(self._clients) if c is not None}
+
+
 if __name__ == "__main__":
     import argparse
 
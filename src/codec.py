@@ -0,0 +1,187 @@
+"""
+Storage codec for `dag.Node` weights
+
+# delta: against a reference node (a parent or the creator's previous node)
+# quantization: fp32 (none), fp16, int8 (per-tensor symmetric scale)
+# entropy coding: zlib or lzma (stdlib only)
+# Deltas are taken against the *decoded* reference (closed loop), so errors do not accumulate along a chain.
+"""
+import zlib
+import lzma
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+class Encoded:
+    def __init__(self, blob, entries, reference=None, depth=0, raw_nbytes=0):
+        self.blob = blob
+        self.entries = entries  # [(name, shape, scale, offset, nbytes)]
+        self.reference = reference  # Node or None (key frame)
+        self.depth = depth  # length of the reference chain
+        self.raw_nbytes = raw_nbytes
+
+    @property
+    def nbytes(self):
+        # payload + one fp32 scale per tensor
+        return len(self.blob) + 4 * len(self.entries)
+
+
+class Codec:
+    def __init__(self, dtype='fp16', delta=True, entropy=None, max_chain=16, cache_size=16):
+        if dtype not in ('fp32', 'fp16', 'int8'):
+            raise ValueError("dtype must be one of 'fp32', 'fp16', 'int8' but {}.".format(dtype))
+        if entropy not in (None, 'zlib', 'lzma'):
+            raise ValueError("entropy must be one of None, 'zlib', 'lzma' but {}.".format(entropy))
+
+        self.dtype = dtype
+        self.delta = delta
+        self.entropy = entropy
+        self.max_chain = max_chain  # key frame at least every `max_chain` nodes
+
+        # decoded weights, LRU
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()  # decodes from evaluator threads; re-entered along a reference chain
+
+        # report
+        self.stats = {'nodes': 0, 'raw': 0, 'stored': 0}
+
+    """quantization
+    # TBA
+    """
+
+    def _quantize(self, value):
+        if self.dtype == 'fp32':
+            return value.numpy().tobytes(), 1.
+        elif self.dtype == 'fp16':
+            return value.half().numpy().tobytes(), 1.
+        else:  # int8
+            scale = value.abs().max().item() / 127. if value.numel() else 0.
+            scale = scale or 1.
+            return torch.round(value / scale).to(torch.int8).numpy().tobytes(), scale
+
+    def _dequantize(self, buf, shape, scale):
+        dtype = {'fp32': np.float32, 'fp16': np.float16, 'int8': np.int8}[self.dtype]
+        value = torch.from_numpy(np.frombuffer(buf, dtype=dtype).copy()).float().reshape(shape)
+        if scale != 1.:
+            value.mul_(scale)
+        return value
+
+    def _compress(self, blob):
+        if self.entropy == 'zlib':
+            return zlib.compress(blob, 6)
+        elif self.entropy == 'lzma':
+            return lzma.compress(blob, preset=1)
+        return blob
+
+    def _decompress(self, blob):
+        if self.entropy == 'zlib':
+            return zlib.decompress(blob)
+        elif self.entropy == 'lzma':
+            return lzma.decompress(blob)
+        return blob
+
+    """encode and decode
+    # TBA
+    """
+
+    def encode(self, weights, reference=None):
+        base = None
+        depth = 0
+        if self.delta and (reference is not None):
+            ref_encoded = getattr(reference, 'encoded', None)
+            depth = (ref_encoded.depth + 1) if ref_encoded is not None else 1
+            if depth <= self.max_chain:
+                base = reference.get_weights()
+        if base is None:  # key frame
+            reference, depth = None, 0
+
+        chunks, entries = [], []
+        offset, raw_nbytes = 0, 0
+        for name, value in weights.items():
+            value = value.detach().cpu().float()
+            raw_nbytes += value.numel() * 4
+            if base is not None:
+                value = value - base[name].detach().cpu().float()
+
+            buf, scale = self._quantize(value)
+            chunks.append(buf)
+            entries.append((name, tuple(value.size()), scale, offset, len(buf)))
+            offset += len(buf)
+
+        blob = self._compress(b''.join(chunks))
+
+        return Encoded(blob, entries, reference=reference, depth=depth, raw_nbytes=raw_nbytes)
+
+    def decode(self, node):
+        # one at a time: the LRU is shared, and a chain is decoded once, not by each thread
+        with self._lock:
+            return self._decode(node)
+
+    def _decode(self, node):
+        _id = node.get_id()
+        if _id in self._cache:
+            self._cache.move_to_end(_id)
+            return self._cache[_id]
+
+        encoded = node.encoded
+        blob = self._decompress(encoded.blob)
+        base = encoded.reference.get_weights() if encoded.reference is not None else None
+
+        weights = dict()
+        for name, shape, scale, offset, nbytes in encoded.entries:
+            value = self._dequantize(blob[offset:offset + nbytes], shape, scale)
+            if base is not None:
+                value.add_(base[name].detach().cpu().float())
+            weights[name] = value
+
+        self._put(_id, weights)
+        return weights
+
+    def _put(self, _id, weights):
+        self._cache[_id] = weights
+        self._cache.move_to_end(_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def attach(self, node, reference=None):
+        # replace in-RAM fp32 weights of `node` by its encoding
+        node.encoded = self.encode(node.get_weights(), reference=reference)
+        node.codec = self
+        node.weights = None
+
+        self.stats['nodes'] += 1
+        self.stats['raw'] += node.encoded.raw_nbytes
+        self.stats['stored'] += node.encoded.nbytes
+
+        return node.encoded.nbytes  # bytes stored (and "sent") for this node
+
+    def report(self):
+        n = max(self.stats['nodes'], 1)
+        return {
+            'nodes': self.stats['nodes'],
+            'raw_per_node': self.stats['raw'] / n,
+            'stored_per_node': self.stats['stored'] / n,
+            'ratio': self.stats['raw'] / max(self.stats['stored'], 1)}
+
+
+if __name__ == "__main__":
+    from dag import Node
+
+    w = {'conv': torch.randn(64, 32, 3, 3), 'fc': torch.randn(10, 64)}
+    genesis = Node(weights=dict(w), _id=-1)
+
+    for dtype in ('fp32', 'fp16', 'int8'):
+        for entropy in (None, 'zlib'):
+            codec = Codec(dtype=dtype, delta=True, entropy=entropy)
+            prev = Node(weights=dict(w))
+            codec.attach(prev)
+            for r in range(5):
+                cur = Node(weights={k: v + 1e-3 * torch.randn_like(v) for k, v in prev.get_weights().items()})
+                codec.attach(cur, reference=prev)
+                prev = cur
+            err = max((prev.get_weights()[k] - w[k]).abs().max().item() for k in w)
+            print(dtype, entropy, codec.report(), err)
@@ -0,0 +1,153 @@
+"""
+Communication-efficient model exchange
+
+# What a client receives from a `dag.Node` is compressed relative to her own weights:
+#   update = node - receiver
+#   top-k: keep the k largest-magnitude entries per tensor
+#   quantization: unbiased stochastic rounding to `levels` levels of |v| / max|v|
+#   error feedback: each client keeps, per sender (a node's creator), the reconstruction of what she has received
+#     from it, starting from her own weights. The next update from that sender is taken against it, so the residual
+#     (node - reconstruction) is re-sent instead of lost. A client keeps her `senders` most recently used replicas
+#     (each a full model); an evicted pair restarts error feedback from zero: its residual is dropped, and the next
+#     transfer is against her weights at that time. None: unbounded (up to N^2 replicas).
+# Ref. https://arxiv.org/abs/1610.02132 (QSGD), https://arxiv.org/abs/1902.00340 (CHOCO-gossip)
+"""
+import math
+
+import torch
+
+
+class Compressor:
+    def __init__(self, topk=None, levels=None, error_feedback=True, senders=4):
+        assert((topk is None) or (0. < topk <= 1.))
+        assert((levels is None) or (levels >= 1))
+
+        self.topk = topk  # ratio of kept entries
+        self.levels = levels
+        self.error_feedback = error_feedback
+        self.senders = senders  # replicas per receiver; None: unbounded
+
+        self.replicas = dict()  # (receiver id, sender) -> {name: tensor}, reconstruction for error feedback
+
+        # report
+        self.stats = {'transfers': 0, 'raw': 0, 'sent': 0}
+        self.last_nbytes = 0
+
+    def _sparsify(self, value):
+        flat = value.view(-1)
+        k = max(1, int(math.ceil(self.topk * flat.numel())))
+        if k >= flat.numel():
+            return None, flat
+        _, idx = torch.topk(flat.abs(), k, sorted=False)
+        return idx, flat[idx]
+
+    def _quantize(self, value, generator=None):
+        norm = value.abs().max()
+        if norm.item() == 0.:
+            return value
+        scaled = value.abs() / norm * self.levels
+        floor = scaled.floor()
+        if generator is None:
+            noise = torch.rand_like(scaled)
+        else:  # see `rng.Streams`
+            noise = torch.rand(scaled.shape, generator=generator, dtype=scaled.dtype).to(scaled.device)
+        q = floor + (noise < (scaled - floor)).to(scaled.dtype)  # unbiased
+        return value.sign() * q * (norm / self.levels)
+
+    def _nbytes(self, numel, kept):
+        index = 4 * kept if kept < numel else 0
+        if self.levels is None:
+            value = 4 * kept
+        else:  # sign + level, and one scale per tensor
+            bits = 1 + int(math.ceil(math.log2(self.levels + 1)))
+            value = int(math.ceil(bits * kept / 8)) + 4
+        return index + value
+
+    def compress(self, update, generator=None):
+        # returns the update as seen by the receiver and its size in bytes
+        received = dict()
+        nbytes = 0
+        for name, value in update.items():
+            value = value.contiguous()  # e.g. channels-last
+            if self.topk is not None:
+                idx, kept = self._sparsify(value)
+            else:
+                idx, kept = None, value.view(-1)
+
+            if self.levels is not None:
+                kept = self._quantize(kept, generator)
+
+            if idx is None:
+                received[name] = kept.view_as(value).clone()
+            else:
+                dense = torch.zeros_like(value).view(-1)
+                dense[idx] = kept
+                received[name] = dense.view_as(value)
+
+            nbytes += self._nbytes(value.numel(), kept.numel())
+
+        return received, nbytes
+
+    def receive(self, node, client, generator=None):
+        target = node.get_weights()
+        base = client.get_weights()
+
+        if self.error_feedback:
+            key = (client._id, node.creator)
+            replica = self.replicas.pop(key, None)  # re-inserted, most recently used last
+            if replica is None:
+                replica = {name: value.detach().clone() for name, value in base.items()}
+                mine = [k for k in self.replicas if k[0] == client._id]  # least recently used first
+                if (self.senders is not None) and (len(mine) >= self.senders):
+                    del self.replicas[mine[0]]
+            self.replicas[key] = base = replica
+
+        update = dict()
+        for name, value in target.items():
+            update[name] = value.data - base[name].data
+
+        received, nbytes = self.compress(update, generator)
+
+        self.stats['transfers'] += 1
+        self.stats['raw'] += sum(v.numel() * 4 for v in target.values())
+        self.stats['sent'] += nbytes
+        self.last_nbytes = nbytes
+
+        if self.error_feedback:
+            for name, value in received.items():
+                base[name].add_(value)
+            return {name: value.clone() for name, value in base.items()}
+
+        return {name: base[name].data + received[name] for name in received}
+
+    def replicas_of(self, receiver):
+        # {sender: replica} of a receiver (id), e.g. to checkpoint her
+        return {sender: replica for (r, sender), replica in self.replicas.items() if r == receiver}
+
+    def ratio(self):
+        return self.stats['raw'] / max(self.stats['sent'], 1)
+
+
+if __name__ == "__main__":
+    from dag import Node
+
+    class _Receiver:
+        _id = 0
+
+        def __init__(self, weights):
+            self.weights = weights
+
+        def get_weights(self):
+            return self.weights
+
+    torch.manual_seed(0)
+    target = {'conv': torch.randn(64, 32, 3, 3), 'fc': torch.randn(10, 64)}
+    node = Node(weights=target)
+
+    for topk, levels in ((None, None), (0.01, None), (None, 16), (0.01, 16)):
+        compressor = Compressor(topk=topk, levels=levels)
+        receiver = _Receiver({k: torch.zeros_like(v) for k, v in target.items()})
+        for _ in range(200):  # error feedback converges to the target
+            receiver.weights = compressor.receive(node, receiver)
+        err = max((receiver.weights[k] - target[k]).abs().max().item() for k in target)
+        print(topk, levels, '%.1fx' % compressor.ratio(), err)
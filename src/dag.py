@@ -1,6 +1,18 @@
 """
 DAG (Directed Acyclic Graph)
 """
+import random
+import itertools
+
+import numpy as np
+
+
+_versions = itertools.count(1)
+
+
+def next_version():
+    # content ids of weights, shared by `Node`s and `client.Client`s
+    return next(_versions)
 
 
 class Node:
@@ -8,10 +20,12 @@ class Node:
 
     def __init__(self,
                  weights,
-                 #  parent: list = [],
-                 #  edges: list = [],
+                 parents: list = None,
                  _id=None,
-                 creator=None):
+                 creator=None,
+                 _round=None,
+                 weight=1.,
+                 version=None):
 
         # id
         if _id != None:
@@ -20,16 +34,304 @@ class Node:
             self._id = Node._id
             Node._id += 1
 
-        # TODO: rounds
+        self.round = _round
 
         self.weights = weights
-        # self.parent = parent
-        # self.edges = edges
+        self.store = None  # on-disk copy of weights, see `store.DAGStore`
+        self.encoded, self.codec = None, None  # encoded weights, see `codec.Codec`
+        self.parents = list(parents or [])  # references from averaging
 
         self.creator = creator
 
+        # content id of `weights`: its creator's version if copied exactly, see `client.Metrics`
+        self.version = version if version is not None else next_version()
+
+        self._merkle = None  # see `merkle`
+
+        # own transaction weight
+        self.weight = weight
+
     def get_id(self):
         return self._id
 
     def get_weights(self):
+        if self.weights is None:
+            if self.codec is not None:
+                return self.codec.decode(self)
+            if self.store is not None:
+                return self.store.get_weights(self._id)
         return self.weights
+
+    def get_parents(self):
+        return self.parents
+
+    def merkle(self):
+        # per-layer Merkle tree of the weights; built once, the weights are immutable
+        if self._merkle is None:
+            from merkle import MerkleTree
+            self._merkle = MerkleTree(self.get_weights())
+        return self._merkle
+
+    def root(self):
+        return self.merkle().root
+
+    def release(self):
+        # drop in-RAM weights, the node stays in the DAG
+        # (encoded weights are kept since the others may refer to them)
+        self.weights = None
+
+
+class DAG:
+    """Ledger of `Node`s
+
+    # tips: O(1) insert/remove/contains, O(k) sampling
+    # cumulative weight: own weight + sum of the weights of all its descendants (exact, O(ancestors) per node);
+    # confirmation_depth=k: only those at most k hops below, an approximation (IOTA-like: a node that deep
+    # under the tips counts as confirmed, and its weight stops growing), O(ancestors within k) per node.
+    # An insertion only appends its parents (CSR over insertion order); the weights are pushed
+    # up to the ancestors lazily, in a flush which walks a batch of new nodes level by level, vectorized.
+    """
+
+    def __init__(self, genesis=None, confirmation_depth=None):
+        self.nodes = dict()  # id -> Node
+        self.children = dict()  # id -> [Node]
+
+        self._order = []  # insertion index -> Node
+        self._index = dict()  # id -> insertion index
+
+        # tips
+        self._tips = []
+        self._tip_pos = dict()  # id -> position in self._tips
+
+        # cumulative weight
+        self.confirmation_depth = confirmation_depth  # None: exact
+        self._indptr = np.zeros(1025, dtype=np.int64)  # insertion index -> its parents in `_parents`
+        self._parents = np.zeros(2048, dtype=np.int64)  # insertion indices
+        self._weights = np.zeros(1024, dtype=np.float64)  # own
+        self._cumulative = np.zeros(1024, dtype=np.float64)
+        self._pending = []  # insertion indices, not yet pushed up
+
+        if genesis is not None:
+            self.add(genesis)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, node):
+        return node.get_id() in self.nodes
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def get(self, _id):
+        return self.nodes[_id]
+
+    """insertion
+    # TBA
+    """
+
+    @staticmethod
+    def _grow(array, size):
+        if size <= len(array):
+            return array
+        res = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+        res[:len(array)] = array
+        return res
+
+    def add(self, node):
+        _id = node.get_id()
+        if _id in self.nodes:
+            raise KeyError("node '{}' is already in the DAG.".format(_id))
+
+        # unique parents, keeping order
+        parents = []
+        for parent in node.get_parents():
+            if parent.get_id() not in self.nodes:
+                raise KeyError("parent '{}' is not in the DAG.".format(parent.get_id()))
+            if all(parent is not p for p in parents):
+                parents.append(parent)
+        node.parents = parents
+
+        idx = len(self._order)
+        self.nodes[_id] = node
+        self.children[_id] = []
+        self._order.append(node)
+        self._index[_id] = idx
+
+        # edges and tips
+        untipped = []
+        for parent in parents:
+            p_id = parent.get_id()
+            self.children[p_id].append(node)
+            if self._remove_tip(p_id):
+                untipped.append(parent)
+
+        self._add_tip(node)
+
+        # cumulative weight
+        self._indptr = self._grow(self._indptr, idx + 2)
+        start = self._indptr[idx]
+        self._parents = self._grow(self._parents, start + len(parents))
+        self._parents[start:start + len(parents)] = [self._index[p.get_id()] for p in parents]
+        self._indptr[idx + 1] = start + len(parents)
+
+        self._weights = self._grow(self._weights, idx + 1)
+        self._cumulative = self._grow(self._cumulative, idx + 1)
+        self._weights[idx] = node.weight
+        self._cumulative[idx] = node.weight
+        if parents:
+            self._pending.append(idx)
+
+        return untipped  # parents which are no longer tips
+
+    """tips
+    # TBA
+    """
+
+    def _add_tip(self, node):
+        self._tip_pos[node.get_id()] = len(self._tips)
+        self._tips.append(node)
+
+    def _remove_tip(self, _id):
+        pos = self._tip_pos.pop(_id, None)
+        if pos is None:
+            return False
+
+        # swap with the last one
+        last = self._tips.pop()
+        if pos < len(self._tips):
+            self._tips[pos] = last
+            self._tip_pos[last.get_id()] = pos
+
+        return True
+
+    def is_tip(self, node):
+        return node.get_id() in self._tip_pos
+
+    def tips(self):
+        return self._tips[:]
+
+    def sample_tips(self, count, rng=None):
+        rng = rng or random
+        return rng.sample(self._tips, min(count, len(self._tips)))
+
+    """cumulative weight
+    # per batch of new nodes (sources), a breadth-first walk up their parents, one level at a time,
+    # vectorized over the batch; `marks` (sources x nodes) stamps what each source has reached,
+    # so a walk costs O(ancestors within `confirmation_depth`) and nothing is kept between flushes
+    """
+
+    def _up(self, nodes):
+        # -> (position in `nodes`, parent) of every parent of every node
+        starts = self._indptr[nodes]
+        counts = self._indptr[nodes + 1] - starts
+        pos = np.repeat(np.arange(len(nodes)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return pos, self._parents[starts[pos] + offsets]
+
+    def _flush(self, budget=1 << 23):
+        # budget: entries of `marks` (int32, 32 MB; pages never touched cost nothing)
+        if not self._pending:
+            return
+
+        n = len(self._order)
+        chunk = max(1, min(len(self._pending), 1024, budget // n))
+        marks = np.zeros(chunk * n, dtype=np.int32)  # (source, node) -> stamp, from `tick`
+        tick = 1
+
+        added, size = [], 0  # (node, source) pushed up to, `bincount`-ed in batches
+        pending = np.asarray(self._pending, dtype=np.int64)
+        for start in range(0, len(pending), chunk):
+            sources = pending[start:start + chunk]
+            if tick > (1 << 30):  # before int32 stamps wrap
+                marks[:] = 0
+                tick = 1
+            src, nodes = np.arange(len(sources)), sources
+            base = tick  # stamps of this batch are >= base
+            marks[src * n + nodes] = tick
+            tick += len(src)
+
+            level = 0
+            while len(nodes) and ((self.confirmation_depth is None) or (level < self.confirmation_depth)):
+                pos, parents = self._up(nodes)
+                src = src[pos]
+                keys = src * n + parents
+                stamps = np.arange(tick, tick + len(keys), dtype=np.int32)
+                new = marks[keys] < base  # not reached on a shorter path
+                marks[keys] = stamps  # the last of duplicates wins
+                new &= marks[keys] == stamps
+                tick += len(keys)
+
+                src, nodes = src[new], parents[new]
+                added.append((nodes, sources[src]))
+                size += len(nodes)
+                if size >= n:
+                    self._push(added, n)
+                    added, size = [], 0
+                level += 1
+
+        self._push(added, n)
+        self._pending = []
+
+    def _push(self, added, n):
+        if added:
+            nodes = np.concatenate([a for a, _ in added])
+            weights = self._weights[np.concatenate([s for _, s in added])]
+            self._cumulative[:n] += np.bincount(nodes, weights=weights, minlength=n)
+
+    def cumulative_weight(self, node):
+        self._flush()
+        return self._cumulative[self._index[node.get_id()]].item()
+
+    def cumulative_weights(self):
+        self._flush()
+        return self._cumulative[:len(self._order)].copy()
+
+    def ancestors(self, node):
+        # all of them, in insertion order; O(ancestors)
+        seen = set()
+        stack = [self._index[node.get_id()]]
+        while stack:
+            idx = stack.pop()
+            for p in self._parents[self._indptr[idx]:self._indptr[idx + 1]].tolist():
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        return [self._order[i] for i in sorted(seen)]
+
+
+if __name__ == "__main__":
+    import time
+
+    genesis = Node(weights=None, _id=-1)
+    dag = DAG(genesis)
+
+    a = Node(weights=None, parents=[genesis])
+    b = Node(weights=None, parents=[genesis])
+    c = Node(weights=None, parents=[a, b])
+    for n in (a, b, c):
+        dag.add(n)
+
+    print([t.get_id() for t in dag.tips()])  # [c]
+    print(dag.cumulative_weights())  # [4, 2, 2, 1]
+
+    # 20k nodes, 50 per round, 2 parents each
+    start = time.time()
+    latest = dag.tips()
+    for r in range(400):
+        current = []
+        for _ in range(50):
+            node = Node(weights=None, parents=random.sample(latest, min(2, len(latest))), _round=r)
+            dag.add(node)
+            current.append(node)
+        latest = current
+    print(len(dag), time.time() - start)
+
+    start = time.time()
+    dag.cumulative_weights()
+    print('flush', time.time() - start)
+
+    start = time.time()
+    for _ in range(1000):
+        dag.sample_tips(2)
+    print(time.time() - start)
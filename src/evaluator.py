@@ -0,0 +1,128 @@
+"""
+Parallel evaluation of proposals
+
+# R replicas of the evaluation model (`Client`s without training data), one per worker thread.
+# Each worker is pinned to a disjoint set of CPUs and runs its intra-op threads there,
+# so R models are tested at once (torch releases the GIL in its ops).
+# `imap` evaluates in waves of R but yields in order, so a sequential scan over its results
+# (e.g. optimal stopping in `reputation`) sees exactly what it would see one by one.
+# Closing `imap` early (a `break`) drains the wave in flight, so no replica is still testing
+# when the next client's test set is set.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import torch
+
+from client import Client
+
+
+class ParallelEvaluator:
+    def __init__(self, args, make_net, replicas=2, template=None, threads=None):
+        # make_net: () -> net of the same architecture
+        # template: a `Client` whose BN statistics (and compiled inference) the replicas copy
+        # threads: intra-op threads per replica; default, all CPUs split evenly
+        self.replicas = replicas
+
+        self.clients = []
+        for r in range(replicas):
+            client = Client(args=args, net=make_net(), trainset=None, testset=None, log=False, _id=-2 - r)
+            if template is not None:
+                client.net.load_state_dict(template.net.state_dict())
+                client.buffers = template.buffers  # same BN statistics, shared test results
+                if template.inference is not None:
+                    client.compile_inference()
+            self.clients.append(client)
+
+        """affinity
+        # contiguous, disjoint CPU sets (Linux); elsewhere, thread counts only
+        """
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+        per = max(1, len(cpus) // replicas)
+        self.cpus = [cpus[r * per:(r + 1) * per] or cpus for r in range(replicas)]
+        self.threads = threads or per
+
+        self._local = threading.local()
+        self._next = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=replicas, initializer=self._pin)
+
+    def _pin(self):
+        with self._lock:
+            r = self._next
+            self._next += 1
+
+        self._local.client = self.clients[r]
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cpus[r])  # this thread, inherited by its intra-op threads
+        torch.set_num_threads(self.threads)
+
+    def set_dataset(self, testset):
+        for client in self.clients:
+            client.set_dataset(trainset=None, testset=testset)
+
+    def _evaluate(self, proposal, epoch, show=False):
+        client = self._local.client
+        return client.score(proposal, epoch, show=show)
+
+    def imap(self, proposals, epoch, show=False):
+        # accuracies, in order, evaluated in waves of `replicas`
+        proposals = list(proposals)
+        for start in range(0, len(proposals), self.replicas):
+            wave = [self._pool.submit(self._evaluate, p, epoch, show) for p in proposals[start:start + self.replicas]]
+            try:
+                for future in wave:
+                    yield future.result()
+            finally:  # closed early: cancel those not started, wait for the running ones
+                for future in wave:
+                    future.cancel()
+                wait(wave)
+
+    def evaluate(self, proposals, epoch, show=False):
+        return list(self.imap(proposals, epoch, show))
+
+    def close(self):
+        self._pool.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from torch.utils.data import TensorDataset
+
+    from net import DenseNet
+
+    args = argparse.Namespace(path='/tmp/evaluator', cuda=False, batchSz=64, opt='sgd')
+    torch.manual_seed(0)
+
+    def _dense_net():
+        return DenseNet(growthRate=12, depth=40, reduction=0.5, bottleneck=True, nClasses=10)
+
+    testset = TensorDataset(torch.randn(256, 3, 32, 32), torch.randint(10, (256,)))
+
+    proposals = [Client(args=args, net=_dense_net(), _id=i) for i in range(8)]
+
+    test_client = Client(args=args, net=_dense_net(), _id=-1)
+    test_client.set_dataset(trainset=None, testset=testset)
+
+    start = time.time()
+    sequential = []
+    for p in proposals:
+        test_client.set_weights(p.get_weights())
+        sequential.append(100. - test_client.test(1, show=False, log=False))
+    print('sequential', time.time() - start)
+
+    for replicas in (2, 4):
+        evaluator = ParallelEvaluator(args, _dense_net, replicas=replicas, template=test_client)
+        evaluator.set_dataset(testset)
+
+        start = time.time()
+        parallel = evaluator.evaluate(proposals, 1)
+        print('replicas=%d' % replicas, time.time() - start, parallel == sequential)
+
+        evaluator.close()
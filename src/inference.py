@@ -0,0 +1,180 @@
+"""
+Inference graph for `net.DenseNet` in eval. mode
+
+# Only weights change between evaluations, so the graph is captured (TorchScript) once
+# and the weights are its buffers, refreshed in place by `load()` (no recompilation).
+# eval. BN is an affine map per channel:
+#   BN -> Conv (Bottleneck.bn2 after conv1) is folded into the conv (weight and bias)
+#   BN -> ReLU (pre-activation) is a fused `relu(addcmul(shift, x, scale))`
+"""
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from net import Bottleneck, SingleLayer
+
+
+def _affine(bn):
+    # eval. BN: y = x * scale + shift
+    scale = bn.weight.data / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias.data - bn.running_mean * scale
+    return scale.view(1, -1, 1, 1), shift.view(1, -1, 1, 1)
+
+
+class _PreAct(nn.Module):
+    # BN -> ReLU -> Conv
+    def __init__(self, bn, conv):
+        super(_PreAct, self).__init__()
+        self.register_buffer('scale', torch.empty(1, bn.num_features, 1, 1))
+        self.register_buffer('shift', torch.empty(1, bn.num_features, 1, 1))
+        self.register_buffer('weight', torch.empty_like(conv.weight.data))
+        self.padding = conv.padding[0]
+
+    def load(self, bn, conv):
+        scale, shift = _affine(bn)
+        self.scale.copy_(scale)
+        self.shift.copy_(shift)
+        self.weight.copy_(conv.weight.data)
+
+    def forward(self, x):
+        return F.conv2d(torch.relu(torch.addcmul(self.shift, x, self.scale)), self.weight, None, 1, self.padding)
+
+
+class _Bottleneck(nn.Module):
+    def __init__(self, layer: Bottleneck):
+        super(_Bottleneck, self).__init__()
+        self.pre = _PreAct(layer.bn1, layer.conv1)
+        self.register_buffer('bias1', torch.empty(layer.conv1.out_channels))  # bn2 folded into conv1
+        self.register_buffer('weight2', torch.empty_like(layer.conv2.weight.data))
+
+    def load(self, layer: Bottleneck):
+        self.pre.load(layer.bn1, layer.conv1)
+        scale, shift = _affine(layer.bn2)
+        self.pre.weight.mul_(scale.view(-1, 1, 1, 1))
+        self.bias1.copy_(shift.view(-1))
+        self.weight2.copy_(layer.conv2.weight.data)
+
+    def forward(self, x):
+        out = self.pre(x) + self.bias1.view(1, -1, 1, 1)
+        out = F.conv2d(torch.relu(out), self.weight2, None, 1, 1)
+        return torch.cat((x, out), 1)
+
+
+class _SingleLayer(nn.Module):
+    def __init__(self, layer: SingleLayer):
+        super(_SingleLayer, self).__init__()
+        self.pre = _PreAct(layer.bn1, layer.conv1)
+
+    def load(self, layer: SingleLayer):
+        self.pre.load(layer.bn1, layer.conv1)
+
+    def forward(self, x):
+        return torch.cat((x, self.pre(x)), 1)
+
+
+class _Transition(nn.Module):
+    def __init__(self, layer):
+        super(_Transition, self).__init__()
+        self.pre = _PreAct(layer.bn1, layer.conv1)
+
+    def load(self, layer):
+        self.pre.load(layer.bn1, layer.conv1)
+
+    def forward(self, x):
+        return F.avg_pool2d(self.pre(x), 2)
+
+
+class InferenceNet(nn.Module):
+    def __init__(self, net):
+        super(InferenceNet, self).__init__()
+
+        self.register_buffer('weight0', torch.empty_like(net.conv1.weight.data))
+
+        layers = []
+        for block, trans in ((net.dense1, net.trans1), (net.dense2, net.trans2), (net.dense3, None)):
+            for layer in block:
+                layers.append(_Bottleneck(layer) if isinstance(layer, Bottleneck) else _SingleLayer(layer))
+            if trans is not None:
+                layers.append(_Transition(trans))
+        self.layers = nn.ModuleList(layers)
+
+        nChannels = net.bn1.num_features
+        self.register_buffer('scale', torch.empty(1, nChannels, 1, 1))
+        self.register_buffer('shift', torch.empty(1, nChannels, 1, 1))
+        self.fc = nn.Linear(net.fc.in_features, net.fc.out_features)
+        for p in self.fc.parameters():
+            p.requires_grad_(False)
+
+        self.load(net)
+
+    @torch.no_grad()
+    def load(self, net):
+        # refresh (fold) all buffers from `net`, in place
+        self.weight0.copy_(net.conv1.weight.data)
+
+        src = []
+        for block, trans in ((net.dense1, net.trans1), (net.dense2, net.trans2), (net.dense3, None)):
+            src += list(block)
+            if trans is not None:
+                src.append(trans)
+        for dst, layer in zip(self.layers, src):
+            dst.load(layer)
+
+        scale, shift = _affine(net.bn1)
+        self.scale.copy_(scale)
+        self.shift.copy_(shift)
+        self.fc.weight.copy_(net.fc.weight.data)
+        self.fc.bias.copy_(net.fc.bias.data)
+
+    def forward(self, x):
+        out = F.conv2d(x, self.weight0, None, 1, 1)
+        for layer in self.layers:
+            out = layer(out)
+        out = torch.relu(torch.addcmul(self.shift, out, self.scale))
+        out = torch.flatten(F.avg_pool2d(out, 8), 1)
+        return F.log_softmax(self.fc(out), dim=1)
+
+
+def compile(net):
+    # returns (InferenceNet, callable graph); falls back to eager if scripting fails
+    inference = InferenceNet(net).to(net.conv1.weight.device).eval()
+    try:
+        graph = torch.jit.script(inference)
+    except Exception:  # e.g. an old TorchScript
+        graph = inference
+    return inference, graph
+
+
+if __name__ == "__main__":
+    import time
+
+    from net import DenseNet
+
+    torch.manual_seed(0)
+    net = DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10)
+
+    # non-trivial BN statistics
+    net.train()
+    with torch.no_grad():
+        for _ in range(3):
+            net(torch.randn(32, 3, 32, 32))
+    net.eval()
+
+    inference, graph = compile(net)
+    x = torch.randn(128, 3, 32, 32)
+
+    with torch.no_grad():
+        print('max abs. diff.', (net(x) - graph(x)).abs().max().item())
+
+        # new weights, same graph
+        for p in net.parameters():
+            p.add_(0.01 * torch.randn_like(p))
+        inference.load(net)
+        print('max abs. diff. after load', (net(x) - graph(x)).abs().max().item())
+
+        for name, f in (('eager', net), ('graph', graph)):
+            f(x)
+            start = time.time()
+            for _ in range(5):
+                f(x)
+            print(name, (time.time() - start) / 5)
@@ -1,19 +1,32 @@
+import os
+import json
+import time
 import argparse
-import random
-from copy import deepcopy
 
 import torch
-import torchvision.datasets as dset
-import torchvision.transforms as transforms
-from torch.utils.data import random_split
+from torch.utils.data import random_split, Subset
 
 from tqdm import tqdm
 
-from net import DenseNet
-from client import Client
+from net import DenseNet, materialize
+from client import Client, ClientPool, Augment
 from byzantines import Byzantine_Random
-from dag import Node
+from dag import Node, DAG
+from store import DAGStore
+from codec import Codec
+from compression import Compressor
+from network import Network, MBPS
+from sketch import Sketcher
+from ann import IVFIndex
+from checkpoint import Checkpointer
+from recorder import Recorder
+from evaluator import ParallelEvaluator
+from rng import Streams
+from merkle import Dedup
+import topology as topologies
 import reputation
+import aggregation
+import partition
 
 
 if __name__ == "__main__":
@@ -27,17 +40,73 @@ if __name__ == "__main__":
     parser.add_argument('--nByzs', type=int, default=33)
     parser.add_argument('--batchSz', type=int, default=128)
     parser.add_argument('--nEpochs', type=int, default=300)
+    parser.add_argument('--partition', type=str, default='random',
+                        choices=('random',) + partition.SCHEMES)
+    parser.add_argument('--alpha', type=float, default=0.5)  # Dirichlet
+    parser.add_argument('--nShards', type=int, default=2)  # shards per client
     parser.add_argument('--op-stop', action='store_true')
     parser.add_argument('--filter', action='store_true')
     parser.add_argument('--repute', type=str, default='acc',
                         choices=('acc', 'Frobenius', 'random', 'GNN'))
+    parser.add_argument('--sketch', type=int, default=0)  # sketch dim. for Frobenius, 0: exact
+    parser.add_argument('--rerank', type=int, default=0)  # exact re-rank of the top candidates
+    parser.add_argument('--ann', action='store_true')  # nearest-neighbor index over sketches
+    parser.add_argument('--ann-min-train', type=int, default=None,
+                        help='proposals indexed before the IVF quantizer is trained (flat scan below); '
+                             'the index holds the live proposals only, about nNodes / 2, so the default is '
+                             'max(32, nNodes // 4)')
+    parser.add_argument('--aggregate', type=str, default='repute',
+                        choices=('repute', 'krum', 'trimmed', 'median'))
+    parser.add_argument('--nAssumed', type=int, default=None)  # assumed Byz.s among candidates
+    parser.add_argument('--proposals', type=str, default='latest',
+                        choices=('latest', 'tips'))
+    parser.add_argument('--nTips', type=int, default=10)
+    parser.add_argument('--confirmation-depth', type=int, default=None)  # cumulative weights over descendants at most this deep (approximate); default: all, exact
+    parser.add_argument('--topology', type=str, default='full',
+                        choices=topologies.KINDS)  # whose nodes a client sees
+    parser.add_argument('--degree', type=int, default=4)  # k of ring, regular, small-world
+    parser.add_argument('--rewire', type=float, default=0.1)  # small-world
+    parser.add_argument('--dag-store', type=str, default=None)  # path of on-disk DAG log
+    parser.add_argument('--dedup', action='store_true')  # nodes share identical layers (per-layer Merkle digests)
+    parser.add_argument('--codec', type=str, default='none',
+                        choices=('none', 'fp32', 'fp16', 'int8'))
+    parser.add_argument('--codec-ref', type=str, default='previous',
+                        choices=('previous', 'parent', 'none'))
+    parser.add_argument('--codec-entropy', type=str, default='none',
+                        choices=('none', 'zlib', 'lzma'))
+    parser.add_argument('--compress', type=str, default='none',
+                        choices=('none', 'topk', 'quant', 'topk+quant'))
+    parser.add_argument('--topk', type=float, default=0.01)
+    parser.add_argument('--qlevels', type=int, default=16)
+    parser.add_argument('--no-ef', action='store_true')
+    parser.add_argument('--ef-senders', type=int, default=4)  # error-feedback replicas per client, 0: unbounded
+    parser.add_argument('--network', action='store_true')  # transfer cost accounting
+    parser.add_argument('--bandwidth', type=float, default=100.)  # Mbps
+    parser.add_argument('--latency', type=float, default=10.)  # ms
     parser.add_argument('--path')
     parser.add_argument('--no-cuda', action='store_true')
-    # parser.add_argument('--load', action='store_true')  # TODO
+    parser.add_argument('--snapshot', type=str, default=None)  # path of resumable snapshots
+    parser.add_argument('--snapshot-every', type=int, default=10)  # rounds
+    parser.add_argument('--resume', action='store_true')  # from the latest snapshot
+    parser.add_argument('--record', type=str, default=None)  # path of per-round score matrices
+    parser.add_argument('--summary', type=str, default=None)  # path of a JSON summary, updated every round
+    parser.add_argument('--shared-data', type=str, default=None)  # decoded CIFAR in shared memory, see `sweep`
     parser.add_argument('--seed', type=int, default=1)
     parser.add_argument('--opt', type=str, default='sgd',
                         choices=('sgd', 'adam', 'rmsprop'))
+    parser.add_argument('--precision', type=str, default='fp32',
+                        choices=('fp32', 'bf16'),
+                        help='bf16: autocast, torch >= 1.10')
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--fast-eval', action='store_true')  # BN-folded, compiled eval. of proposals
+    parser.add_argument('--replicas', type=int, default=1)  # parallel eval. of proposals
+    parser.add_argument('--efficient', action='store_true')  # memory-efficient dense blocks
+    parser.add_argument('--checkpoint-every', type=int, default=1)
     args = parser.parse_args()
+    if args.resume and (args.snapshot is None):
+        parser.error("--resume requires --snapshot")
+    if (args.precision == 'bf16') and not hasattr(torch, 'autocast'):
+        parser.error("--precision=bf16 requires torch >= 1.10 but {}".format(torch.__version__))
 
     args.cuda = not args.no_cuda and torch.cuda.is_available()
 
@@ -48,37 +117,60 @@ if __name__ == "__main__":
     if args.cuda:
         torch.cuda.manual_seed(args.seed)
 
+    # independent streams per (purpose, client, round), see `rng`
+    streams = Streams(args.seed)
+
     """Data
     # TODO: get Mean and Std per client
     # Ref: https://github.com/bamos/densenet.pytorch
     """
+    import torchvision.transforms as transforms  # deferred, as is the dataset below
+
     normMean = [0.49139968, 0.48215827, 0.44653124]
     normStd = [0.24703233, 0.24348505, 0.26158768]
     normTransform = transforms.Normalize(normMean, normStd)
 
     trainTransform = transforms.Compose([
-        transforms.RandomCrop(32, padding=4),
-        transforms.RandomHorizontalFlip(),
         transforms.ToTensor(),
         normTransform
     ])
+    # RandomCrop(32, padding=4) + RandomHorizontalFlip, per batch from each client's own stream
+    augment = Augment(padding=4, fill=[-m / s for m, s in zip(normMean, normStd)])
     testTransform = transforms.Compose([
         transforms.ToTensor(),
         normTransform
     ])
 
-    trainset = dset.CIFAR10(root='cifar', train=True, download=True, transform=trainTransform)
-    testset = dset.CIFAR10(root='cifar', train=False, download=True, transform=testTransform)
-
-    # Random split
-    splited_trainset = random_split(trainset, [int(len(trainset) / args.nNodes) for _ in range(args.nNodes)])
-    splited_testset = random_split(testset, [int(len(testset) / args.nNodes) for _ in range(args.nNodes)])
+    if args.shared_data is not None:
+        from sweep import SharedCIFAR10
+
+        trainset = SharedCIFAR10(args.shared_data, train=True, transform=trainTransform)
+        testset = SharedCIFAR10(args.shared_data, train=False, transform=testTransform)
+    else:
+        import torchvision.datasets as dset
+
+        download = not os.path.isdir(os.path.join('cifar', 'cifar-10-batches-py'))  # skip the download check
+        trainset = dset.CIFAR10(root='cifar', train=True, download=download, transform=trainTransform)
+        testset = dset.CIFAR10(root='cifar', train=False, download=download, transform=testTransform)
+
+    if args.partition == 'random':  # Random split
+        splited_trainset = random_split(trainset, [int(len(trainset) / args.nNodes) for _ in range(args.nNodes)],
+                                        generator=streams.torch('split', 'train'))
+        splited_testset = random_split(testset, [int(len(testset) / args.nNodes) for _ in range(args.nNodes)],
+                                       generator=streams.torch('split', 'test'))
+    else:  # non-IID, see `partition`
+        train_idxes, test_idxes = partition.partition(
+            trainset.targets, testset.targets, args.nNodes, scheme=args.partition, seed=args.seed,
+            cache='cifar/partitions', alpha=args.alpha, nShards=args.nShards)
+        splited_trainset = [Subset(trainset, idx.tolist()) for idx in train_idxes]
+        splited_testset = [Subset(testset, idx.tolist()) for idx in test_idxes]
 
     """Set nodes
     # TBA
     """
     def _dense_net():
-        return DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10)
+        return DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10,
+                        efficient=args.efficient, checkpoint_every=args.checkpoint_every)
         # print('>>> Number of params: {}'.format(
         #     sum([p.data.nelement() for p in net.parameters()])))
 
@@ -89,59 +181,256 @@ if __name__ == "__main__":
         testset=None,
         log=False,
         _id=-1)
+    if args.fast_eval:
+        tmp_client.compile_inference()
+
+    evaluator = None
+    if args.replicas > 1:
+        evaluator = ParallelEvaluator(args, _dense_net, replicas=args.replicas, template=tmp_client)
 
-    clients = []
-    for i in range(args.nNodes):
+    # same init. weights, one shared snapshot; clients are created on their first activation
+    init_net = tmp_client.net.module if isinstance(tmp_client.net, torch.nn.DataParallel) else tmp_client.net
+    init_state = {name: value.detach().clone() for name, value in init_net.state_dict().items()}
+
+    restored = None  # on resume, clients whose logs were restored; the others' are of rounds to be redone
+
+    def _client(i):
         if i < args.nByzs:  # Byzantine nodes
-            client = Byzantine_Random(
-                args=args,
-                net=_dense_net(),
-                trainset=splited_trainset[i],
-                testset=splited_testset[i],
-                log=True)
+            cls = Byzantine_Random
         else:  # Honest nodes
-            client = Client(
-                args=args,
-                net=_dense_net(),
-                trainset=splited_trainset[i],
-                testset=splited_testset[i],
-                log=True)
-        client.set_weights(tmp_client.get_weights())  # same init. weights
-        clients.append(client)
+            cls = Client
+        client = cls(
+            args=args,
+            net=materialize(_dense_net, init_state),
+            trainset=splited_trainset[i],
+            testset=splited_testset[i],
+            log=True,
+            _id=i,
+            streams=streams,
+            augment=augment)
+        if (restored is not None) and (i not in restored):
+            client.truncate_logs()
+        return client
+
+    clients = ClientPool(_client, args.nNodes)
 
     """Set DAG
-    # TODO: DAG connection
+    # parents: elected nodes (or her own last node)
     """
-    genesis = Node(
-        weights=tmp_client.get_weights(),
-        _id=-1)
+    dedup = Dedup() if args.dedup else None
 
-    nodes = []
-    nodes.append(genesis)
+    def _snapshot(weights):
+        if dedup is not None:
+            return dedup.snapshot(weights)
+        return {name: weight.clone() for name, weight in weights.items()}
+
+    genesis = Node(
+        weights=_snapshot(tmp_client.get_weights()),
+        _id=-1,
+        _round=0)
+
+    dag = DAG(genesis, confirmation_depth=args.confirmation_depth)
+    last_nodes = dict()  # creator -> her latest node
+
+    sketcher = None
+    if args.sketch > 0:
+        sketcher = Sketcher(dim=args.sketch, seed=args.seed)
+        sketcher.attach(genesis, FNs=(args.filter,))
+
+    index = None
+    if (sketcher is not None) and args.ann:
+        min_train = args.ann_min_train or max(32, args.nNodes // 4)  # of the live proposals, not 256 of a whole DAG
+        index = IVFIndex(dim=args.sketch, min_train=min_train)
+        index.add(genesis.get_id(), genesis.sketches[args.filter])
+
+    codec = None
+    if args.codec != 'none':
+        codec = Codec(
+            dtype=args.codec,
+            delta=(args.codec_ref != 'none'),
+            entropy=(None if args.codec_entropy == 'none' else args.codec_entropy))
+        codec.attach(genesis)
+
+    checkpointer = None
+    if args.snapshot is not None:
+        checkpointer = Checkpointer(args.snapshot, every=args.snapshot_every)
+    resuming = args.resume and checkpointer.exists()
+
+    store = None
+    if args.dag_store is not None:
+        store = DAGStore(args.dag_store, weights=genesis.get_weights())
+        if store.index and not resuming:  # its nodes' ids would be appended again
+            parser.error("--dag-store {} is not empty; resume from a snapshot, or use a new one".format(
+                args.dag_store))
+        if genesis.get_id() not in store.index:  # else, resumed (truncated to the snapshot by `restore`)
+            store.append(genesis)
+
+    """Model exchange
+    # TBA
+    """
+    compressor = None
+    if args.compress != 'none':
+        compressor = Compressor(
+            topk=(args.topk if 'topk' in args.compress else None),
+            levels=(args.qlevels if 'quant' in args.compress else None),
+            error_feedback=(not args.no_ef), senders=(args.ef_senders or None))
+
+    # candidates of a client: her neighbors' proposals
+    topology = topologies.build(args.topology, args.nNodes, k=args.degree, p=args.rewire,
+                                rng=streams.numpy('topology'))
+
+    network = None
+    if args.network:
+        network = Network(args.nNodes, bandwidth=args.bandwidth * MBPS, latency=args.latency / 1000.)
+
+    def _receive(e, a, client):
+        # weights of elected (or candidate) `e` as received by `client`
+        if (compressor is not None) and isinstance(e, Node):
+            weights = compressor.receive(e, client, generator=streams.torch('compress', a, epoch, e.get_id()))
+        else:
+            weights = e.get_weights()
+
+        if (network is not None) and isinstance(e, Node) and (e.creator != a):
+            network.fetch(e, a, purpose='average',
+                          nbytes=(compressor.last_nbytes if compressor is not None else None))
+
+        return weights
 
     """Run simulator
     # TODO: logging time (train, test)
     """
-    latest_nodes = deepcopy(nodes)  # in DAG
-
-    for epoch in range(1, args.nEpochs + 1):
+    latest_nodes = [genesis]  # in DAG
+
+    start = 1
+    dirty = set()  # clients activated since the last snapshot
+    if checkpointer is not None:
+        if resuming:
+            state = checkpointer.restore(clients, codec=codec, compressor=compressor, store=store)
+            restored = set(state['clients'])  # after: `restore` creates them
+            if state['byzantines'] != list(range(args.nByzs)):
+                raise ValueError("Byzantine nodes {} do not match the snapshot.".format(args.nByzs))
+            dag, latest_nodes, last_nodes = state['dag'], state['latest_nodes'], state['last_nodes']
+            dag.confirmation_depth = args.confirmation_depth  # weights are pushed up lazily, on the next read
+            index, network = state['index'], state['network']
+            start = state['epoch'] + 1
+            print(">>> Resumed from round %d" % (state['epoch']))
+        elif args.resume:  # nothing to resume from
+            restored = set()
+
+    recorder = None
+    if args.record is not None:
+        recorder = Recorder(
+            args.record, nNodes=args.nNodes, nRounds=args.nEpochs, nProposals=max(args.nNodes, args.nTips) + 1,
+            byzantines=range(args.nByzs), kind=(args.repute if args.aggregate == 'repute' else args.aggregate))
+
+    summary = None
+    if args.summary is not None:
+        summary = {'args': dict(vars(args)), 'history': [], 'elapsed': 0., 'done': False}
+        if args.resume and os.path.isfile(args.summary):
+            with open(args.summary, 'r') as f:
+                prev = json.load(f)
+            summary['history'] = [h for h in prev['history'] if h['round'] < start]
+            summary['elapsed'] = prev['elapsed']
+
+    def _summarize(epoch, accs, done=False):
+        # accs: {client: acc. after averaging and training}, this round
+        honest = [acc for a, acc in accs.items() if a >= args.nByzs]
+        summary['history'].append({
+            'round': epoch,
+            'acc': sum(accs.values()) / len(accs),
+            'honest_acc': sum(honest) / len(honest) if honest else None})
+        summary['rounds'] = epoch
+        summary['final_acc'] = summary['history'][-1]['acc']
+        summary['final_honest_acc'] = summary['history'][-1]['honest_acc']
+        summary['best_acc'] = max(h['acc'] for h in summary['history'])
+        summary['elapsed'] += time.time() - started
+        summary['done'] = done
+
+        with open(args.summary + '.tmp', 'w') as f:
+            json.dump(summary, f)
+        os.replace(args.summary + '.tmp', args.summary)
+
+    for epoch in range(start, args.nEpochs + 1):
         print(">>> Round %5d" % (epoch))
+        started = time.time()
 
         # select activated clients
         # At least one honest node
-        n_activated_byz = random.randint(0, args.nByzs)  # in Byz.
-        n_activated_norm = random.randint(1, args.norm)  # in Norm.
-        activateds = random.sample([t for t in range(args.nByzs)], n_activated_byz)
-        activateds += random.sample([t + args.nByzs for t in range(args.norm)], n_activated_norm)
+        rng = streams.random('activation', epoch)
+        n_activated_byz = rng.randint(0, args.nByzs)  # in Byz.
+        n_activated_norm = rng.randint(1, args.norm)  # in Norm.
+        activateds = rng.sample([t for t in range(args.nByzs)], n_activated_byz)
+        activateds += rng.sample([t + args.nByzs for t in range(args.norm)], n_activated_norm)
+        dirty.update(activateds)
 
         current_nodes = []
         current_accs = []
+        untipped = []
+
+        if args.proposals == 'tips':
+            proposals = dag.sample_tips(args.nTips, rng=streams.random('tips', epoch))
+        else:
+            proposals = latest_nodes
+
+        distances = None  # among proposals, shared by the clients in a round (Krum)
+        groups = topology.group(proposals)
+
+        if recorder is not None:
+            recorder.begin_round(epoch, proposals, activateds)
 
         for a in tqdm(activateds):
             client = clients[a]
 
+            parents = [last_nodes.get(a, genesis)]
+
+            visible = topology.visible(a, proposals, groups)
+
             if a < args.nByzs:  # Byzantine node
                 pass  # skip averaging
+            elif not visible:  # none of her neighbors proposed, keep her own weights
+                client.adjust_opt(epoch)
+            elif args.aggregate != 'repute':  # Normal node, robust aggregation instead of election
+                client.adjust_opt(epoch)
+
+                candidates = [p for p in visible if p.creator != a]
+                weightses = [_receive(p, a, client) for p in candidates]
+                weightses.append(client.get_weights())
+
+                if args.nAssumed is not None:
+                    f = args.nAssumed
+                else:
+                    f = int(len(weightses) * args.nByzs / args.nNodes)
+
+                # proposals are received alike unless compressed relative to the receiver
+                shared = (compressor is None) and (len(candidates) == len(proposals))
+
+                if not candidates:
+                    new_weights = client.get_weights()
+                    elected_nodes = [client]
+                elif args.aggregate == 'krum':
+                    if shared and (distances is not None):
+                        D = distances
+                    else:
+                        D = aggregation.pairwise_distances(weightses[:-1])
+                        if shared:
+                            distances = D
+                    D = aggregation.extend_distances(D, weightses[:-1], weightses[-1])
+
+                    new_weights, selected = aggregation.krum(
+                        weightses, f=f, m=max(len(weightses) - f, 1), distances=D)
+                    elected_nodes = [(candidates[i] if i < len(candidates) else client) for i in selected]
+                elif args.aggregate == 'trimmed':
+                    new_weights = aggregation.trimmed_mean(weightses, b=f)
+                    elected_nodes = candidates + [client]
+                elif args.aggregate == 'median':
+                    new_weights = aggregation.median(weightses)
+                    elected_nodes = candidates + [client]
+
+                client.set_weights(new_weights)
+                if recorder is not None:
+                    recorder.elect(a, elected_nodes)
+
+                parents = [e if isinstance(e, Node) else last_nodes.get(a, genesis) for e in elected_nodes]
             else:  # Normal node
                 client.adjust_opt(epoch)
 
@@ -158,28 +447,41 @@ if __name__ == "__main__":
                 # TODO: parameterize
                 # TODO: ETA
                 tmp_client.set_dataset(trainset=None, testset=client.testset)
+                if evaluator is not None:
+                    evaluator.set_dataset(client.testset)
+                scores = dict() if recorder is not None else None
 
                 if args.repute == 'acc':
                     bests, idx_bests, _ = reputation.by_accuracy(
-                        proposals=latest_nodes, count=min(len(latest_nodes), 2), test_client=tmp_client,
+                        proposals=visible, count=min(len(visible), 2), test_client=tmp_client,
                         epoch=epoch, show=False, log=False,
-                        timing=False, optimal_stopping=args.op_stop)
+                        timing=False, optimal_stopping=args.op_stop, evaluator=evaluator, scores=scores,
+                        rng=streams.random('reputation', a, epoch))
                 elif args.repute == 'Frobenius':
                     bests, idx_bests, _ = reputation.by_Frobenius(
-                        proposals=latest_nodes, count=min(len(latest_nodes), 2), base_client=client, FN=args.filter,
+                        proposals=visible, count=min(len(visible), 2), base_client=client, FN=args.filter,
                         return_acc=True, test_client=tmp_client, epoch=epoch, show=False, log=False,
-                        timing=False, optimal_stopping=args.op_stop)
+                        timing=False, optimal_stopping=args.op_stop,
+                        sketcher=sketcher, rerank=args.rerank, index=index, evaluator=evaluator, scores=scores,
+                        rng=streams.random('reputation', a, epoch))
                 elif args.repute == 'random':
                     bests, idx_bests, _ = reputation.by_random(
-                        proposals=latest_nodes, count=min(len(latest_nodes), 2),
+                        proposals=visible, count=min(len(visible), 2),
                         return_acc=True, test_client=tmp_client, epoch=epoch, show=False, log=False,
-                        timing=False)
+                        timing=False, evaluator=evaluator, scores=scores,
+                        rng=streams.random('reputation', a, epoch))
                 elif args.repute == 'GNN':
                     pass  # TODO
                 else:
                     raise()  # err
 
-                best_nodes = [latest_nodes[idx_best] for idx_best in idx_bests]
+                if network is not None:  # downloads for scoring
+                    scored = [visible[i] for i in idx_bests] if args.repute == 'random' else visible
+                    for p in scored:
+                        if p.creator != a:
+                            network.fetch(p, a)
+
+                best_nodes = [visible[idx_best] for idx_best in idx_bests]
                 elected_nodes = []
                 elected_repus = []
 
@@ -211,11 +513,19 @@ if __name__ == "__main__":
                 """FL
                 # own weights + the other's weights
                 """
-                weightses = [e.get_weights() for e in elected_nodes]
+                weightses = [_receive(e, a, client) for e in elected_nodes]
                 repus_sum = sum(elected_repus)
-                repus = [e / repus_sum for e in elected_repus]
+                if repus_sum > 0:
+                    repus = [e / repus_sum for e in elected_repus]
+                else:  # e.g. all at 0% acc.
+                    repus = [1. / len(elected_repus) for _ in elected_repus]
 
                 client.set_average_weights(weightses, repus)
+                if recorder is not None:
+                    recorder.scores(a, scores, visible)
+                    recorder.elect(a, elected_nodes, repus)
+
+                parents = [e if isinstance(e, Node) else last_nodes.get(a, genesis) for e in elected_nodes]
 
             # train
             client.train(epoch, show=False, log=True)
@@ -223,18 +533,36 @@ if __name__ == "__main__":
             # for logging
             after_avg_acc = 100. - client.test(epoch, show=False, log=True)
             current_accs.append(after_avg_acc)
+            if recorder is not None:
+                recorder.acc(a, after_avg_acc)
 
             # save weights
             client.save()
 
             """DAG
-            # TODO
+            # TBA
             """
             # create node
             new_node = Node(
-                weights=client.get_weights(),
-                creator=a)
-            # nodes.append(new_node)
+                weights=_snapshot(client.get_weights()),
+                parents=parents,
+                creator=a,
+                _round=epoch,
+                version=(client.version if codec is None else None))  # decoded weights differ
+            untipped += dag.add(new_node)
+            if sketcher is not None:
+                sketcher.attach(new_node, FNs=(args.filter,))
+                if index is not None:
+                    index.add(new_node.get_id(), new_node.sketches[args.filter])
+            if codec is not None:
+                if args.codec_ref == 'previous':
+                    reference = last_nodes.get(a, parents[0])
+                else:
+                    reference = parents[0]
+                codec.attach(new_node, reference=reference)
+            if store is not None:
+                store.append(new_node)  # weights are memory-mapped from now on
+            last_nodes[a] = new_node
             current_nodes.append(new_node)
 
         """Log
@@ -244,6 +572,56 @@ if __name__ == "__main__":
         print(">>> latest_nodes:", [d.get_id() for d in latest_nodes])
         print(">>> current_nodes:", [d.get_id() for d in current_nodes])
         print(">>> current_accs:", current_accs)
+        step_times = [clients[a].step_time for a in activateds if clients[a].step_time is not None]
+        print(">>> %s %s: %.3fs/step, mean acc. %.2f" % (
+            args.precision, 'NHWC' if args.channels_last else 'NCHW',
+            sum(step_times) / max(len(step_times), 1), sum(current_accs) / len(current_accs)))
+        print(">>> DAG: %d nodes, %d tips" % (len(dag), len(dag.tips())))
+        if dedup is not None:
+            print(">>> dedup: %d layers shared, %d copied, %.1f MB saved" % (
+                dedup.shared, dedup.copied, dedup.saved / 2**20))
+        print(">>> tests: %d cached, %d run" % (Client.metrics.hits, Client.metrics.misses))
+        if network is not None:
+            report = network.end_round(epoch)
+            print(">>> network: %.1f MB (score %.1f MB, average %.1f MB), critical path %.2fs" % (
+                report['bytes'] / 2**20, report.get('bytes_score', 0.) / 2**20,
+                report.get('bytes_average', 0.) / 2**20, report['critical_path']))
+        if compressor is not None:
+            print(">>> compression: x%.2f over %d transfers, mean acc. %.2f" % (
+                compressor.ratio(), compressor.stats['transfers'], sum(current_accs) / len(current_accs)))
+        if codec is not None:
+            report = codec.report()
+            print(">>> codec: %.1f KB/node stored and sent (raw %.1f KB, x%.2f)" % (
+                report['stored_per_node'] / 1024, report['raw_per_node'] / 1024, report['ratio']))
         print()
 
-        latest_nodes = deepcopy(current_nodes)
+        # release weights which are no longer proposed
+        for node in untipped + latest_nodes:
+            if any(node is c for c in current_nodes):
+                continue
+            if (args.proposals == 'tips') and dag.is_tip(node):
+                continue
+            node.release()
+            if index is not None:
+                index.remove(node.get_id())
+
+        latest_nodes = current_nodes
+
+        if recorder is not None:
+            recorder.end_round(epoch)
+        if summary is not None:
+            _summarize(epoch, dict(zip(activateds, current_accs)), done=(epoch == args.nEpochs))
+
+        if (checkpointer is not None) and checkpointer.due(epoch):
+            checkpointer.save(
+                epoch, clients, dirty, dag, latest_nodes, last_nodes,
+                codec=codec, compressor=compressor, index=index, network=network,
+                byzantines=range(args.nByzs), cuda=args.cuda)
+            dirty = set()
+
+    if checkpointer is not None:
+        checkpointer.wait()
+    if store is not None:
+        store.close()
+    if evaluator is not None:
+        evaluator.close()
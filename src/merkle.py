@@ -0,0 +1,190 @@
+"""
+Per-layer Merkle tree of weights
+
+# leaf:      sha256(0x00 | name | dtype | shape | raw bytes), one per parameter, in sorted key order
+# internal:  sha256(0x01 | left | right); an odd node is carried up as is
+# Leaf digests are cached by the memory they hash (storage, offset, shape, strides, dtype) and checked
+# against the tensor's version counter (`Tensor._version`), so only changed layers are rehashed;
+# the tree above them is a few hundred 32-byte hashes.
+# The counter is shared by a tensor, its views and its `detach()`es, and bumped by every in-place op
+# on any of them (incl. optimizer steps): `Client.get_weights` returns `detach()`es, so a new dict of
+# the same parameters hits the cache, and a held one sees training.
+# Writes through `.data` do not bump it: use `detach()` (as `weights.Weights` does).
+"""
+import hashlib
+import weakref
+
+from torch.multiprocessing.reductions import StorageWeakRef
+
+from weights import _raw
+
+
+def leaf_digest(name, tensor):
+    h = hashlib.sha256(b'\x00')
+    h.update(name.encode())
+    h.update(str(tensor.dtype).encode())
+    h.update(str(tuple(tensor.size())).encode())
+    if tensor.numel():
+        h.update(_raw(tensor))
+    return h.digest()
+
+
+def _node(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _storage(tensor):
+    return tensor.untyped_storage() if hasattr(tensor, 'untyped_storage') else tensor.storage()
+
+
+class Digests:
+    # (data_ptr, offset, shape, strides, dtype) -> (storage weakref, version, name, digest)
+    # A freed storage's entry is dead (its address may be reused): pruned as entries grow.
+    def __init__(self):
+        self._entries = dict()
+        self._pruned = 0  # entries after the last prune
+        self.hashed, self.cached = 0, 0
+
+    @staticmethod
+    def _key(tensor):
+        return (_storage(tensor).data_ptr(), tensor.storage_offset(), tuple(tensor.size()), tensor.stride(),
+                tensor.dtype)
+
+    def _prune(self):
+        if len(self._entries) > 2 * self._pruned + 1024:
+            self._entries = {k: e for k, e in self._entries.items() if not e[0].expired()}
+            self._pruned = len(self._entries)
+
+    def put(self, name, tensor, digest):
+        self._entries[self._key(tensor)] = (StorageWeakRef(_storage(tensor)), tensor._version, name, digest)
+        self._prune()
+
+    def get(self, name, tensor):
+        entry = self._entries.get(self._key(tensor))
+        if (entry is not None) and (entry[1] == tensor._version) and (entry[2] == name) and not entry[0].expired():
+            self.cached += 1
+            return entry[3]
+
+        self.hashed += 1
+        digest = leaf_digest(name, tensor)
+        self.put(name, tensor, digest)
+        return digest
+
+
+DIGESTS = Digests()  # shared
+
+
+class MerkleTree:
+    def __init__(self, weights, digests=None):
+        # weights: `Weights (dict)`
+        digests = digests if digests is not None else DIGESTS
+
+        self.names = sorted(weights.keys())
+        self.leaves = {name: digests.get(name, weights[name]) for name in self.names}
+
+        level = [self.leaves[name] for name in self.names]
+        self.levels = [level]
+        while len(level) > 1:
+            level = [_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                     for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+        self.root = level[0] if level else hashlib.sha256(b'').digest()
+
+    def hex(self):
+        return self.root.hex()
+
+    def diff(self, other):
+        # names of layers which differ from `other` (a `MerkleTree`), incl. missing ones
+        names = set(self.names) | set(other.names)
+        return sorted(n for n in names if self.leaves.get(n) != other.leaves.get(n))
+
+    """proof of inclusion
+    # [(sibling digest, sibling is on the left)], leaf to root
+    """
+
+    def proof(self, name):
+        i = self.names.index(name)
+        path = []
+        for level in self.levels[:-1]:
+            sibling = i ^ 1
+            if sibling < len(level):
+                path.append((level[sibling], sibling < i))
+            i //= 2
+        return path
+
+
+def verify(root, name, tensor_or_digest, proof):
+    digest = tensor_or_digest if isinstance(tensor_or_digest, bytes) else leaf_digest(name, tensor_or_digest)
+    for sibling, left in proof:
+        digest = _node(sibling, digest) if left else _node(digest, sibling)
+    return digest == root
+
+
+"""dedup
+# TBA
+"""
+
+
+class Dedup:
+    # digest -> a live tensor with that content; identical layers of new snapshots share it
+    def __init__(self, digests=None):
+        self.digests = digests if digests is not None else DIGESTS
+        self._tensors = dict()  # digest -> weakref
+        self.shared, self.copied = 0, 0
+        self.saved = 0  # bytes
+
+    def _forget(self, digest, ref):
+        if self._tensors.get(digest) is ref:
+            del self._tensors[digest]
+
+    def snapshot(self, weights):
+        # immutable copy of `weights`, like {name: value.clone()}, but layers seen before are not copied
+        res = dict()
+        for name, value in weights.items():
+            digest = self.digests.get(name, value)
+            ref = self._tensors.get(digest)
+            tensor = ref() if ref is not None else None
+            if tensor is not None:
+                self.shared += 1
+                self.saved += tensor.numel() * tensor.element_size()
+            else:
+                self.copied += 1
+                tensor = value.detach().clone()
+                self.digests.put(name, tensor, digest)
+                self._tensors[digest] = weakref.ref(tensor, lambda r, d=digest: self._forget(d, r))
+            res[name] = tensor
+        return res
+
+
+if __name__ == "__main__":
+    import time
+
+    import torch
+
+    from net import DenseNet
+    from weights import Weights
+
+    net = DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10)
+    w = Weights(net.named_parameters())
+
+    for label in ('cold', 'warm'):
+        start = time.time()
+        tree = MerkleTree(w)
+        print('%s %.2f ms, %d hashed, %d cached' % (label, (time.time() - start) * 1e3, DIGESTS.hashed, DIGESTS.cached))
+
+    before = tree
+    with torch.no_grad():
+        net.fc.weight.add_(1.)  # fine-tune the last layer only
+    tree = MerkleTree(w)
+    print(before.diff(tree), DIGESTS.hashed)
+
+    name = 'fc.weight'
+    print(verify(tree.root, name, w[name], tree.proof(name)), verify(before.root, name, w[name], tree.proof(name)))
+
+    dedup = Dedup()
+    a = dedup.snapshot(w)
+    with torch.no_grad():
+        net.fc.bias.add_(1.)
+    b = dedup.snapshot(w)
+    print(dedup.shared, dedup.copied, '%.1f MB saved' % (dedup.saved / 2**20), a['conv1.weight'] is b['conv1.weight'])
@@ -8,17 +8,115 @@ import torch.optim as optim
 import torch.nn.functional as F
 from torch.autograd import Variable
 
-import torchvision.models as models
-import torchvision.datasets as dset
-import torchvision.transforms as transforms
-from torchvision.utils import save_image
-
 from torch.utils.data import DataLoader
+from torch.utils.checkpoint import checkpoint
 
 import math
+import inspect
+import operator
+import functools
+import threading
+import contextlib
+
+
+"""precision and layout
+# bf16: forward/backward under CPU autocast, master weights stay fp32
+# channels-last: NHWC memory format for the net and inputs
+"""
+
+
+def autocast(precision='fp32', cuda=False):
+    if precision == 'bf16':
+        if hasattr(torch, 'autocast'):  # torch >= 1.10
+            return torch.autocast('cuda' if cuda else 'cpu', dtype=torch.bfloat16)
+        raise RuntimeError("bf16 autocast requires torch >= 1.10 but {}.".format(torch.__version__))
+    return contextlib.nullcontext()
+
+
+def to_layout(x, channels_last=False):
+    # x: a `Tensor` (NCHW) or a `Module`
+    if channels_last:
+        if isinstance(x, nn.Module):
+            return x.to(memory_format=torch.channels_last)
+        return x.contiguous(memory_format=torch.channels_last)
+    return x
+
+
+"""memory-efficient dense blocks
+# A layer reads the concat. of all the previous features but keeps only its own outputs:
+# concat -> BN -> ReLU -> conv1 runs in a shared scratch buffer and is recomputed in backward,
+# so the activations kept for backward grow linearly (not quadratically) with depth.
+# `checkpoint_every`: recompute every k-th layer only (k > 1: faster, more memory; 0: never)
+# Same parameters (names) and numerics as the default blocks.
+# Ref. https://arxiv.org/abs/1707.06990
+"""
+
+_REENTRANT = {'use_reentrant': True} if 'use_reentrant' in inspect.signature(checkpoint).parameters else {}
+
+
+class _Scratch(threading.local):
+    # shared concat. storage, grown on demand, per thread and (device, dtype)
+    def __init__(self):
+        self._buffers = dict()
+
+    def cat(self, features):
+        dtype = functools.reduce(torch.promote_types, [f.dtype for f in features])
+        shape = list(features[0].shape)
+        shape[1] = sum(f.size(1) for f in features)
+        numel = functools.reduce(operator.mul, shape, 1)
+
+        key = (features[0].device, dtype)
+        buf = self._buffers.get(key)
+        if (buf is None) or (buf.numel() < numel):
+            buf = self._buffers[key] = torch.empty(numel, dtype=dtype, device=features[0].device)
+
+        return torch.cat(features, 1, out=buf[:numel].view(shape))
+
+
+_scratch = _Scratch()
 
 
-class Bottleneck(nn.Module):
+def _concat_bn_relu_conv(bn, conv, features, recompute=False):
+    if torch.is_grad_enabled():
+        x = torch.cat(features, 1)
+    else:  # not kept for backward (checkpointed forward or eval.)
+        x = _scratch.cat(features)
+
+    if recompute and bn.training:  # same batch statistics, running ones are not updated twice
+        x = F.batch_norm(x, None, None, bn.weight, bn.bias, True, 0., bn.eps)
+    else:
+        x = bn(x)
+
+    return conv(F.relu(x))
+
+
+class _DenseLayer:
+    # mixin; `bn1` and `conv1` read the concat. of `features`
+    def _checkpointed(self, *features):
+        # called under no_grad in forward, again with grad in backward
+        return _concat_bn_relu_conv(self.bn1, self.conv1, features, recompute=torch.is_grad_enabled())
+
+    def _first(self, features, recompute=False):
+        if recompute:
+            return checkpoint(self._checkpointed, *features, **_REENTRANT)
+        return _concat_bn_relu_conv(self.bn1, self.conv1, features)
+
+
+class _DenseBlock(nn.Sequential):
+    def __init__(self, *layers, checkpoint_every=1):
+        super(_DenseBlock, self).__init__(*layers)
+        self.checkpoint_every = checkpoint_every
+
+    def forward(self, x):
+        features = [x]
+        for i, layer in enumerate(self):
+            recompute = self.training and (self.checkpoint_every > 0) and (i % self.checkpoint_every == 0) \
+                and any(f.requires_grad for f in features)
+            features.append(layer.new_features(features, recompute))
+        return torch.cat(features, 1)
+
+
+class Bottleneck(nn.Module, _DenseLayer):
     def __init__(self, nChannels, growthRate):
         super(Bottleneck, self).__init__()
         interChannels = 4 * growthRate
@@ -35,8 +133,12 @@ class Bottleneck(nn.Module):
         out = torch.cat((x, out), 1)
         return out
 
+    def new_features(self, features, recompute=False):
+        out = self._first(features, recompute)
+        return self.conv2(F.relu(self.bn2(out)))
+
 
-class SingleLayer(nn.Module):
+class SingleLayer(nn.Module, _DenseLayer):
     def __init__(self, nChannels, growthRate):
         super(SingleLayer, self).__init__()
         self.bn1 = nn.BatchNorm2d(nChannels)
@@ -48,6 +150,9 @@ class SingleLayer(nn.Module):
         out = torch.cat((x, out), 1)
         return out
 
+    def new_features(self, features, recompute=False):
+        return self._first(features, recompute)
+
 
 class Transition(nn.Module):
     def __init__(self, nChannels, nOutChannels):
@@ -63,9 +168,12 @@ class Transition(nn.Module):
 
 
 class DenseNet(nn.Module):
-    def __init__(self, growthRate, depth, reduction, nClasses, bottleneck):
+    def __init__(self, growthRate, depth, reduction, nClasses, bottleneck, efficient=False, checkpoint_every=1):
         super(DenseNet, self).__init__()
 
+        self.efficient = efficient  # see `_DenseBlock`
+        self.checkpoint_every = checkpoint_every
+
         nDenseBlocks = (depth - 4) // 3
         if bottleneck:
             nDenseBlocks //= 2
@@ -109,6 +217,8 @@ class DenseNet(nn.Module):
             else:
                 layers.append(SingleLayer(nChannels, growthRate))
             nChannels += growthRate
+        if self.efficient:
+            return _DenseBlock(*layers, checkpoint_every=self.checkpoint_every)
         return nn.Sequential(*layers)
 
     def forward(self, x):
@@ -116,11 +226,22 @@ class DenseNet(nn.Module):
         out = self.trans1(self.dense1(out))
         out = self.trans2(self.dense2(out))
         out = self.dense3(out)
-        out = torch.squeeze(F.avg_pool2d(F.relu(self.bn1(out)), 8))
+        out = torch.flatten(F.avg_pool2d(F.relu(self.bn1(out)), 8), 1)  # not squeeze: a batch may be of 1
         out = F.log_softmax(self.fc(out), dim=1)
         return out
 
 
+def materialize(make_net, state_dict):
+    # a net of `make_net()` holding `state_dict`
+    # its (overwritten) random init. does not consume the global RNG, so results do not depend
+    # on when (or whether) a net is materialized
+    with torch.random.fork_rng(devices=[]):
+        net = make_net()
+
+    net.load_state_dict(state_dict)
+    return net
+
+
 def train(args, epoch, net, trainLoader, optimizer, logger=None, show=False):
     if (not show) and (logger is None):
         return
@@ -130,14 +251,19 @@ def train(args, epoch, net, trainLoader, optimizer, logger=None, show=False):
     nProcessed = 0
     nTrain = len(trainLoader.dataset)
 
+    precision = getattr(args, 'precision', 'fp32')
+    channels_last = getattr(args, 'channels_last', False)
+
     for batch_idx, (data, target) in enumerate(trainLoader):
         if args.cuda:
             data, target = data.cuda(), target.cuda()
+        data = to_layout(data, channels_last)
 
         data, target = Variable(data), Variable(target)
         optimizer.zero_grad()
-        output = net(data)
-        loss = F.nll_loss(output, target)
+        with autocast(precision, args.cuda):
+            output = net(data).float()
+            loss = F.nll_loss(output, target)
         loss.backward()
         optimizer.step()
 
@@ -166,13 +292,17 @@ def test(args, epoch, net, testLoader, optimizer, logger=None, show=True):
     test_loss = 0
     incorrect = 0
 
+    precision = getattr(args, 'precision', 'fp32')
+    channels_last = getattr(args, 'channels_last', False)
+
     for data, target in testLoader:
         if args.cuda:
             data, target = data.cuda(), target.cuda()
+        data = to_layout(data, channels_last)
 
-        with torch.no_grad():
+        with torch.no_grad(), autocast(precision, args.cuda):
             # data, target = Variable(data), Variable(target)
-            output = net(data)
+            output = net(data).float()
             test_loss += F.nll_loss(output, target).item()
             pred = output.data.max(1)[1]  # get the index of the max log-probability
             incorrect += pred.ne(target.data).cpu().sum()
@@ -209,8 +339,11 @@ def adjust_opt(optAlg, optimizer, epoch):
 if __name__ == '__main__':
     import argparse
     import setproctitle
+    import torchvision.datasets as dset
+    import torchvision.transforms as transforms
     import os
     import shutil
+    import time
 
     """argparse"""
     parser = argparse.ArgumentParser()
@@ -222,6 +355,11 @@ if __name__ == '__main__':
     parser.add_argument('--seed', type=int, default=1)
     parser.add_argument('--opt', type=str, default='sgd',
                         choices=('sgd', 'adam', 'rmsprop'))
+    parser.add_argument('--precision', type=str, default='fp32',
+                        choices=('fp32', 'bf16'))
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--efficient', action='store_true')  # memory-efficient dense blocks
+    parser.add_argument('--checkpoint-every', type=int, default=1)
     args = parser.parse_args()
 
     args.cuda = not args.no_cuda and torch.cuda.is_available()
@@ -270,9 +408,11 @@ if __name__ == '__main__':
     """net
     # TODO: remove batch normalization (and residual connection ?)
     """
-    net = DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10)
+    net = DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10,
+                   efficient=args.efficient, checkpoint_every=args.checkpoint_every)
     print('>>> Number of params: {}'.format(
         sum([p.data.nelement() for p in net.parameters()])))
+    net = to_layout(net, args.channels_last)
 
     if args.cuda:
 
@@ -311,7 +451,11 @@ if __name__ == '__main__':
 
         adjust_opt(args.opt, optimizer, epoch)
 
+        start = time.time()
         train(args, epoch, net, trainLoader, optimizer, show=True, logger=trainF)
+        print('>>> {} {}: {:.3f}s/step'.format(
+            args.precision, 'NHWC' if args.channels_last else 'NCHW',
+            (time.time() - start) / len(trainLoader)))
         test(args, epoch, net, testLoader, optimizer, show=True, logger=testF)
 
         # save
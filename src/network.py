@@ -0,0 +1,127 @@
+"""
+Simulated network
+
+# Every weight transfer (node -> client) is recorded and charged
+#   time = latency + nbytes / bandwidth
+# where the bandwidth of a transfer is the slowest of the sender's uplink, the receiver's downlink,
+# and the link itself (if it is set).
+# A client downloads (and a creator uploads) one transfer at a time and clients run in parallel,
+# so the critical path of a round is the busiest uplink or downlink.
+"""
+import numpy as np
+
+import weights
+
+
+MBPS = 1e6 / 8  # bytes per second
+
+
+def nbytes_of(node):
+    encoded = getattr(node, 'encoded', None)
+    if encoded is not None:
+        return encoded.nbytes
+    return weights.nbytes(node.get_weights())  # as sent, see `weights.to_bytes`
+
+
+class Network:
+    def __init__(self, nNodes, bandwidth=100 * MBPS, latency=0.01):
+        # per-client uplink/downlink (bytes/s); index -1 (`nNodes`) is the genesis/archive
+        self.uplink = np.full(nNodes + 1, bandwidth, dtype=np.float64)
+        self.downlink = np.full(nNodes + 1, bandwidth, dtype=np.float64)
+        self.latency = np.full(nNodes + 1, latency, dtype=np.float64)
+
+        self.links = dict()  # (src, dst) -> (bandwidth, latency)
+
+        self._nbytes = dict()  # node id -> payload size
+
+        # current round
+        self._src, self._dst, self._size, self._purpose = [], [], [], []
+
+        self.history = []  # per-round reports
+
+    def set_client(self, client, uplink=None, downlink=None, latency=None):
+        if uplink is not None:
+            self.uplink[client] = uplink
+        if downlink is not None:
+            self.downlink[client] = downlink
+        if latency is not None:
+            self.latency[client] = latency
+
+    def set_link(self, src, dst, bandwidth, latency=None):
+        self.links[(src, dst)] = (bandwidth, latency)
+
+    """record
+    # O(1) per transfer, costs are computed once per round
+    """
+
+    def transfer(self, src, dst, nbytes, purpose='score'):
+        self._src.append(-1 if src is None else src)
+        self._dst.append(dst)
+        self._size.append(nbytes)
+        self._purpose.append(purpose)
+
+    def fetch(self, node, client, purpose='score', nbytes=None):
+        if nbytes is None:
+            _id = node.get_id()
+            if _id not in self._nbytes:
+                self._nbytes[_id] = nbytes_of(node)
+            nbytes = self._nbytes[_id]
+        self.transfer(node.creator, client, nbytes, purpose)
+
+    def end_round(self, epoch):
+        src = np.asarray(self._src, dtype=np.int64)
+        dst = np.asarray(self._dst, dtype=np.int64)
+        size = np.asarray(self._size, dtype=np.float64)
+
+        bandwidth = np.minimum(self.uplink[src], self.downlink[dst])
+        latency = np.maximum(self.latency[src], self.latency[dst])
+        if self.links:
+            for i, (s, d) in enumerate(zip(self._src, self._dst)):
+                if (s, d) in self.links:
+                    b, l = self.links[(s, d)]
+                    bandwidth[i] = min(bandwidth[i], b)
+                    if l is not None:
+                        latency[i] = l
+        time = latency + size / bandwidth
+
+        n = len(self.uplink)
+        download = np.bincount(dst, weights=time, minlength=n)
+        upload = np.bincount(src % n, weights=size / self.uplink[src], minlength=n)
+
+        report = {
+            'round': epoch,
+            'transfers': len(size),
+            'bytes': size.sum(),
+            'critical_path': max(download.max(), upload.max()) if len(size) else 0.}
+        purposes = np.asarray(self._purpose)
+        for purpose in set(self._purpose):
+            report['bytes_' + purpose] = size[purposes == purpose].sum()
+
+        self.history.append(report)
+        self._src, self._dst, self._size, self._purpose = [], [], [], []
+
+        return report
+
+    def total(self):
+        return {
+            'rounds': len(self.history),
+            'bytes': sum(r['bytes'] for r in self.history),
+            'time': sum(r['critical_path'] for r in self.history)}
+
+
+if __name__ == "__main__":
+    import time
+
+    net = Network(100, bandwidth=100 * MBPS, latency=0.01)
+    net.set_client(3, downlink=10 * MBPS)  # a slow client
+    net.set_link(5, 3, 1 * MBPS)
+
+    start = time.time()
+    for epoch in range(1, 11):
+        for dst in range(100):
+            for src in range(50):
+                net.transfer(src, dst, 3 * 1024 * 1024)
+        net.transfer(5, 3, 3 * 1024 * 1024, purpose='average')
+        report = net.end_round(epoch)
+    print(report)
+    print(net.total(), time.time() - start)
@@ -0,0 +1,180 @@
+"""
+Non-IID data partitioning
+
+# Every scheme is vectorized: samples are assigned to clients by label, with no per-sample loop.
+#   iid:        a random permutation, split evenly
+#   pareto:     client i draws `major` of her samples from class i % C, the rest evenly (80:20)
+#   dirichlet:  per class, client shares ~ Dir(alpha); small alpha, more skewed
+#   shards:     sorted by label, cut into nNodes * nShards shards, `nShards` random shards per client
+# A client's testset follows the class mix of her trainset.
+# Every client gets at least one sample of each split: an empty one takes a random sample of the largest.
+# Indices are cached on disk, keyed by (scheme, params, seed, nNodes, labels).
+"""
+import os
+import json
+import hashlib
+
+import numpy as np
+
+
+SCHEMES = ('iid', 'pareto', 'dirichlet', 'shards')
+
+
+def _assign(labels, shares, rng):
+    # labels: (N,), shares: (C, nNodes), rows sum to 1 -> owner of each sample
+    nClasses, nNodes = shares.shape
+    owner = np.empty(len(labels), dtype=np.int64)
+
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=nClasses)
+    starts = np.concatenate(([0], np.cumsum(counts)))
+
+    for c in range(nClasses):  # O(C) numpy calls
+        idx = order[starts[c]:starts[c + 1]]
+        idx = idx[rng.permutation(len(idx))]
+        cuts = np.round(np.cumsum(shares[c]) * len(idx)).astype(np.int64)
+        owner[idx] = np.searchsorted(cuts, np.arange(len(idx)), side='right')
+
+    return owner
+
+
+def _group(owner, nNodes):
+    # owner -> [indices of client i]
+    order = np.argsort(owner, kind='stable')
+    ends = np.cumsum(np.bincount(owner, minlength=nNodes))
+    return np.split(order, ends[:-1])
+
+
+def _fill(idxes, rng):
+    # [indices of client i] -> none empty, given enough samples; O(empty * nNodes)
+    sizes = np.array([len(idx) for idx in idxes], dtype=np.int64)
+    empty = np.flatnonzero(sizes == 0)
+    if len(empty) == 0:
+        return idxes
+
+    idxes = list(idxes)
+    for j in rng.permutation(empty).tolist():
+        d = int(np.argmax(sizes))
+        k = int(rng.integers(sizes[d]))
+        idxes[j] = idxes[d][k:k + 1]
+        idxes[d] = np.delete(idxes[d], k)
+        sizes[d] -= 1
+        sizes[j] = 1
+    return idxes
+
+
+def _shares(scheme, nClasses, nNodes, rng, major=0.8, alpha=0.5):
+    if scheme == 'pareto':
+        P = np.full((nNodes, nClasses), (1. - major) / max(nClasses - 1, 1))
+        P[np.arange(nNodes), np.arange(nNodes) % nClasses] = major
+        return (P / P.sum(0)).T
+    if scheme == 'dirichlet':
+        return rng.dirichlet(np.full(nNodes, alpha), size=nClasses)
+    raise ValueError("Unknown scheme: {}".format(scheme))
+
+
+def _shards(labels, nNodes, nShards, perm):
+    # perm: client slot -> shard; the same for train and test
+    nTotal = nNodes * nShards
+    sizes = np.full(nTotal, len(labels) // nTotal)
+    sizes[:len(labels) % nTotal] += 1  # as `np.array_split`
+
+    client = np.empty(nTotal, dtype=np.int64)
+    client[perm] = np.arange(nTotal) // nShards
+
+    owner = np.empty(len(labels), dtype=np.int64)
+    owner[np.argsort(labels, kind='stable')] = np.repeat(client, sizes)
+    return _group(owner, nNodes)
+
+
+def split(train_labels, test_labels, nNodes, scheme='iid', seed=0, major=0.8, alpha=0.5, nShards=2):
+    # returns ([train indices of client i], [test indices of client i]), none empty
+    train_labels = np.asarray(train_labels, dtype=np.int64)
+    test_labels = np.asarray(test_labels, dtype=np.int64)
+    for labels in (train_labels, test_labels):
+        if len(labels) < nNodes:
+            raise ValueError("{} samples for {} clients.".format(len(labels), nNodes))
+    nClasses = int(max(train_labels.max(), test_labels.max())) + 1
+    rng = np.random.default_rng(seed)
+
+    if scheme == 'iid':
+        return tuple(np.array_split(rng.permutation(len(labels)), nNodes) for labels in (train_labels, test_labels))
+
+    if scheme == 'shards':
+        perm = rng.permutation(nNodes * nShards)
+        res = _shards(train_labels, nNodes, nShards, perm), _shards(test_labels, nNodes, nShards, perm)
+    else:
+        shares = _shares(scheme, nClasses, nNodes, rng, major=major, alpha=alpha)
+        res = tuple(_group(_assign(labels, shares, rng), nNodes) for labels in (train_labels, test_labels))
+    return tuple(_fill(idxes, rng) for idxes in res)
+
+
+"""cache
+# one .npz per key: concatenated indices and offsets
+"""
+
+
+def _key(train_labels, test_labels, nNodes, scheme, seed, params):
+    h = hashlib.sha1(json.dumps([scheme, sorted(params.items()), seed, nNodes, 'fill']).encode())  # not before `_fill`
+    for labels in (train_labels, test_labels):
+        h.update(np.ascontiguousarray(labels, dtype=np.int64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def partition(train_labels, test_labels, nNodes, scheme='iid', seed=0, cache=None, **params):
+    # `split` with an on-disk cache (directory `cache`)
+    if cache is None:
+        return split(train_labels, test_labels, nNodes, scheme, seed, **params)
+
+    path = os.path.join(cache, '{}-{}.npz'.format(scheme, _key(train_labels, test_labels, nNodes, scheme, seed, params)))
+    if os.path.isfile(path):
+        with np.load(path) as f:
+            return tuple(np.split(f[name], f[name + '_offsets']) for name in ('train', 'test'))
+
+    res = split(train_labels, test_labels, nNodes, scheme, seed, **params)
+
+    os.makedirs(cache, exist_ok=True)
+    arrays = dict()
+    for name, idxes in zip(('train', 'test'), res):
+        arrays[name] = np.concatenate(idxes)
+        arrays[name + '_offsets'] = np.cumsum([len(idx) for idx in idxes])[:-1]
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+    return res
+
+
+def histogram(labels, idxes, nClasses=10):
+    # (nNodes, nClasses) label counts, see `TODO/visualization.heatmap`
+    labels = np.asarray(labels, dtype=np.int64)
+    owner = np.repeat(np.arange(len(idxes)), [len(idx) for idx in idxes])
+    return np.bincount(owner * nClasses + labels[np.concatenate(idxes)],
+                       minlength=len(idxes) * nClasses).reshape(len(idxes), nClasses)
+
+
+if __name__ == "__main__":
+    import time
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    train_labels = np.repeat(np.arange(10), 5000)[rng.permutation(50000)]  # CIFAR-10 like
+    test_labels = np.repeat(np.arange(10), 1000)[rng.permutation(10000)]
+
+    cache = tempfile.mkdtemp()
+    for scheme in SCHEMES:
+        for nNodes in (100, 10000):
+            start = time.time()
+            train, test = partition(train_labels, test_labels, nNodes, scheme, seed=1, cache=cache)
+            elapsed = time.time() - start
+
+            start = time.time()
+            cached, _ = partition(train_labels, test_labels, nNodes, scheme, seed=1, cache=cache)
+            hit = time.time() - start
+
+            assert np.array_equal(np.sort(np.concatenate(train)), np.arange(50000))
+            assert min(len(idx) for idx in train + test) > 0
+            assert all(np.array_equal(a, b) for a, b in zip(train, cached))
+            print('%-9s nNodes=%5d  %.1fms (cached %.1fms)' % (scheme, nNodes, elapsed * 1e3, hit * 1e3))
+
+        print(histogram(train_labels, train)[:3])
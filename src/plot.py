@@ -1,12 +1,23 @@
 """Ref
 # https://github.com/bamos/densenet.pytorch/blob/master/plot.py
+
+# One process for a whole experiment tree, e.g. `python src/plot.py data`
+# - every directory with `train.csv`/`test.csv` (a client) is plotted by a pool of workers
+# - unchanged directories are skipped (size/mtime manifest), changed logs are read from their last offset
+# - the parent of clients (an experiment) gets aggregate curves: mean and quantiles across its clients
 """
 import argparse
 import os
+import json
+import hashlib
+from multiprocessing import Pool
+
 import numpy as np
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+
+MANIFEST = '.plot-manifest.json'
+CACHE = '.plot-cache.npz'
+LOGS = ('train', 'test')
 
 
 def rolling(N, i, loss, err):
@@ -17,56 +28,220 @@ def rolling(N, i, loss, err):
     return i_, loss_, err_
 
 
+"""incremental read
+# a log is only appended to; rewritten (e.g. a new run) if it shrinks or its head changes
+"""
+
+
+def _head(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(256)).hexdigest()
+
+
+def _parse(chunk):
+    if not chunk.strip():
+        return np.empty((0, 3))
+    return np.array(chunk.decode().replace(',', ' ').split(), dtype=float).reshape(-1, 3)
+
+
+def _read(path, entry, rows):
+    # entry: {'size', 'mtime', 'offset', 'head'} of the last read, rows: parsed so far
+    st = os.stat(path)
+    if entry and (entry['size'] == st.st_size) and (entry['mtime'] == st.st_mtime):
+        return entry, rows, False
+
+    head = _head(path)
+    if (not entry) or (st.st_size < entry['offset']) or (entry['head'] != head):
+        entry, rows = {'offset': 0}, np.empty((0, 3))
+
+    with open(path, 'rb') as f:
+        f.seek(entry['offset'])
+        chunk = f.read()
+    end = chunk.rfind(b'\n') + 1  # complete lines only
+
+    rows = np.concatenate((rows, _parse(chunk[:end])))
+    entry = {'size': st.st_size, 'mtime': st.st_mtime, 'offset': entry['offset'] + end, 'head': head}
+    return entry, rows, True
+
+
+"""plot
+# TBA
+"""
+
+
+def _plot_client(expDir, train, test):
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+
+    created = []
+    for ylabel, col, name in (('Cross-Entropy Loss', 1, 'loss'), ('Error', 2, 'error')):
+        fig, ax = plt.subplots(1, 1, figsize=(6, 5))
+        ax.plot(train[:, 0], train[:, col], label='Train')
+        ax.plot(test[:, 0], test[:, col], label='Test')
+        ax.set_xlabel('Epoch')
+        ax.set_ylabel(ylabel)
+        ax.set_yscale('log')
+        ax.legend()
+        fname = os.path.join(expDir, name + '.png')
+        fig.savefig(fname)
+        plt.close(fig)
+        created.append(fname)
+
+    # side by side, instead of `convert +append`
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for ax, (ylabel, col) in zip(axes, (('Cross-Entropy Loss', 1), ('Error', 2))):
+        ax.plot(train[:, 0], train[:, col], label='Train')
+        ax.plot(test[:, 0], test[:, col], label='Test')
+        ax.set_xlabel('Epoch')
+        ax.set_ylabel(ylabel)
+        ax.set_yscale('log')
+        ax.legend()
+    fname = os.path.join(expDir, 'loss-error.png')
+    fig.savefig(fname)
+    plt.close(fig)
+    created.append(fname)
+
+    return created
+
+
+def process(job):
+    # one client directory; returns (expDir, manifest entries, test rows, created files)
+    expDir, entries, force = job
+
+    cache = dict()
+    cache_f = os.path.join(expDir, CACHE)
+    if os.path.isfile(cache_f):
+        with np.load(cache_f) as f:
+            cache = {log: f[log] for log in LOGS}
+
+    changed = False
+    rows = dict()
+    for log in LOGS:
+        entry, rows[log], updated = _read(
+            os.path.join(expDir, log + '.csv'), entries.get(log), cache.get(log, np.empty((0, 3))))
+        entries[log] = entry
+        changed |= updated
+
+    if changed or not cache:
+        np.savez(cache_f, **rows)
+
+    created = []
+    if changed or force or not os.path.isfile(os.path.join(expDir, 'loss-error.png')):
+        created = _plot_client(expDir, rows['train'], rows['test'])
+
+    return expDir, entries, rows['test'], created
+
+
+"""aggregate
+# per epoch, across the clients which logged it
+"""
+
+
+def aggregate(tests, qs=(0.25, 0.5, 0.75)):
+    # tests: [(epoch, loss, err) rows] -> (N, 2 + 2 * (1 + len(qs))):
+    # epoch, count, mean loss, loss quantiles, mean err, err quantiles
+    rows = np.concatenate([t for t in tests if len(t)]) if any(len(t) for t in tests) else np.empty((0, 3))
+    if not len(rows):
+        return np.empty((0, 2 + 2 * (1 + len(qs))))
+
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    epochs, starts, counts = np.unique(rows[:, 0], return_index=True, return_counts=True)
+
+    res = [epochs, counts.astype(np.float64)]
+    for col in (1, 2):
+        groups = np.split(rows[:, col], starts[1:])
+        res.append(np.array([np.nanmean(g) for g in groups]))
+        for q in qs:
+            res.append(np.array([np.nanquantile(g, q) for g in groups]))
+    return np.stack(res, axis=1)
+
+
+def _plot_aggregate(expDir, agg):
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+
+    np.savetxt(os.path.join(expDir, 'aggregate.csv'), agg, delimiter=',', fmt='%g',
+               header='epoch,count,loss_mean,loss_q25,loss_q50,loss_q75,err_mean,err_q25,err_q50,err_q75')
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for ax, (ylabel, col) in zip(axes, (('Cross-Entropy Loss', 2), ('Error', 6))):
+        ax.fill_between(agg[:, 0], agg[:, col + 1], agg[:, col + 3], alpha=0.3, label='25-75%')
+        ax.plot(agg[:, 0], agg[:, col + 2], '--', label='Median')
+        ax.plot(agg[:, 0], agg[:, col], label='Mean')
+        ax.set_xlabel('Epoch')
+        ax.set_ylabel('Test ' + ylabel)
+        ax.legend()
+    fname = os.path.join(expDir, 'aggregate.png')
+    fig.savefig(fname)
+    plt.close(fig)
+
+    return fname
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('expDir', type=str)
+    parser.add_argument('expDir', type=str)  # a client, an experiment, or a tree of them
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--force', action='store_true')  # ignore the manifest
     args = parser.parse_args()
 
-    try:
-        trainP = os.path.join(args.expDir, 'train.csv')
-        trainData = np.loadtxt(trainP, delimiter=',').reshape(-1, 3)
-        testP = os.path.join(args.expDir, 'test.csv')
-        testData = np.loadtxt(testP, delimiter=',').reshape(-1, 3)
-    except(IOError):
-        exit()
-
-    # N = 392 * 2  # Rolling loss over the past epoch.
-
-    trainI, trainLoss, trainErr = np.split(trainData, [1, 2], axis=1)
-    trainI, trainLoss, trainErr = [x.ravel() for x in
-                                   (trainI, trainLoss, trainErr)]
-
-    # try:
-    #     trainI_, trainLoss_, trainErr_ = rolling(N, trainI, trainLoss, trainErr)
-    # except(ValueError):
-    #     exit()
-
-    testI, testLoss, testErr = np.split(testData, [1, 2], axis=1)
-
-    fig, ax = plt.subplots(1, 1, figsize=(6, 5))
-    plt.plot(trainI, trainLoss, label='Train')
-    # plt.plot(trainI_, trainLoss_, label='Train')
-    plt.plot(testI, testLoss, label='Test')
-    plt.xlabel('Epoch')
-    plt.ylabel('Cross-Entropy Loss')
-    plt.legend()
-    ax.set_yscale('log')
-    loss_fname = os.path.join(args.expDir, 'loss.png')
-    plt.savefig(loss_fname)
-    print('Created {}'.format(loss_fname))
-
-    fig, ax = plt.subplots(1, 1, figsize=(6, 5))
-    plt.plot(trainI, trainErr, label='Train')
-    # plt.plot(trainI_, trainErr_, label='Train')
-    plt.plot(testI, testErr, label='Test')
-    plt.xlabel('Epoch')
-    plt.ylabel('Error')
-    ax.set_yscale('log')
-    plt.legend()
-    err_fname = os.path.join(args.expDir, 'error.png')
-    plt.savefig(err_fname)
-    print('Created {}'.format(err_fname))
-
-    loss_err_fname = os.path.join(args.expDir, 'loss-error.png')
-    os.system('convert +append {} {} {}'.format(loss_fname, err_fname, loss_err_fname))
-    print('Created {}'.format(loss_err_fname))
+    clients = []
+    for root, dirs, files in os.walk(args.expDir):
+        dirs.sort()
+        if ('train.csv' in files) and ('test.csv' in files):
+            clients.append(root)
+
+    manifest_f = os.path.join(args.expDir, MANIFEST)
+    manifest = dict()
+    if os.path.isfile(manifest_f) and not args.force:
+        with open(manifest_f, 'r') as f:
+            manifest = json.load(f)
+
+    def _unchanged(expDir):
+        entries = manifest.get(expDir)
+        if not entries:
+            return False
+        for log in LOGS:
+            st = os.stat(os.path.join(expDir, log + '.csv'))
+            if (entries[log]['size'] != st.st_size) or (entries[log]['mtime'] != st.st_mtime):
+                return False
+        return os.path.isfile(os.path.join(expDir, CACHE))
+
+    jobs = [(d, dict(manifest.get(d, {})), args.force) for d in clients if args.force or not _unchanged(d)]
+    print('{} clients, {} changed'.format(len(clients), len(jobs)))
+
+    results = []
+    if jobs:
+        if args.workers > 1 and len(jobs) > 1:
+            with Pool(min(args.workers, len(jobs))) as pool:
+                results = pool.map(process, jobs, chunksize=max(1, len(jobs) // (4 * args.workers)))
+        else:
+            results = [process(job) for job in jobs]
+
+    changed = set()
+    for expDir, entries, _, created in results:
+        manifest[expDir] = entries
+        changed.add(os.path.dirname(expDir))
+        for fname in created:
+            print('Created {}'.format(fname))
+
+    # experiments: parents of clients
+    experiments = dict()
+    for d in clients:
+        experiments.setdefault(os.path.dirname(d), []).append(d)
+
+    for expDir, members in sorted(experiments.items()):
+        if len(members) < 2 or not (args.force or (expDir in changed)
+                                    or not os.path.isfile(os.path.join(expDir, 'aggregate.png'))):
+            continue
+        tests = []
+        for d in members:
+            with np.load(os.path.join(d, CACHE)) as f:
+                tests.append(f['test'])
+        print('Created {}'.format(_plot_aggregate(expDir, aggregate(tests))))
+
+    with open(manifest_f + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_f + '.tmp', manifest_f)
@@ -0,0 +1,162 @@
+"""
+Per-round record of reputation and elections
+
+# Preallocated, memory-mapped .npy arrays (one row per round), plus a small `index.json`:
+#   proposals   (R, P)      node id of proposal slot j              MISSING if unused
+#   creators    (R, P)      creator of proposal j                   -1 for genesis
+#   scores      (R, N, P)   score client i gave proposal j          NaN if not scored
+#                           (accuracy, or Frobenius distance)
+#   elected     (R, N, E)   node ids elected by client i            SELF for her own weights
+#   repus       (R, N, E)   their (normalized) reputations          NaN if not used
+#   accs        (R, N)      client i's acc. after averaging and training
+#   activated   (R, N)
+#   byzantine   (N,)
+# Per-client rows are set (to the fills above) only for the clients activated in a round, the others
+# are left as they are (zero, or of an earlier run if resumed): mask them with `activated`.
+# Writes are plain array stores; pages are flushed once per round.
+# `load` returns read-only mappings, sliced to the rounds written, e.g.
+#   heatmap(load(path)['scores'][r])  # see `TODO/visualization.heatmap`
+"""
+import os
+import json
+
+import numpy as np
+
+from dag import Node
+
+
+MISSING = -2  # -1 is the genesis
+SELF = -3
+
+_ARRAYS = {
+    # name: (shape of a row, dtype, fill)
+    'proposals': (('P',), np.int64, MISSING),
+    'creators': (('P',), np.int32, MISSING),
+    'scores': (('N', 'P'), np.float32, np.nan),
+    'elected': (('N', 'E'), np.int64, MISSING),
+    'repus': (('N', 'E'), np.float32, np.nan),
+    'accs': (('N',), np.float32, np.nan),
+    'activated': (('N',), np.bool_, False)}
+
+
+class Recorder:
+    def __init__(self, path, nNodes, nRounds, nProposals, nElected=2, byzantines=(), kind=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        index_f = os.path.join(path, 'index.json')
+        dims = {'N': nNodes, 'P': nProposals, 'E': nElected}
+        if os.path.isfile(index_f):  # e.g. resumed
+            with open(index_f, 'r') as f:
+                self.index = json.load(f)
+            if self.index['dims'] != dims or self.index['nRounds'] != nRounds:
+                raise ValueError("{} does not match the record: {}.".format(dims, self.index['dims']))
+            mode = 'r+'
+        else:
+            self.index = {'dims': dims, 'nRounds': nRounds, 'rounds': 0, 'kind': kind}
+            mode = 'w+'
+
+        self.arrays = dict()
+        for name, (row, dtype, _) in _ARRAYS.items():
+            self.arrays[name] = np.lib.format.open_memmap(
+                os.path.join(path, name + '.npy'), mode=mode, dtype=dtype,
+                shape=(nRounds,) + tuple(dims[d] for d in row) if mode == 'w+' else None)
+
+        byz = np.zeros(nNodes, dtype=np.bool_)
+        byz[list(byzantines)] = True
+        np.save(os.path.join(path, 'byzantine.npy'), byz)
+
+        self._round = None
+        self._slots = dict()  # node id -> proposal slot, current round
+
+    """record
+    # r: round (1-based), i: client
+    """
+
+    def begin_round(self, r, proposals, activateds):
+        row = r - 1
+        activateds = list(activateds)
+        for name, (shape, _, fill) in _ARRAYS.items():
+            if (shape[0] == 'N') and (name != 'activated'):  # only the clients who write this round,
+                self.arrays[name][row, activateds] = fill  # pages of the others' N x P rows stay untouched
+            else:
+                self.arrays[name][row] = fill
+
+        n = min(len(proposals), self.arrays['proposals'].shape[1])
+        self.arrays['proposals'][row, :n] = [p.get_id() for p in proposals[:n]]
+        self.arrays['creators'][row, :n] = [-1 if p.creator is None else p.creator for p in proposals[:n]]
+        self.arrays['activated'][row, activateds] = True
+
+        self._round = row
+        self._slots = {p.get_id(): j for j, p in enumerate(proposals[:n])}
+
+    def scores(self, i, scores: dict, proposals: list = None):
+        # scores: {proposal index: score}, indices into `proposals` (e.g. her neighbors', see `topology`)
+        # if given, else into those of `begin_round`
+        if scores:
+            if proposals is not None:
+                scores = {self._slots[proposals[j].get_id()]: s for j, s in scores.items()
+                          if proposals[j].get_id() in self._slots}
+            idx = [j for j in scores if j < self.arrays['scores'].shape[2]]
+            self.arrays['scores'][self._round, i, idx] = [scores[j] for j in idx]
+
+    def elect(self, i, elected: list, repus: list = None):
+        # elected: `Node`s, or anything else (e.g. a `Client`) for her own weights
+        E = self.arrays['elected'].shape[2]
+        ids = [e.get_id() if isinstance(e, Node) else SELF for e in elected[:E]]
+        self.arrays['elected'][self._round, i, :len(ids)] = ids
+        if repus is not None:
+            self.arrays['repus'][self._round, i, :len(ids)] = repus[:E]
+
+    def acc(self, i, acc):
+        self.arrays['accs'][self._round, i] = acc
+
+    def end_round(self, r):
+        for array in self.arrays.values():
+            array.flush()
+
+        self.index['rounds'] = max(self.index['rounds'], r)
+        index_f = os.path.join(self.path, 'index.json')
+        with open(index_f + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_f + '.tmp', index_f)
+
+
+def load(path):
+    # read-only, rounds written so far
+    with open(os.path.join(path, 'index.json'), 'r') as f:
+        index = json.load(f)
+
+    res = {'index': index}
+    for name in _ARRAYS:
+        res[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')[:index['rounds']]
+    res['byzantine'] = np.load(os.path.join(path, 'byzantine.npy'))
+    return res
+
+
+if __name__ == "__main__":
+    import time
+    import tempfile
+
+    N, R = 1000, 300
+    path = tempfile.mkdtemp()
+    recorder = Recorder(path, nNodes=N, nRounds=R, nProposals=N + 1, byzantines=range(330), kind='acc')
+
+    rng = np.random.default_rng(0)
+    start = time.time()
+    _id = 0
+    for r in range(1, R + 1):
+        proposals = [Node(weights=None, _id=_id + j, creator=j, _round=r) for j in range(N)]
+        _id += N
+        activateds = rng.choice(N, 50, replace=False).tolist()
+
+        recorder.begin_round(r, proposals, activateds)
+        for i in activateds:
+            recorder.scores(i, {j: float(s) for j, s in enumerate(rng.random(N))})
+            recorder.elect(i, [proposals[0], None], [0.6, 0.4])
+            recorder.acc(i, 50.)
+        recorder.end_round(r)
+    print('%.2f ms/round' % ((time.time() - start) / R * 1e3))
+
+    rec = load(path)
+    print(rec['scores'].shape, np.isfinite(rec['scores'][-1]).sum(1).max(), rec['elected'][-1][activateds[0]])
@@ -7,10 +7,22 @@ import random
 import torch
 
 
+def _accuracies(proposals, test_client, epoch, show=False, log=False, evaluator=None):
+    # lazily, in order; evaluator: see `evaluator.ParallelEvaluator`
+    if evaluator is not None:
+        yield from evaluator.imap(proposals, epoch, show=show)  # closes it when closed
+        return
+
+    for proposal in proposals:
+        yield test_client.score(proposal, epoch, show=show, log=log)  # cached, see `client.Metrics`
+
+
 def by_random(
         proposals: list, count: int,
         return_acc=False, test_client=None, epoch=None, show=False, log=False,
-        timing=False):
+        timing=False, evaluator=None, scores=None, rng=None):
+    # scores: optional dict, filled with {index: score} of every scored proposal (see `recorder`)
+    # rng: e.g. `random.Random`, instead of the global `random`
 
     if timing:
         start = time.time()
@@ -21,13 +33,13 @@ def by_random(
     elapsed = None
     accs = []
 
-    idxes = random.sample(range(n), count)
+    idxes = (rng or random).sample(range(n), count)
 
-    if return_acc and (test_client is not None) and (epoch is not None):
-        for idx in idxes:
-            test_client.set_weights(proposals[idx].get_weights())
-            res = 100. - test_client.test(epoch, show=show, log=log)
-            accs.append(res)
+    if return_acc and ((test_client is not None) or (evaluator is not None)) and (epoch is not None):
+        accs = list(_accuracies(
+            [proposals[idx] for idx in idxes], test_client, epoch, show=show, log=log, evaluator=evaluator))
+        if scores is not None:
+            scores.update(zip(idxes, accs))
 
     # elapsed time
     if timing:
@@ -37,14 +49,16 @@ def by_random(
     return accs, idxes, elapsed
 
 
-def suffle(A):
-    return (list(t) for t in zip(*(random.sample([i for i in (enumerate(A))], len(A)))))
+def suffle(A, rng=None):
+    # rng: e.g. `random.Random`, see `rng.Streams`
+    rng = rng or random
+    return (list(t) for t in zip(*(rng.sample([i for i in (enumerate(A))], len(A)))))
 
 
 def by_accuracy(
         proposals: list, count: int, test_client,
         epoch, show=False, log=False,
-        timing=False, optimal_stopping=False):
+        timing=False, optimal_stopping=False, evaluator=None, scores=None, rng=None):
 
     if timing:
         start = time.time()
@@ -64,28 +78,30 @@ def by_accuracy(
         passing_number = int(n / math.e)
         cutline = 0.
 
-        idx_suffled, suffled = suffle(proposals)
-
-        for i, proposal in enumerate(suffled):
-            test_client.set_weights(proposal.get_weights())
-            res = 100. - test_client.test(epoch, show=show, log=log)
-            accs.append(res)
-            idx_bests.append(idx_suffled[i])
-            if cutline < res:
-                cutline = res
-                if (i >= passing_number) and (i + 1 >= count):
-                    break
+        idx_suffled, suffled = suffle(proposals, rng)
+
+        results = _accuracies(suffled, test_client, epoch, show, log, evaluator)
+        try:
+            for i, res in enumerate(results):
+                accs.append(res)
+                idx_bests.append(idx_suffled[i])
+                if cutline < res:
+                    cutline = res
+                    if (i >= passing_number) and (i + 1 >= count):
+                        break
+        finally:
+            results.close()  # now, not when collected: replicas are idle on return
     else:
         """normal mode
         # TBA
         """
-        for i, proposal in enumerate(proposals):  # tqdm(proposals):
-            test_client.set_weights(proposal.get_weights())
-            res = 100. - test_client.test(epoch, show=show, log=log)
+        for i, res in enumerate(_accuracies(proposals, test_client, epoch, show, log, evaluator)):  # tqdm
             accs.append(res)
             idx_bests.append(i)
 
     # print(accs)
+    if scores is not None:
+        scores.update(zip(idx_bests, accs))
     bests = accs[:]
     bests, idx_bests = (list(t)[:count] for t in zip(*sorted(zip(bests, idx_bests), reverse=True)))
 
@@ -126,7 +142,8 @@ def Frobenius(weights: dict, base_weights: dict = None):
 def by_Frobenius(
         proposals: list, count: int, base_client, FN=False,
         return_acc=False, test_client=None, epoch=None, show=False, log=False,
-        timing=False, optimal_stopping=False):
+        timing=False, optimal_stopping=False,
+        sketcher=None, rerank=0, index=None, evaluator=None, scores=None, rng=None):
 
     if timing:
         start = time.time()
@@ -137,7 +154,42 @@ def by_Frobenius(
     bests, idx_bests, elapsed = [], [], None
     distances = []
 
-    if optimal_stopping and (n >= 3):
+    """distance
+    # sketcher: rank on sketches (see `sketch.Sketcher`), then re-rank the top `rerank` exactly
+    # index: fetch the candidates from a nearest-neighbor index of sketches (see `ann.IVFIndex`)
+    """
+    cached = dict()
+
+    def _base_sketch():
+        if 'sketch' not in cached:
+            cached['sketch'] = sketcher.sketch(base_client.get_weights(), FN=FN)
+        return cached['sketch']
+
+    def _distance(proposal, exact=False):
+        if (sketcher is not None) and (not exact):
+            return -1 * (sketcher.get(proposal, FN=FN) - _base_sketch()).norm().item()
+
+        if FN:
+            if 'FN' not in cached:
+                cached['FN'] = filterwise_normalization(base_client.get_weights())
+
+            return -1 * Frobenius(
+                filterwise_normalization(proposal.get_weights()),
+                base_weights=cached['FN'])
+        else:
+            return -1 * Frobenius(
+                proposal.get_weights(), base_weights=base_client.get_weights())
+
+    if (index is not None) and (sketcher is not None):
+        """index mode
+        # no scan over proposals
+        """
+        positions = {p.get_id(): i for i, p in enumerate(proposals)}
+
+        for dist, key in index.search(_base_sketch(), max(count, rerank), where=lambda key: key in positions):
+            distances.append(-1 * dist)
+            idx_bests.append(positions[key])
+    elif optimal_stopping and (n >= 3):
         """optimal stopping mode
         # TODO: Her own weights' Frobenius Norm is 0
         # so they are always best.
@@ -145,20 +197,10 @@ def by_Frobenius(
         passing_number = int(n / math.e)
         cutline = 0.
 
-        idx_suffled, suffled = suffle(proposals)
-        cached = None
+        idx_suffled, suffled = suffle(proposals, rng)
 
         for i, proposal in enumerate(suffled):  # enumerate(tqdm(proposals)):
-            if FN:
-                if cached is None:
-                    cached = filterwise_normalization(base_client.get_weights())
-
-                res = -1 * Frobenius(
-                    filterwise_normalization(proposal.get_weights()),
-                    base_weights=cached)
-            else:
-                res = -1 * Frobenius(
-                    proposal.get_weights(), base_weights=base_client.get_weights())
+            res = _distance(proposal)
 
             if i == 0:
                 cutline = res
@@ -174,35 +216,31 @@ def by_Frobenius(
         """normal mode
         # TBA
         """
-        cached = None
-
         for i, proposal in enumerate(proposals):
-            if FN:
-                if cached is None:
-                    cached = filterwise_normalization(base_client.get_weights())
-
-                res = -1 * Frobenius(
-                    filterwise_normalization(proposal.get_weights()),
-                    base_weights=cached)
-            else:
-                res = -1 * Frobenius(
-                    proposal.get_weights(), base_weights=base_client.get_weights())
+            res = _distance(proposal)
 
             distances.append(res)
             idx_bests.append(i)
 
     # print(distances)
+    if scores is not None:
+        scores.update((idx, -1 * d) for idx, d in zip(idx_bests, distances))
     bests = distances[:]
-    bests, idx_bests = (list(t)[:count] for t in zip(*sorted(zip(bests, idx_bests), reverse=True)))
+    bests, idx_bests = (list(t) for t in zip(*sorted(zip(bests, idx_bests), reverse=True)))
+
+    if (sketcher is not None) and rerank:
+        tops = idx_bests[:max(rerank, count)]
+        exacts = [_distance(proposals[idx], exact=True) for idx in tops]
+        if scores is not None:
+            scores.update((idx, -1 * d) for idx, d in zip(tops, exacts))
+        bests, idx_bests = (list(t) for t in zip(*sorted(zip(exacts, tops), reverse=True)))
+
+    bests, idx_bests = bests[:count], idx_bests[:count]
     bests = [-1 * b for b in bests]
 
-    if return_acc and (test_client is not None) and (epoch is not None):
-        accs = []
-        for idx_best in idx_bests:
-            test_client.set_weights(proposals[idx_best].get_weights())
-            res = 100. - test_client.test(epoch, show=show, log=log)
-            accs.append(res)
-        bests = accs[:]
+    if return_acc and ((test_client is not None) or (evaluator is not None)) and (epoch is not None):
+        bests = list(_accuracies(
+            [proposals[idx] for idx in idx_bests], test_client, epoch, show=show, log=log, evaluator=evaluator))
 
     # elapsed time
     if timing:
@@ -0,0 +1,126 @@
+"""
+Random-projection sketches of weights
+
+# A sparse Johnson-Lindenstrauss transform (CountSketch / feature hashing):
+# every parameter is added, with a random sign, to one of `dim` buckets.
+#   E[||S(x) - S(y)||^2] = ||x - y||^2,  relative std. ~ sqrt(2 / dim)
+# Hashes are seeded per parameter name, so every node is sketched by the same projection,
+# and sketching costs O(|theta|) instead of O(dim |theta|).
+# Ref. https://arxiv.org/abs/0902.2206 (feature hashing)
+"""
+import math
+import zlib
+
+import torch
+
+
+class Sketcher:
+    def __init__(self, dim=4096, seed=0):
+        self.dim = dim
+        self.seed = seed
+
+        self._hashes = dict()  # name -> (bucket, sign)
+
+    def _hash(self, name, numel):
+        if name not in self._hashes:
+            g = torch.Generator()
+            g.manual_seed(self.seed * 1000003 + zlib.crc32(name.encode()))
+            bucket = torch.randint(self.dim, (numel,), generator=g)
+            sign = torch.randint(2, (numel,), generator=g).float().mul_(2).sub_(1)
+            self._hashes[name] = (bucket, sign)
+        return self._hashes[name]
+
+    def sketch(self, weights, FN=False):
+        scales = dict()
+        if FN:  # filter-wise normalization, see `reputation.filterwise_normalization`
+            norms = {name: value.data.float().norm().item() for name, value in weights.items()}
+            theta = math.sqrt(sum(n * n for n in norms.values()))
+            scales = {name: theta / (n + 1e-10) for name, n in norms.items()}
+
+        res = torch.zeros(self.dim)
+        for name, value in weights.items():
+            flat = value.data.reshape(-1).float().cpu()
+            bucket, sign = self._hash(name, flat.numel())
+            contrib = flat * sign
+            if name in scales:
+                contrib.mul_(scales[name])
+            res.index_add_(0, bucket, contrib)
+
+        return res
+
+    def attach(self, node, FNs=(False, True)):
+        # computed once, at creation
+        weights = node.get_weights()
+        node.sketches = {FN: self.sketch(weights, FN=FN) for FN in FNs}
+
+    def get(self, proposal, FN=False):
+        sketches = getattr(proposal, 'sketches', None)
+        if sketches is None:  # e.g. a `Client`, whose weights change
+            return self.sketch(proposal.get_weights(), FN=FN)
+        if FN not in sketches:
+            sketches[FN] = self.sketch(proposal.get_weights(), FN=FN)
+        return sketches[FN]
+
+
+def agreement(exact: list, approx: list, count: int):
+    # exact, approx: distances of the same proposals
+    # returns (overlap of the `count` nearest, Spearman's rho)
+    n = len(exact)
+    rank_exact = sorted(range(n), key=lambda i: exact[i])
+    rank_approx = sorted(range(n), key=lambda i: approx[i])
+
+    overlap = len(set(rank_exact[:count]) & set(rank_approx[:count])) / count
+
+    pos_exact, pos_approx = [0] * n, [0] * n
+    for r, i in enumerate(rank_exact):
+        pos_exact[i] = r
+    for r, i in enumerate(rank_approx):
+        pos_approx[i] = r
+    d2 = sum((pos_exact[i] - pos_approx[i]) ** 2 for i in range(n))
+    rho = 1. - 6. * d2 / (n * (n * n - 1)) if n > 1 else 1.
+
+    return overlap, rho
+
+
+if __name__ == "__main__":
+    import time
+
+    from net import DenseNet
+    from reputation import Frobenius, filterwise_normalization
+
+    torch.manual_seed(0)
+
+    net = DenseNet(growthRate=12, depth=100, reduction=0.5, bottleneck=True, nClasses=10)
+    base = {name: p.data for name, p in net.named_parameters()}
+
+    # proposals at various distances
+    proposals = []
+    for i in range(40):
+        scale = 1e-3 * (1 + i % 10)
+        proposals.append({k: v + scale * torch.randn_like(v) for k, v in base.items()})
+
+    for FN in (False, True):
+        if FN:
+            cached = filterwise_normalization(base)
+            exact = [Frobenius(filterwise_normalization(p), cached) for p in proposals]
+        else:
+            exact = [Frobenius(p, base) for p in proposals]
+
+        for dim in (256, 1024, 4096, 16384):
+            sketcher = Sketcher(dim=dim)
+            s_base = sketcher.sketch(base, FN=FN)
+
+            start = time.time()
+            sketches = [sketcher.sketch(p, FN=FN) for p in proposals]
+            elapsed = (time.time() - start) / len(proposals)
+
+            approx = [(s - s_base).norm().item() for s in sketches]
+            overlap, rho = agreement(exact, approx, count=5)
+
+            # exact re-rank of the top 10
+            tops = sorted(range(len(approx)), key=lambda i: approx[i])[:10]
+            reranked = [exact[i] if i in tops else float('inf') for i in range(len(approx))]
+            overlap_rr, _ = agreement(exact, reranked, count=5)
+
+            print('FN=%d\tdim=%5d\ttop-5 overlap=%.2f (re-ranked %.2f)\trho=%.3f\t%.3fs/sketch' % (
+                FN, dim, overlap, overlap_rr, rho, elapsed))
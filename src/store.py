@@ -0,0 +1,320 @@
+"""
+Append-only on-disk DAG log
+
+# path/layout.json       : names, shapes, dtypes and offsets of a weight payload (fixed for all nodes)
+# path/index.jsonl       : node id -> (segment, offset, parents, creator, round), one line per node
+# path/segment-XXXXX.bin : payloads, back to back
+"""
+import os
+import json
+import mmap
+import threading
+
+import numpy as np
+import torch
+
+from dag import Node, DAG
+
+
+ALIGN = 64
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class DAGStore:
+    def __init__(self, path, weights=None, segment_bytes=1 << 30):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+        self.layout = None  # [(name, shape, dtype, offset)]
+        self.nbytes = 0  # payload size
+
+        self.index = dict()  # id -> entry
+        self._maps = dict()  # segment -> mmap
+        self._lock = threading.Lock()  # `_map` from evaluator threads
+        self._writer = None
+        self._segment = 0
+        self._offset = 0
+
+        layout_f = os.path.join(self.path, 'layout.json')
+        if os.path.isfile(layout_f):
+            with open(layout_f, 'r') as f:
+                meta = json.load(f)
+            self.layout = [(name, tuple(shape), dtype, offset) for name, shape, dtype, offset in meta['layout']]
+            self.nbytes = meta['nbytes']
+            self.per_segment = meta['per_segment']
+            self._read_index()
+        else:
+            if weights is None:
+                raise ValueError("weights are required to create a new store at '{}'.".format(self.path))
+            self._make_layout(weights)
+            self.per_segment = max(1, segment_bytes // self.nbytes)
+            with open(layout_f, 'w') as f:
+                json.dump({
+                    'layout': self.layout,
+                    'nbytes': self.nbytes,
+                    'per_segment': self.per_segment}, f)
+
+    def _make_layout(self, weights):
+        self.layout = []
+        offset = 0
+        for name, value in weights.items():
+            dtype = str(value.detach().cpu().numpy().dtype)
+            self.layout.append((name, tuple(value.size()), dtype, offset))
+            offset = _aligned(offset + value.numel() * value.element_size())
+        self.nbytes = offset
+
+    def _segment_f(self, segment):
+        return os.path.join(self.path, 'segment-%05d.bin' % (segment))
+
+    def _read_index(self):
+        index_f = os.path.join(self.path, 'index.jsonl')
+        if not os.path.isfile(index_f):
+            return
+
+        with open(index_f, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn tail
+                self.index[entry['id']] = entry
+
+        written = [e for e in self.index.values() if e['segment'] is not None]
+        if written:
+            last = max(written, key=lambda e: (e['segment'], e['offset']))
+            self._segment = last['segment']
+            self._offset = last['offset'] + self.nbytes
+
+    """append
+    # TBA
+    """
+
+    def append(self, node, release=True):
+        _id = node.get_id()
+        if _id in self.index:
+            raise KeyError("node '{}' is already in the store.".format(_id))
+
+        weights = node.get_weights()
+
+        if self._offset + self.nbytes > self.per_segment * self.nbytes:
+            self._segment += 1
+            self._offset = 0
+            self._close_writer()
+
+        if self._writer is None:
+            self._writer = open(self._segment_f(self._segment), 'ab')
+            self._writer.seek(0, os.SEEK_END)
+            self._offset = self._writer.tell()
+
+        # payload
+        pad = 0
+        for name, shape, dtype, offset in self.layout:
+            if pad:
+                self._writer.write(b'\0' * pad)
+            arr = np.ascontiguousarray(weights[name].detach().cpu().numpy())
+            if str(arr.dtype) != dtype or arr.shape != shape:
+                raise ValueError("'{}' does not match the layout: {} {}.".format(name, arr.dtype, arr.shape))
+            self._writer.write(arr.data)
+            pad = _aligned(arr.nbytes) - arr.nbytes
+        if pad:
+            self._writer.write(b'\0' * pad)
+        self._writer.flush()
+
+        # index
+        entry = {
+            'id': _id,
+            'segment': self._segment,
+            'offset': self._offset,
+            'parents': [p.get_id() for p in node.get_parents()],
+            'creator': node.creator,
+            'round': node.round}
+        self._append_index(entry)
+        self._offset += self.nbytes
+
+        node.store = self
+        if release:
+            node.release()
+
+    def _append_index(self, entry):
+        self.index[entry['id']] = entry
+        with open(os.path.join(self.path, 'index.jsonl'), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    """read
+    # zero-copy: tensors are views of a private (copy-on-write) mapping of the segment
+    """
+
+    def _map(self, segment, end):
+        with self._lock:
+            mm = self._maps.get(segment)
+            if (mm is None) or (len(mm) < end):  # the current segment grows
+                with open(self._segment_f(segment), 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                self._maps[segment] = mm
+            return mm
+
+    def get_weights(self, _id):
+        entry = self.index[_id]
+        if entry['segment'] is None:
+            raise KeyError("weights of node '{}' are dropped.".format(_id))
+
+        mm = self._map(entry['segment'], entry['offset'] + self.nbytes)
+
+        weights = dict()
+        for name, shape, dtype, offset in self.layout:
+            count = int(np.prod(shape))
+            arr = np.frombuffer(mm, dtype=dtype, count=count, offset=entry['offset'] + offset)
+            weights[name] = torch.from_numpy(arr.reshape(shape))
+        return weights
+
+    def load(self):
+        # rebuild the DAG from the index (weights stay on disk)
+        dag = DAG()
+        nodes = dict()
+        for _id, entry in self.index.items():  # in append order
+            node = Node(
+                weights=None,
+                parents=[nodes[p] for p in entry['parents']],
+                _id=_id,
+                creator=entry['creator'],
+                _round=entry['round'])
+            node.store = self
+            nodes[_id] = node
+            dag.add(node)
+
+        if nodes:
+            Node._id = max(Node._id, max(nodes.keys()) + 1)
+
+        return dag
+
+    """compaction
+    # TBA
+    """
+
+    def drop(self, before_round):
+        # drop whole segments of which all nodes are older than `before_round`
+        self._close_writer()
+
+        segments = dict()
+        for entry in self.index.values():
+            if entry['segment'] is not None:
+                segments.setdefault(entry['segment'], []).append(entry)
+
+        dropped = []
+        for segment, entries in segments.items():
+            if segment == self._segment:
+                continue  # being written
+            if all((e['round'] is not None) and (e['round'] < before_round) for e in entries):
+                for e in entries:
+                    e['segment'], e['offset'] = None, None
+                self._unmap(segment)
+                os.remove(self._segment_f(segment))
+                dropped.append(segment)
+
+        if dropped:
+            self._rewrite_index()
+
+        return dropped
+
+    def compact(self, keep):
+        # rewrite the payloads of `keep` (ids) into fresh segments, drop the others
+        self._close_writer()
+
+        keep = set(keep)
+        old_segments = sorted(set(e['segment'] for e in self.index.values() if e['segment'] is not None))
+        segment = (old_segments[-1] + 1) if old_segments else 0
+        first = segment
+        offset = 0
+        writer = None
+
+        for _id, entry in self.index.items():
+            if entry['segment'] is None:
+                continue
+            if _id not in keep:
+                entry['segment'], entry['offset'] = None, None
+                continue
+
+            if offset + self.nbytes > self.per_segment * self.nbytes:
+                writer.close()
+                writer, segment, offset = None, segment + 1, 0
+            if writer is None:
+                writer = open(self._segment_f(segment), 'wb')
+
+            mm = self._map(entry['segment'], entry['offset'] + self.nbytes)
+            writer.write(mm[entry['offset']:entry['offset'] + self.nbytes])
+            entry['segment'], entry['offset'] = segment, offset
+            offset += self.nbytes
+
+        if writer is not None:
+            writer.close()
+
+        for s in old_segments:
+            self._unmap(s)
+            os.remove(self._segment_f(s))
+
+        self._segment = segment if writer is not None else first
+        self._offset = offset if writer is not None else 0
+        self._rewrite_index()
+
+    def _unmap(self, segment):
+        with self._lock:
+            mm = self._maps.pop(segment, None)
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                pass  # still referenced by tensors, closed when released
+
+    def truncate(self, next_id):
+        # forget nodes appended from `next_id` on (e.g. after a snapshot, see `checkpoint`);
+        # their payloads stay in the segments until `compact`
+        dropped = [_id for _id in self.index if _id >= next_id]
+        for _id in dropped:
+            del self.index[_id]
+        if dropped:
+            self._rewrite_index()
+        return dropped
+
+    def _rewrite_index(self):
+        index_f = os.path.join(self.path, 'index.jsonl')
+        with open(index_f + '.tmp', 'w') as f:
+            for entry in self.index.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(index_f + '.tmp', index_f)
+
+    def close(self):
+        self._close_writer()
+        for segment in list(self._maps.keys()):
+            self._unmap(segment)
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    path = tempfile.mkdtemp()
+
+    w = {'a': torch.randn(3, 4), 'b': torch.arange(5).float()}
+    genesis = Node(weights=w, _id=-1, _round=0)
+    node = Node(weights={k: v + 1 for k, v in w.items()}, parents=[genesis], _round=1)
+
+    store = DAGStore(path, weights=w, segment_bytes=256)
+    store.append(genesis)
+    store.append(node)
+    print(node.get_weights()['b'])
+
+    # reopen
+    store.close()
+    dag = DAGStore(path).load()
+    print(len(dag), [t.get_id() for t in dag.tips()])
+    print(dag.get(node.get_id()).get_weights()['b'])
+
+    shutil.rmtree(path)
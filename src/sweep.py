@@ -0,0 +1,267 @@
+"""
+Concurrent sweep of experiments
+
+# e.g. python src/sweep.py --out data/sweep --jobs 4 --threads 2 \
+#        --grid nNodes=10 nByzs=3 repute=acc,Frobenius op-stop=false,true filter=false,true seed=1,2 -- --nEpochs=100
+# - every point of the grid is one `main.py` process, at most `jobs` at once (and only while
+#   `memory` GB per job is available); flags (e.g. op-stop) are passed if true
+# - CIFAR is decoded once into shared memory (`/dev/shm`); runs memory-map it, so its pages are shared
+# - each run writes `<out>/<name>/summary.json` every round (see `main.py --summary`) and snapshots;
+#   a sweep run again skips finished runs and resumes interrupted ones from their snapshot
+# - results are collected into `<out>/summary.csv`
+"""
+import argparse
+import os
+import sys
+import json
+import time
+import shutil
+import itertools
+import subprocess
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset
+
+
+COLUMNS = ('rounds', 'final_acc', 'final_honest_acc', 'best_acc', 'elapsed')
+
+
+"""shared dataset
+# TBA
+"""
+
+
+def export(root='cifar', shm=None):
+    # decoded CIFAR-10 as .npy files in `shm`, once; returns `shm`
+    import torchvision.datasets as dset
+
+    shm = shm or (os.path.join('/dev/shm', 'ddl-cifar') if os.path.isdir('/dev/shm') else os.path.join(root, 'shm'))
+    if os.path.isfile(os.path.join(shm, 'test_targets.npy')):  # written last
+        return shm
+    os.makedirs(shm, exist_ok=True)
+
+    download = not os.path.isdir(os.path.join(root, 'cifar-10-batches-py'))
+    for split, train in (('train', True), ('test', False)):
+        dataset = dset.CIFAR10(root=root, train=train, download=download)
+        np.save(os.path.join(shm, split + '_data.npy'), np.ascontiguousarray(dataset.data))
+        np.save(os.path.join(shm, split + '_targets.npy'), np.asarray(dataset.targets, dtype=np.int64))
+    return shm
+
+
+class SharedCIFAR10(Dataset):
+    # `dset.CIFAR10` over a memory-mapped `export`
+    def __init__(self, shm, train=True, transform=None, target_transform=None):
+        split = 'train' if train else 'test'
+        self.data = np.load(os.path.join(shm, split + '_data.npy'), mmap_mode='r')
+        self.targets = np.load(os.path.join(shm, split + '_targets.npy')).tolist()
+        self.transform = transform
+        self.target_transform = target_transform
+
+    def __getitem__(self, index):
+        img, target = Image.fromarray(np.asarray(self.data[index])), self.targets[index]
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return img, target
+
+    def __len__(self):
+        return len(self.data)
+
+
+"""grid
+# TBA
+"""
+
+
+def expand(grid):
+    # grid: ['key=v1,v2', ...] -> [{'key': 'v1', ...}, ...], in order
+    keys, values = [], []
+    for item in grid:
+        key, _, vals = item.partition('=')
+        keys.append(key)
+        values.append(vals.split(','))
+    return [dict(zip(keys, point)) for point in itertools.product(*values)]
+
+
+def name_of(point):
+    return '_'.join('{}={}'.format(k, v) for k, v in point.items())
+
+
+def argv_of(point):
+    argv = []
+    for key, value in point.items():
+        if value.lower() in ('false', 'true'):  # a flag
+            if value.lower() == 'true':
+                argv.append('--' + key)
+        else:
+            argv.append('--{}={}'.format(key, value))
+    return argv
+
+
+def read_summary(runDir):
+    try:
+        with open(os.path.join(runDir, 'summary.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):  # not yet, or being replaced
+        return None
+
+
+def _available():
+    # bytes, Linux; None elsewhere
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+"""run
+# TBA
+"""
+
+
+class Sweep:
+    def __init__(self, out, points, extra=(), jobs=1, threads=1, memory=0., shm=None, snapshot_every=10):
+        self.out = out
+        self.points = points
+        self.extra = list(extra)
+        self.jobs = jobs
+        self.threads = threads
+        self.memory = memory * 2**30
+        self.shm = shm
+        self.snapshot_every = snapshot_every
+
+        os.makedirs(out, exist_ok=True)
+
+    def _command(self, name, point):
+        runDir = os.path.join(self.out, name)
+        snapshot = os.path.join(runDir, 'snapshot')
+        resume = os.path.isfile(os.path.join(snapshot, 'latest.json'))
+        if not resume and os.path.isdir(runDir):  # interrupted before its first snapshot
+            shutil.rmtree(runDir)
+        os.makedirs(runDir, exist_ok=True)
+
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')]
+        cmd += argv_of(point)
+        cmd += ['--path=' + runDir, '--summary=' + os.path.join(runDir, 'summary.json'),
+                '--snapshot=' + snapshot, '--snapshot-every=%d' % (self.snapshot_every)]
+        cmd += self.extra
+        if self.shm is not None:
+            cmd.append('--shared-data=' + self.shm)
+        if resume:
+            cmd.append('--resume')
+        return cmd, resume
+
+    def _env(self):
+        env = dict(os.environ)
+        for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+            env[var] = str(self.threads)
+        return env
+
+    def run(self, poll=1.):
+        pending = []
+        for point in self.points:
+            name = name_of(point)
+            summary = read_summary(os.path.join(self.out, name))
+            if (summary is not None) and summary.get('done'):
+                continue
+            pending.append((name, point))
+        print('{} runs, {} to go'.format(len(self.points), len(pending)))
+
+        running = dict()  # name -> (process, log file)
+        failed = []
+        try:
+            while pending or running:
+                for name, (proc, logF) in list(running.items()):
+                    if proc.poll() is None:
+                        continue
+                    logF.close()
+                    del running[name]
+                    if proc.returncode != 0:
+                        failed.append(name)
+                    print('{} {} ({})'.format('Finished' if proc.returncode == 0 else 'Failed', name,
+                                              proc.returncode))
+
+                while pending and (len(running) < self.jobs):
+                    available = _available()
+                    if running and (available is not None) and (available < self.memory):
+                        break  # wait for one to finish
+                    name, point = pending.pop(0)
+                    cmd, resume = self._command(name, point)
+                    logF = open(os.path.join(self.out, name, 'log.txt'), 'a' if resume else 'w')
+                    running[name] = (subprocess.Popen(
+                        cmd, stdout=logF, stderr=subprocess.STDOUT, env=self._env()), logF)
+                    print('{} {}'.format('Resumed' if resume else 'Started', name))
+
+                time.sleep(poll)
+        except KeyboardInterrupt:  # resumable, see `_command`
+            for proc, logF in running.values():
+                proc.terminate()
+            for proc, logF in running.values():
+                proc.wait()
+                logF.close()
+            raise
+
+        return failed
+
+    def collect(self):
+        # one row per point, finished or not; also written to `<out>/summary.csv`
+        keys = list(self.points[0].keys()) if self.points else []
+        rows = []
+        for point in self.points:
+            summary = read_summary(os.path.join(self.out, name_of(point))) or dict()
+            row = [point[k] for k in keys]
+            for col in COLUMNS:
+                value = summary.get(col)
+                row.append('' if value is None else ('%.2f' % value if isinstance(value, float) else str(value)))
+            row.append('done' if summary.get('done') else ('running' if summary else 'pending'))
+            rows.append(row)
+
+        header = keys + list(COLUMNS) + ['status']
+        with open(os.path.join(self.out, 'summary.csv'), 'w') as f:
+            f.write(','.join(header) + '\n')
+            for row in rows:
+                f.write(','.join(row) + '\n')
+
+        return header, rows
+
+
+def table(header, rows):
+    widths = [max(len(str(c)) for c in col) for col in zip(header, *rows)]
+    lines = ['  '.join(str(c).ljust(w) for c, w in zip(r, widths)) for r in [header] + rows]
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', type=str, default='data/sweep')
+    parser.add_argument('--grid', type=str, nargs='+',
+                        default=['nNodes=10', 'nByzs=3', 'repute=acc,Frobenius', 'op-stop=false,true',
+                                 'filter=false,true', 'seed=1'])
+    parser.add_argument('--jobs', type=int, default=None)  # concurrent runs; default, CPUs / threads
+    parser.add_argument('--threads', type=int, default=1)  # intra-op threads per run
+    parser.add_argument('--memory', type=float, default=0.)  # GB a run needs before it starts
+    parser.add_argument('--root', type=str, default='cifar')
+    parser.add_argument('--shm', type=str, default=None)  # default, /dev/shm/ddl-cifar
+    parser.add_argument('--no-shm', action='store_true')  # each run loads CIFAR itself
+    parser.add_argument('--snapshot-every', type=int, default=10)
+    args, extra = parser.parse_known_args()  # the rest goes to every run, e.g. -- --nEpochs=100
+    extra = [a for a in extra if a != '--']
+
+    jobs = args.jobs or max(1, (os.cpu_count() or 1) // args.threads)
+    shm = None if args.no_shm else export(args.root, args.shm)
+
+    sweep = Sweep(args.out, expand(args.grid), extra=extra, jobs=jobs, threads=args.threads,
+                  memory=args.memory, shm=shm, snapshot_every=args.snapshot_every)
+    failed = sweep.run()
+
+    print()
+    print(table(*sweep.collect()))
+    if failed:
+        print('Failed: {} (see log.txt)'.format(', '.join(failed)))
+        sys.exit(1)
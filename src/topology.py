@@ -0,0 +1,179 @@
+"""
+Peer topology
+
+# Who sees whose nodes: a client's candidates are the latest nodes of her neighbors
+# (and her own, and the genesis), so per-round scoring scales with her degree.
+# Undirected, without self-loops, stored as CSR (`indptr`, `indices`), neighbors sorted:
+#   full         implicit (no arrays), everyone sees everything, as before
+#   ring         each client linked to her k nearest on a ring
+#   regular      random k-regular (Steger-Wormald pairing)
+#   small-world  Watts-Strogatz: a ring whose edges are rewired with prob. p
+"""
+import numpy as np
+
+
+KINDS = ('full', 'ring', 'regular', 'small-world')
+
+
+class Topology:
+    def __init__(self, nNodes, indptr=None, indices=None, kind='full'):
+        # indptr, indices: CSR; None: fully connected
+        self.nNodes = nNodes
+        self.indptr = indptr
+        self.indices = indices
+        self.kind = kind
+
+    @classmethod
+    def from_edges(cls, nNodes, edges, kind=None):
+        # edges: (m, 2), each undirected edge once
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        src = np.concatenate((edges[:, 0], edges[:, 1]))
+        dst = np.concatenate((edges[:, 1], edges[:, 0]))
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+
+        indptr = np.zeros(nNodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=nNodes), out=indptr[1:])
+        return cls(nNodes, indptr, dst.astype(np.int32), kind=kind)
+
+    def is_full(self):
+        return self.indptr is None
+
+    def neighbors(self, i):
+        # None if fully connected
+        if self.indptr is None:
+            return None
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def degree(self, i):
+        if self.indptr is None:
+            return self.nNodes - 1
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def nnz(self):
+        if self.indptr is None:
+            return self.nNodes * (self.nNodes - 1)
+        return len(self.indices)
+
+    """candidates
+    # per round: `group` the proposals once (O(P)), then `visible` per client (O(degree))
+    """
+
+    def group(self, proposals):
+        # creator -> indices into `proposals`; None: the genesis
+        groups = dict()
+        if self.indptr is None:
+            return groups
+        for k, p in enumerate(proposals):
+            groups.setdefault(p.creator, []).append(k)
+        return groups
+
+    def visible(self, i, proposals, groups):
+        # proposals of i's neighbors, her own and the genesis, in the order of `proposals`
+        if self.indptr is None:
+            return proposals
+
+        idx = groups.get(None, []) + groups.get(i, [])
+        for j in self.neighbors(i).tolist():
+            idx += groups.get(j, [])
+        return [proposals[k] for k in sorted(idx)]
+
+
+"""builders
+# rng: `np.random.Generator` (see `rng.Streams.numpy`)
+"""
+
+
+def full(nNodes):
+    return Topology(nNodes, kind='full')
+
+
+def _lattice(nNodes, k):
+    # each to her k // 2 successors on a ring
+    u = np.repeat(np.arange(nNodes), k // 2)
+    v = (u + np.tile(np.arange(1, k // 2 + 1), nNodes)) % nNodes
+    return np.stack((u, v), axis=1)
+
+
+def ring(nNodes, k=2):
+    if (k % 2) or not (0 < k < nNodes):
+        raise ValueError("k must be even and in (0, {}): {}.".format(nNodes, k))
+    return Topology.from_edges(nNodes, _lattice(nNodes, k), kind='ring')
+
+
+def regular(nNodes, k, rng, retries=100):
+    if ((nNodes * k) % 2) or not (0 < k < nNodes):
+        raise ValueError("No {}-regular graph on {} nodes.".format(k, nNodes))
+
+    for _ in range(retries):
+        # pair up random stubs, skipping loops and multi-edges; restart if stuck
+        stubs = np.repeat(np.arange(nNodes), k).tolist()
+        edges = set()
+        fails = 0
+        while stubs and (fails < 100):
+            a, b = rng.integers(len(stubs), size=2).tolist()
+            u, v = stubs[a], stubs[b]
+            if (u == v) or ((min(u, v), max(u, v)) in edges):
+                fails += 1
+                continue
+            edges.add((min(u, v), max(u, v)))
+            for x in sorted((a, b), reverse=True):  # swap-remove
+                stubs[x] = stubs[-1]
+                stubs.pop()
+            fails = 0
+        if not stubs:
+            return Topology.from_edges(nNodes, sorted(edges), kind='regular')
+    raise RuntimeError("No {}-regular graph on {} nodes after {} retries.".format(k, nNodes, retries))
+
+
+def small_world(nNodes, k, p, rng):
+    edges = _lattice(nNodes, k)
+    present = set(map(tuple, np.sort(edges, axis=1).tolist()))
+
+    for e in np.flatnonzero(rng.random(len(edges)) < p).tolist():
+        u, v = edges[e]
+        for _ in range(nNodes):  # a new end, not u and not yet linked to u
+            w = int(rng.integers(nNodes))
+            if (w != u) and ((min(u, w), max(u, w)) not in present):
+                break
+        else:
+            continue
+        present.discard((min(u, v), max(u, v)))
+        present.add((min(u, w), max(u, w)))
+        edges[e] = (u, w)
+
+    return Topology.from_edges(nNodes, edges, kind='small-world')
+
+
+def build(kind, nNodes, k=4, p=0.1, rng=None):
+    if kind == 'full':
+        return full(nNodes)
+    rng = rng if rng is not None else np.random.default_rng()
+    if kind == 'ring':
+        return ring(nNodes, k)
+    elif kind == 'regular':
+        return regular(nNodes, k, rng)
+    elif kind == 'small-world':
+        return small_world(nNodes, k, p, rng)
+    raise ValueError("Unknown topology: {}.".format(kind))
+
+
+if __name__ == "__main__":
+    import time
+
+    class _Node:
+        def __init__(self, creator):
+            self.creator = creator
+
+    N = 10000
+    for kind in KINDS:
+        start = time.time()
+        topology = build(kind, N, k=6, p=0.1, rng=np.random.default_rng(0))
+        built = time.time() - start
+
+        proposals = [_Node(None)] + [_Node(i) for i in range(N)]
+        groups = topology.group(proposals)
+        start = time.time()
+        sizes = [len(topology.visible(i, proposals, groups)) for i in range(N)]
+        print('%-12s built in %.3fs, %.1f us/client, candidates %d-%d, nnz %d' % (
+            kind, built, (time.time() - start) / N * 1e6, min(sizes), max(sizes), topology.nnz()))
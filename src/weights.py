@@ -1,12 +1,15 @@
 import torch
-from torch.autograd import Variable
 
 import json
+import struct
 import hashlib
+import warnings
 
 import math
 from numbers import Number
 
+import numpy as np
+
 
 class Weights():
     def __init__(self,
@@ -60,18 +63,71 @@ class Weights():
         return self.params.__contains__(key)
 
     """arithmetic
-    # *_ : in-place version
+    # x.op(y)          : new tensors (autograd-tracked, as torch ops)
+    # x.op(y, out=z)   : written into z's tensors, returns z
+    # x.op_(y)         : in-place, on the tensors themselves (through `detach()`, so version counters see it), returns x
+    # y: `Weights (dict)` with the same keys, or `Number`, which is passed to torch as is
+    #    (so the result keeps the tensor's dtype)
     """
 
-    # -x
-    def neg(self):
-        res = dict()
+    @staticmethod
+    def _accepts(other):
+        # else, the operators return NotImplemented, so that e.g. `LazyWeights.__rsub__` gets `x - lazy`
+        return isinstance(other, dict) or isinstance(other, Weights) or isinstance(other, Number)
+
+    def _operand(self, other):
+        if isinstance(other, dict) or isinstance(other, Weights):
+            for key in self.keys():
+                if key not in other.keys():
+                    raise KeyError("'{}' is not in a argument.".format(key))
+            return lambda key: other[key].data
+        elif isinstance(other, Number):
+            return lambda key: other
+        raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
+
+    def _binary(self, op, other, out=None):
+        y = self._operand(other)
+
+        if out is None:
+            res = dict()
+            for key, value in self.items():
+                res[key] = getattr(value, op)(y(key))
+            return Weights(res)
+
+        fn = getattr(torch, op)
         for key, value in self.items():
-            res[key] = -1 * value.data
-        return Weights(res)
+            fn(value.detach(), y(key), out=out[key].detach())
+        return out if isinstance(out, Weights) else Weights(out)
+
+    def _binary_(self, op, other):
+        y = self._operand(other)
+        for key, value in self.items():
+            getattr(value.detach(), op + '_')(y(key))
+        return self
+
+    def _unary(self, op, out=None):
+        if out is None:
+            res = dict()
+            for key, value in self.items():
+                res[key] = getattr(value, op)()
+            return Weights(res)
+
+        fn = getattr(torch, op)
+        for key, value in self.items():
+            fn(value.detach(), out=out[key].detach())
+        return out if isinstance(out, Weights) else Weights(out)
+
+    def _unary_(self, op):
+        for key, value in self.items():
+            getattr(value.detach(), op + '_')()
+        return self
+
+    # -x
+    def neg(self, out=None):
+        return self._unary('neg', out)
 
     def neg_(self):
-        self.params = self.neg()
+        return self._unary_('neg')
 
     def __neg__(self):
         return self.neg()
@@ -79,197 +135,145 @@ class Weights():
     # x + (y: dict or Weights)
     # or
     # x + (y: Number)
-    def add(self, other):
-        res = dict()
-
-        if isinstance(other, dict) or isinstance(other, Weights):
-            for key, value in self.items():
-                if key not in other.keys():
-                    raise KeyError("'{}' is not in a argument.".format(key))
-                res[key] = value.add(other[key].data)
-        elif isinstance(other, Number):
-            s = Variable(torch.Tensor([other]).double())
-            for key, value in self.items():
-                res[key] = value.add(s.expand(value.size()))
-        else:
-            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
-
-        return Weights(res)
+    def add(self, other, out=None):
+        return self._binary('add', other, out)
 
     def add_(self, other):
-        self.params = self.add(other)
+        return self._binary_('add', other)
 
     def __add__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return self.add(other)
 
-    # x - y
-    def sub(self, other):
-        # return self.add(-other)
-        res = dict()
-
-        if isinstance(other, dict) or isinstance(other, Weights):
-            for key, value in self.items():
-                if key not in other.keys():
-                    raise KeyError("'{}' is not in a argument.".format(key))
-                res[key] = value.sub(other[key].data)
-        elif isinstance(other, Number):
-            s = Variable(torch.Tensor([other]).double())
-            for key, value in self.items():
-                res[key] = value.sub(s.expand(value.size()))
-        else:
-            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
+    def __iadd__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
+        return self.add_(other)
 
-        return Weights(res)
+    # x - y
+    def sub(self, other, out=None):
+        return self._binary('sub', other, out)
 
     def sub_(self, other):
-        self.params = self.sub(other)
+        return self._binary_('sub', other)
 
     def __sub__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return self.sub(other)
 
+    def __isub__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
+        return self.sub_(other)
+
     # x * (y: dict or Weights): Hadamard product
     # or
     # x * (y: Number): scalar multiplication
-    def mul(self, other):
-        res = dict()
-
-        if isinstance(other, dict) or isinstance(other, Weights):
-            for key, value in self.items():
-                if key not in other.keys():
-                    raise KeyError("'{}' is not in a argument.".format(key))
-                res[key] = value.mul(other[key].data)
-        elif isinstance(other, Number):
-            s = Variable(torch.Tensor([other]).double())
-            for key, value in self.items():
-                res[key] = value.mul(s.expand(value.size()))
-        else:
-            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
-
-        return Weights(res)
+    def mul(self, other, out=None):
+        return self._binary('mul', other, out)
 
     def mul_(self, other):
-        self.params = self.mul(other)
+        return self._binary_('mul', other)
 
     def __mul__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return self.mul(other)
 
+    def __imul__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
+        return self.mul_(other)
+
     # x / (y: dict or Weights): inverse of Hadamard product
     # or
     # x / (y: Number): inverse of scalar multiplication
-    def div(self, other):
-        res = dict()
-
-        if isinstance(other, dict) or isinstance(other, Weights):
-            for key, value in self.items():
-                if key not in other.keys():
-                    raise KeyError("'{}' is not in a argument.".format(key))
-                res[key] = value.div(other[key].data)
-        elif isinstance(other, Number):
-            s = Variable(torch.Tensor([other]).double())
-            for key, value in self.items():
-                res[key] = value.div(s.expand(value.size()))
-        else:
-            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
-
-        return Weights(res)
+    def div(self, other, out=None):
+        return self._binary('div', other, out)
 
     def div_(self, other):
-        self.params = self.div(other)
+        return self._binary_('div', other)
 
     def __truediv__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return self.div(other)
 
+    def __itruediv__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
+        return self.div_(other)
+
     # x // (y: dict or Weights): element-wise floor_divide
     # or
     # x // (y: Number): floor_divide with scalar
-    def floor_divide(self, other):
-        res = dict()
-
-        if isinstance(other, dict) or isinstance(other, Weights):
-            for key, value in self.items():
-                if key not in other.keys():
-                    raise KeyError("'{}' is not in a argument.".format(key))
-                res[key] = value.floor_divide(other[key].data)
-        elif isinstance(other, Number):
-            s = Variable(torch.Tensor([other]).double())
-            for key, value in self.items():
-                res[key] = value.floor_divide(s.expand(value.size()))
-        else:
-            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
-
-        return Weights(res)
+    def floor_divide(self, other, out=None):
+        return self._binary('floor_divide', other, out)
 
     def floor_divide_(self, other):
-        self.params = self.floor_divide(other)
+        return self._binary_('floor_divide', other)
 
     def __floordiv__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return self.floor_divide(other)
 
     # x % (y: dict or Weights): element-wise mod operator
     # or
     # x % (y: Number): mod operator with scalar
-    def remainder(self, other):
-        res = dict()
-
-        if isinstance(other, dict) or isinstance(other, Weights):
-            for key, value in self.items():
-                if key not in other.keys():
-                    raise KeyError("'{}' is not in a argument.".format(key))
-                res[key] = value.remainder(other[key].data)
-        elif isinstance(other, Number):
-            s = Variable(torch.Tensor([other]).double())
-            for key, value in self.items():
-                res[key] = value.remainder(s.expand(value.size()))
-        else:
-            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
-
-        return Weights(res)
+    def remainder(self, other, out=None):
+        return self._binary('remainder', other, out)
 
     def remainder_(self, other):
-        self.params = self.remainder(other)
+        return self._binary_('remainder', other)
 
     def __mod__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return self.remainder(other)
 
     # divmod()
     def __divmod__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return (self.div(other), self.remainder(other))
 
     # x ** (y: dict or Weights): element-wise
     # or
     # x ** (y: Number): power of scalar
-    def pow(self, other):
-        res = dict()
-
-        if isinstance(other, dict) or isinstance(other, Weights):
-            for key, value in self.items():
-                if key not in other.keys():
-                    raise KeyError("'{}' is not in a argument.".format(key))
-                res[key] = value.pow(other[key].data)
-        elif isinstance(other, Number):
-            s = Variable(torch.Tensor([other]).double())
-            for key, value in self.items():
-                res[key] = value.pow(s.expand(value.size()))
-        else:
-            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
-
-        return Weights(res)
+    def pow(self, other, out=None):
+        return self._binary('pow', other, out)
 
     def pow_(self, other):
-        self.params = self.pow(other)
+        return self._binary_('pow', other)
 
     def __pow__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
         return self.pow(other)
 
-    # round()
-    def round(self):
-        res = dict()
+    def __ipow__(self, other):
+        if not self._accepts(other):
+            return NotImplemented
+        return self.pow_(other)
+
+    # x + alpha * y, e.g. a step of an iterative algorithm
+    def add_scaled_(self, other, alpha):
+        if not (isinstance(other, dict) or isinstance(other, Weights)):
+            raise TypeError("The argument must be `Weights (dict)` but {}.".format(type(other)))
+        y = self._operand(other)
         for key, value in self.items():
-            res[key] = value.round()
-        return Weights(res)
+            value.detach().add_(y(key), alpha=alpha)
+        return self
+
+    # round()
+    def round(self, out=None):
+        return self._unary('round', out)
 
     def round_(self):
-        self.params = self.round()
+        return self._unary_('round')
 
     def __round__(self):
         return self.round()
@@ -314,23 +318,49 @@ class Weights():
         return json.dumps(res)
 
     def hash(self):
-        return hashlib.sha256(str(self).encode()).hexdigest()
+        return hashlib.sha256(self.to_bytes()).hexdigest()
+
+    """wire format
+    # see `to_bytes`, `from_buffer`
+    """
+
+    def merkle(self):
+        # per-layer, see `merkle.MerkleTree`
+        from merkle import MerkleTree
+        return MerkleTree(self)
+
+    def nbytes(self, align=None):
+        return nbytes(self, align)
+
+    def to_bytes(self, align=None, out=None):
+        return to_bytes(self, align, out)
+
+    @staticmethod
+    def from_buffer(buffer, copy=False):
+        return from_buffer(buffer, copy)
 
     """copy
     # TBA
     """
 
     # copy
-    def _copy(self, other):
-        if not isinstance(other, Weights):
-            raise TypeError("The argument must be `Weight` but {}.".format(type(other)))
-        return other.params  # deepcopy
-
     def copy_(self, other):
-        self.params = self._copy(other)
+        # values of `other (Weights or dict)` into this one's tensors
+        y = self._operand(other)
+        if isinstance(other, Number):
+            raise TypeError("The argument must be `Weights (dict)` but {}.".format(type(other)))
+        for key, value in self.items():
+            value.detach().copy_(y(key))
+        return self
+
+    def clone(self):
+        res = dict()
+        for key, value in self.items():
+            res[key] = value.data.clone()
+        return Weights(res)
 
     """tensors
-    # TBA
+    # x.zeros() ...: new tensors like x's; x.zeros_() ...: in-place
     """
 
     # zeros
@@ -344,7 +374,9 @@ class Weights():
         return Weights(self._zeros())
 
     def zeros_(self):
-        self.params = self._zeros()
+        for value in self.values():
+            value.detach().zero_()
+        return self
 
     # ones
     def _ones(self):
@@ -357,7 +389,7 @@ class Weights():
         return Weights(self._ones())
 
     def ones_(self):
-        self.params = self._ones()
+        return self.fill_(1)
 
     # fill and full
     def _pack(self, value):
@@ -367,7 +399,9 @@ class Weights():
         return res
 
     def fill_(self, value):
-        self.params = self._pack(value)
+        for elem in self.values():
+            elem.detach().fill_(value)
+        return self
 
     def full(self, value):
         return Weights(self._pack(value))
@@ -380,7 +414,7 @@ class Weights():
         return res
 
     def empty_(self):
-        self.params = self._empty()
+        return self  # its tensors are already allocated
 
     def empty(self):
         return Weights(self._empty())
@@ -396,7 +430,9 @@ class Weights():
         return res
 
     def rand_(self):
-        self.params = self._rand()
+        for value in self.values():
+            value.detach().uniform_()
+        return self
 
     def rand(self):
         return Weights(self._rand())
@@ -408,13 +444,17 @@ class Weights():
         return res
 
     def randn_(self):
-        self.params = self._randn()
+        for value in self.values():
+            value.detach().normal_()
+        return self
 
     def randn(self):
         return Weights(self._randn())
 
     def randint_(self, high):
-        self.params = self._randint(high)
+        for value in self.values():
+            value.detach().random_(0, high)
+        return self
 
     def _randint(self, high):
         res = dict()
@@ -425,6 +465,13 @@ class Weights():
     def randint(self, high):
         return Weights(self._randint(high))
 
+    """lazy
+    # see `LazyWeights`
+    """
+
+    def lazy(self):
+        return LazyWeights('leaf', self)
+
     """TODO
     # type
     # cat
@@ -432,13 +479,346 @@ class Weights():
     """
 
 
-"""distance
+"""lazy
 # TBA
 """
 
+CHUNK = 1 << 20  # elements per chunk
+
+
+class LazyWeights():
+    """Expression over `Weights`, evaluated only when reduced or `eval`-ed
+
+    # e.g. (w1.lazy() - w2) ** 2, Frobenius(FilterNorm(w1.lazy()), w2)
+    # Evaluation goes parameter by parameter and, within one, chunk by chunk (`CHUNK` elements):
+    # the whole tree is applied to a chunk before the next, and intermediate chunks are reused
+    # in place, so no model-sized temporary is made; `eval` allocates only its result.
+    """
+
+    _BINARY = ('add', 'sub', 'mul', 'div', 'floor_divide', 'remainder', 'pow')
+    _REVERSED = {'rdiv': 'div', 'rfloor_divide': 'floor_divide', 'rremainder': 'remainder', 'rpow': 'pow'}
+
+    def __init__(self, op, *args):
+        # op: 'leaf' (args: weights), a unary/binary op (args: operands), or
+        # 'scale' (args: expression, {key: Number})
+        self.op = op
+        self.args = args
+        if op == 'leaf':
+            self._keys = list(args[0].keys())
+        else:
+            self._keys = args[0]._keys
+
+    def keys(self):
+        return list(self._keys)
+
+    def lazy(self):
+        return self
+
+    """build
+    # TBA
+    """
+
+    def _wrap(self, other):
+        if isinstance(other, LazyWeights):
+            expr = other
+        elif isinstance(other, dict) or isinstance(other, Weights):
+            expr = LazyWeights('leaf', other)
+        elif isinstance(other, Number):
+            return other
+        else:
+            raise TypeError("The argument must be `Weights (dict)` or `Number` but {}.".format(type(other)))
+
+        for key in self._keys:
+            if key not in expr._keys:
+                raise KeyError("'{}' is not in a argument.".format(key))
+        return expr
+
+    def _binary(self, op, other):
+        return LazyWeights(op, self, self._wrap(other))
+
+    def __add__(self, other):
+        return self._binary('add', other)
+
+    def __radd__(self, other):
+        return self._binary('add', other)
+
+    def __sub__(self, other):
+        return self._binary('sub', other)
+
+    def __rsub__(self, other):  # y - x = -x + y
+        return (-self)._binary('add', other)
+
+    def __mul__(self, other):
+        return self._binary('mul', other)
+
+    def __rmul__(self, other):
+        return self._binary('mul', other)
+
+    def __truediv__(self, other):
+        return self._binary('div', other)
+
+    def __rtruediv__(self, other):  # y / x, evaluated as such (see `_REVERSED`)
+        return self._binary('rdiv', other)
+
+    def __floordiv__(self, other):
+        return self._binary('floor_divide', other)
+
+    def __rfloordiv__(self, other):
+        return self._binary('rfloor_divide', other)
+
+    def __mod__(self, other):
+        return self._binary('remainder', other)
 
-def FilterNorm(weights):
+    def __rmod__(self, other):
+        return self._binary('rremainder', other)
+
+    def __pow__(self, other):
+        return self._binary('pow', other)
+
+    def __rpow__(self, other):
+        return self._binary('rpow', other)
+
+    def __neg__(self):
+        return LazyWeights('neg', self)
+
+    def scale(self, factors):
+        # per-parameter scalars, {key: Number}
+        return LazyWeights('scale', self, factors)
+
+    """evaluate
+    # TBA
+    """
+
+    def _leaves(self, key, flats):
+        # flattened tensor of every leaf, once per parameter
+        if self.op == 'leaf':
+            if id(self) not in flats:
+                flats[id(self)] = self.args[0][key].data.reshape(-1)
+            return
+        for arg in self.args:
+            if isinstance(arg, LazyWeights):
+                arg._leaves(key, flats)
+
+    def _chunk(self, key, flats, s, e):
+        # -> (tensor, owned): owned tensors are temporaries which may be overwritten
+        if self.op == 'leaf':
+            return flats[id(self)][s:e], False
+
+        a, a_owned = self.args[0]._chunk(key, flats, s, e)
+        if self.op == 'neg':
+            return (a.neg_(), True) if a_owned else (a.neg(), True)
+
+        if self.op == 'scale':
+            b, b_owned = self.args[1][key], False
+            op = 'mul'
+        else:
+            b = self.args[1]
+            b_owned = False
+            if isinstance(b, LazyWeights):
+                b, b_owned = b._chunk(key, flats, s, e)
+            op = self.op
+
+        if op in self._REVERSED:  # other op self
+            op, a, b, a_owned, b_owned = self._REVERSED[op], b, a, b_owned, a_owned
+            if isinstance(a, Number):  # 0-dim, promoted as a scalar; torch has no (Number, Tensor, out=)
+                a = torch.tensor(a, device=b.device)
+
+        # a temporary is reused only if it holds the result dtype, e.g. not (int + 1) / 3
+        fn = getattr(torch, op)
+        dtype = torch.result_type(a, b)
+        if (op == 'div') and not (dtype.is_floating_point or dtype.is_complex):  # true division
+            dtype = torch.get_default_dtype()
+        if a_owned and (a.dtype == dtype):
+            return fn(a, b, out=a), True
+        if b_owned and (b.dtype == dtype):
+            return fn(a, b, out=b), True
+        return fn(a, b), True
+
+    def _chunks(self, key, chunk=None):
+        # -> (start, end, tensor, owned) per chunk of parameter `key`
+        chunk = chunk or CHUNK
+        flats = dict()
+        self._leaves(key, flats)
+        numel = next(iter(flats.values())).numel()
+        for s in range(0, numel, chunk):
+            e = min(s + chunk, numel)
+            yield (s, e) + self._chunk(key, flats, s, e)
+
+    def _shape(self, key):
+        expr = self
+        while expr.op != 'leaf':
+            expr = expr.args[0]
+        return expr.args[0][key].size()
+
+    def eval(self, out=None, chunk=None):
+        # -> `Weights`; out: `Weights (dict)` to write into
+        res = dict()
+        for key in self._keys:
+            dst = None if out is None else out[key].detach()
+            flat = dst if (dst is not None) and dst.is_contiguous() else None  # else, e.g. channels-last
+            for s, e, value, _ in self._chunks(key, chunk):
+                if flat is None:  # of the result dtype, known from the first chunk
+                    flat = torch.empty(self._shape(key), dtype=value.dtype, device=value.device)
+                flat.view(-1)[s:e].copy_(value)
+            if dst is None:
+                dst = flat
+            elif flat is not dst:
+                dst.copy_(flat)
+            res[key] = dst
+
+        if out is not None:
+            return out if isinstance(out, Weights) else Weights(out)
+        return Weights(res)
+
+    def to_dict(self):
+        return self.eval().to_dict()
+
+    def items(self):
+        return self.eval().items()
+
+    """reduce
+    # float64 accumulation
+    """
+
+    def sum(self, chunk=None):
+        total = 0.
+        for key in self._keys:
+            for _, _, value, _ in self._chunks(key, chunk):
+                total += torch.sum(value, dtype=torch.float64).item()
+        return total
+
+    def sqsums(self, chunk=None):
+        # sum of squares, per parameter
+        res = dict()
+        for key in self._keys:
+            total = 0.
+            for _, _, value, owned in self._chunks(key, chunk):
+                square = value.mul_(value) if owned else value * value
+                total += torch.sum(square, dtype=torch.float64).item()
+            res[key] = total
+        return res
+
+    def sqsum(self, chunk=None):
+        return sum(self.sqsums(chunk).values())
+
+
+"""wire format
+# b'DDLW' | u32 version | u64 header length | header | buffers
+# header: JSON {'align': A, 'entries': [[name, shape, dtype, offset, nbytes], ...]}, offsets from the start;
+# every buffer starts at a multiple of A (64: cache lines, and any dtype's alignment) from the start,
+# so the tensors are aligned if the buffer is (e.g. mmap, `out=` pages); raw and contiguous
+# `from_buffer` returns tensors over the buffer itself: no copy, alive as long as the buffer is
+"""
+
+MAGIC = b'DDLW'
+WIRE_VERSION = 1
+ALIGN = 64
+
+_PREAMBLE = struct.Struct('<4sIQ')
+_FROMBUFFER = hasattr(torch, 'frombuffer')  # torch >= 1.10
+
+
+def _dtype_name(dtype):
+    return str(dtype).replace('torch.', '')
+
+
+def _align(n, align):
+    return (n + align - 1) // align * align
+
+
+def _header(weights, align):
+    # -> (header bytes, entries, total size)
+    entries = []
+    for name, value in weights.items():
+        entries.append([name, list(value.size()), _dtype_name(value.dtype), 0, value.numel() * value.element_size()])
+
+    # offsets depend on the header's length, which depends on the offsets' digits: fix point
+    start = 0
+    while True:
+        offset = start
+        for entry in entries:
+            entry[3] = offset
+            offset = _align(offset + entry[4], align)
+        header = json.dumps({'align': align, 'entries': entries}, separators=(',', ':')).encode()
+        needed = _align(_PREAMBLE.size + len(header), align)
+        if needed <= start:
+            return header, entries, max(offset, start)
+        start = needed
+
+
+def nbytes(weights, align=None):
+    # size of `to_bytes(weights)`, without serializing
+    return _header(weights, align or ALIGN)[2]
+
+
+def _raw(value):
+    # contiguous CPU bytes of a tensor, as a flat uint8 array (no copy if already so)
+    value = value.detach().cpu().contiguous()
+    if value.dtype == torch.bfloat16:  # no numpy counterpart
+        value = value.view(torch.int16)
+    return value.numpy().reshape(-1).view(np.uint8)
+
+
+def to_bytes(weights, align=None, out=None):
+    # weights: `Weights (dict)` -> bytearray, or written into `out` (writable, at least `nbytes` long)
+    align = align or ALIGN
+    header, entries, size = _header(weights, align)
+
+    buf = bytearray(size) if out is None else memoryview(out).cast('B')[:size]
+    _PREAMBLE.pack_into(buf, 0, MAGIC, WIRE_VERSION, len(header))
+    buf[_PREAMBLE.size:_PREAMBLE.size + len(header)] = header
+
+    dst = np.frombuffer(buf, dtype=np.uint8)
+    for (name, _, _, offset, n), value in zip(entries, weights.values()):
+        if n:
+            dst[offset:offset + n] = _raw(value)
+    return buf if out is None else out
+
+
+def from_buffer(buffer, copy=False):
+    # buffer: bytes-like (bytes, bytearray, mmap, memoryview) of `to_bytes`
+    # copy: own the memory instead of aliasing `buffer` (e.g. to write to a read-only buffer's tensors)
+    mv = memoryview(buffer).cast('B')
+    magic, version, length = _PREAMBLE.unpack_from(mv, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a weights buffer: {}.".format(bytes(magic)))
+    if version != WIRE_VERSION:
+        raise ValueError("Unsupported version: {}.".format(version))
+    header = json.loads(bytes(mv[_PREAMBLE.size:_PREAMBLE.size + length]).decode())
+
+    res = dict()
+    with warnings.catch_warnings():  # read-only buffers: the tensors are read-only too
+        warnings.simplefilter('ignore', UserWarning)
+        for name, shape, dtype, offset, n in header['entries']:
+            dtype = getattr(torch, dtype)
+            count = n // torch.empty((), dtype=dtype).element_size()
+            if n == 0:
+                value = torch.empty(shape, dtype=dtype)
+            elif _FROMBUFFER:
+                value = torch.frombuffer(mv, dtype=dtype, count=count, offset=offset)
+            elif dtype == torch.bfloat16:
+                raise TypeError("bfloat16 needs torch.frombuffer (torch >= 1.10).")
+            else:
+                value = torch.from_numpy(np.frombuffer(mv, dtype=_dtype_name(dtype), count=count, offset=offset))
+            value = value.view(shape)
+            res[name] = value.clone() if copy else value
+    return Weights(res)
+
+
+"""distance
+# `LazyWeights` in: fused, chunked
+"""
+
+
+def FilterNorm(weights, lazy=False):
     # Filter-wise Normalization
+    # lazy (or `LazyWeights` in): returns `LazyWeights`, each parameter scaled, nothing materialized
+
+    if lazy or isinstance(weights, LazyWeights):
+        expr = weights if isinstance(weights, LazyWeights) else LazyWeights('leaf', weights)
+        sqsums = expr.sqsums()
+        theta = math.sqrt(sum(sqsums.values()))
+        return expr.scale({key: theta / (math.sqrt(sq) + 1e-10) for key, sq in sqsums.items()})
 
     theta = Frobenius(weights)
 
@@ -456,12 +836,17 @@ def FilterNorm(weights):
 
 def Frobenius(weights, base_weights=None):
     # Frobenius Norm.
-    base_weights = base_weights or weights.zeros()
-    square = ((weights - base_weights) ** 2)
+    # per tensor: one difference (none without a base), squares summed in float64
+    if isinstance(weights, LazyWeights) or isinstance(base_weights, LazyWeights):
+        expr = weights if isinstance(weights, LazyWeights) else LazyWeights('leaf', weights)
+        if base_weights is not None:
+            expr = expr - base_weights
+        return math.sqrt(expr.sqsum())
 
     total = 0.
-    for key, value in square.items():
-        total += torch.sum(value).item()
+    for key, value in weights.items():
+        diff = value.data if base_weights is None else value.data - base_weights[key].data
+        total += torch.sum(diff * diff, dtype=torch.float64).item()
 
     return math.sqrt(total)
 
@@ -483,3 +868,4 @@ if __name__ == "__main__":
     print(Frobenius(FilterNorm(w1)))
     print(Frobenius(w1, w2))
     print(Frobenius(w1, w1))
+    print(Frobenius(FilterNorm(w1.lazy()), w2))  # fused, no model-sized temporaries